@@ -169,8 +169,11 @@ X.loader.prototype.checkFileFormat = function(container) {
 
   }
 
-  return [filepath, extension, X.loader.extensions[extension][0],
-          X.loader.extensions[extension][1], X.loader.extensions[extension][2]];
+  // the parser is null if it is part of a module which was not loaded yet
+  var parser = goog.getObjectByName(X.loader.extensions[extension][0]);
+
+  return [filepath, extension, parser, X.loader.extensions[extension][1],
+          X.loader.extensions[extension][2]];
 
 };
 
@@ -206,7 +209,33 @@ X.loader.prototype.load = function(container, object) {
 
   // check the file format which returns the filepath, extension and the parser
   var _checkresult = this.checkFileFormat(container);
-  var filepath = _checkresult[0];
+
+  if (!_checkresult[2]) {
+
+    // the parser is part of a module of a split build which was not loaded
+    // yet, so we load it first and continue afterwards
+    this.loadModule(_checkresult[1], this.fetch.bind(this, container, object),
+        this.failed.bind(this, null, container, object));
+    return;
+
+  }
+
+  this.fetch(container, object);
+
+};
+
+
+/**
+ * Download the file associated to a container via Ajax or parse the attached
+ * file data right away.
+ *
+ * @param {!X.base} container The container which has a X.file() attached.
+ * @param {!X.object} object The X.object which is the parent of the container
+ *          or equals it.
+ */
+X.loader.prototype.fetch = function(container, object) {
+
+  var filepath = container._file._path;
 
   if (container._filedata != null) {
 
@@ -244,6 +273,153 @@ X.loader.prototype.load = function(container, object) {
 };
 
 
+/**
+ * Load the module of a split build which contains the parser for a file
+ * extension. The modules are listed in the XTK_MODULES manifest which is
+ * attached to the core of a split build. Required modules are loaded first.
+ *
+ * @param {!string} extension The file extension in uppercase.
+ * @param {!Function} callback The callback to execute after loading.
+ * @param {!Function} errback The callback to execute if the module or one of
+ *          its required modules could not be loaded.
+ * @throws {Error} An error, if no module contains the parser.
+ */
+X.loader.prototype.loadModule = function(extension, callback, errback) {
+
+  var manifest = goog.global['XTK_MODULES'];
+
+  if (!manifest || !(extension in manifest['extensions'])) {
+
+    throw new Error('The parser for the ' + extension +
+        ' file format is not available.');
+
+  }
+
+  this.loadModuleByName_(manifest, manifest['extensions'][extension], callback,
+      errback);
+
+};
+
+
+/**
+ * Load a module of a split build and all its required modules.
+ *
+ * @param {!Object} manifest The XTK_MODULES manifest.
+ * @param {!string} name The module name.
+ * @param {!Function} callback The callback to execute after loading.
+ * @param {!Function} errback The callback to execute if loading failed.
+ * @private
+ */
+X.loader.prototype.loadModuleByName_ = function(manifest, name, callback,
+    errback) {
+
+  var state = X.loader.modules_[name];
+
+  if (state === true) {
+
+    // already loaded
+    callback();
+    return;
+
+  } else if (state) {
+
+    // currently loading
+    state.push([callback, errback]);
+    return;
+
+  }
+
+  X.loader.modules_[name] = [[callback, errback]];
+
+  var module = manifest['modules'][name];
+  var requires = module['requires'].slice();
+
+  // call the callbacks or the errbacks of all pending loads of this module
+  var done = function(success) {
+
+    var pending = X.loader.modules_[name];
+
+    // a failed module can be requested again
+    if (success) {
+      X.loader.modules_[name] = true;
+    } else {
+      delete X.loader.modules_[name];
+    }
+
+    var error = null;
+
+    for (var i = 0; i < pending.length; i++) {
+
+      // every pending load has to be notified, even if one throws
+      try {
+        pending[i][success ? 0 : 1]();
+      } catch (e) {
+        error = error || e;
+      }
+
+    }
+
+    if (error) {
+      throw error;
+    }
+
+  };
+
+  var next = function() {
+
+    if (requires.length > 0) {
+
+      // load the required modules one after another
+      this.loadModuleByName_(manifest, requires.shift(), next, function() {
+
+        // without its requirements this module is useless
+        done(false);
+
+      });
+      return;
+
+    }
+
+    var script = document.createElement('script');
+    script.setAttribute('type', 'text/javascript');
+    script.setAttribute('src', manifest['path'] + module['file']);
+
+    // only one of the two fires, the other listener is removed
+    var onload = goog.events.listenOnce(script, 'load', function() {
+
+      goog.events.unlistenByKey(onerror);
+      done(true);
+
+    });
+
+    var onerror = goog.events.listenOnce(script, 'error', function() {
+
+      goog.events.unlistenByKey(onload);
+      script.parentNode.removeChild(script);
+      done(false);
+
+    });
+
+    document.getElementsByTagName('head')[0].appendChild(script);
+
+  }.bind(this);
+
+  next();
+
+};
+
+
+/**
+ * The state of the modules of a split build. TRUE for loaded modules or an
+ * array of pending [callback, errback] pairs for modules which are currently
+ * loading. Modules which failed to load have no state.
+ *
+ * @type {!Object}
+ * @private
+ */
+X.loader.modules_ = {};
+
+
 /**
  * Trigger parsing of a data stream. This is the callback for successful
  * downloading. A single-shot listener is configured for a X.event.ModifiedEvent
@@ -337,7 +513,8 @@ X.loader.prototype.complete = function(event) {
  * The failure callback which gets executed if anything goes wrong during
  * downloading. It always throws an error.
  *
- * @param {!XMLHttpRequest} request The original XHR.
+ * @param {?XMLHttpRequest} request The original XHR or NULL if the module
+ *          containing the parser could not be loaded.
  * @param {!X.base} container The container which has a X.file() attached.
  * @param {!X.object} object The X.object which is the parent of the container
  *          or equals it.
@@ -351,45 +528,46 @@ X.loader.prototype.failed = function(request, container, object) {
 
 
 /**
- * Supported data types by extension.
+ * Supported data types by extension. The parsers are referenced by their
+ * exported names so they can live in separately loaded modules.
  *
  * @enum {Array}
  */
 X.loader.extensions = {
   // support for the following extensions and the mapping to X.parsers as well
   // as some custom flags and the result type
-  'OBJ': [X.parserOBJ, null],
-  'OFF': [X.parserOFF, null],
-  'STL': [X.parserSTL, null],
-  'VTK': [X.parserVTK, null],
-  'TRK': [X.parserTRK, null],
-  'MRC': [X.parserMRC, null],
-  'ST': [X.parserMRC, null],
+  'OBJ': ['X.parserOBJ', null],
+  'OFF': ['X.parserOFF', null],
+  'STL': ['X.parserSTL', null],
+  'VTK': ['X.parserVTK', null],
+  'TRK': ['X.parserTRK', null],
+  'MRC': ['X.parserMRC', null],
+  'ST': ['X.parserMRC', null],
   // FSM, INFLATED, SMOOTHWM, SPHERE, PIAL and ORIG are all freesurfer meshes
-  'FSM': [X.parserFSM, null],
-  'INFLATED': [X.parserFSM, null],
-  'SMOOTHWM': [X.parserFSM, null],
-  'SPHERE': [X.parserFSM, null],
-  'PIAL': [X.parserFSM, null],
-  'ORIG': [X.parserFSM, null],
-  'NRRD': [X.parserNRRD, null],
-  'NII': [X.parserNII, null],
-  'GZ': [X.parserNII, null], // right now nii.gz is the only
+  'FSM': ['X.parserFSM', null],
+  'INFLATED': ['X.parserFSM', null],
+  'SMOOTHWM': ['X.parserFSM', null],
+  'SPHERE': ['X.parserFSM', null],
+  'PIAL': ['X.parserFSM', null],
+  'ORIG': ['X.parserFSM', null],
+  'NRRD': ['X.parserNRRD', null],
+  'NII': ['X.parserNII', null],
+  'GZ': ['X.parserNII', null], // right now nii.gz is the only
   // format ending .gz
-  'DCM': [X.parserDCM, null],
-  'DICOM': [X.parserDCM, null],
-  '': [X.parserDCM, null],
-  'CRV': [X.parserCRV, null],
-  'LABEL': [X.parserLBL, null],
-  'MGH': [X.parserMGZ, false],
-  'MGZ': [X.parserMGZ, true],
-  'RAW': [X.parserRAW, false],
-  'RZ': [X.parserRAW, true],
-  'TXT': [X.parserLUT, null],
-  'LUT': [X.parserLUT, null],
-  'PNG': [X.parserIMAGE, 'png'], // here we use the arraybuffer
+  'DCM': ['X.parserDCM', null],
+  'DICOM': ['X.parserDCM', null],
+  '': ['X.parserDCM', null],
+  'CRV': ['X.parserCRV', null],
+  'LABEL': ['X.parserLBL', null],
+  'MGH': ['X.parserMGZ', false],
+  'MGZ': ['X.parserMGZ', true],
+  'RAW': ['X.parserRAW', false],
+  'RZ': ['X.parserRAW', true],
+  'TXT': ['X.parserLUT', null],
+  'LUT': ['X.parserLUT', null],
+  'PNG': ['X.parserIMAGE', 'png'], // here we use the arraybuffer
   // response type
-  'JPG': [X.parserIMAGE, 'jpeg'],
-  'JPEG': [X.parserIMAGE, 'jpeg'],
-  'GIF': [X.parserIMAGE, 'gif']
+  'JPG': ['X.parserIMAGE', 'jpeg'],
+  'JPEG': ['X.parserIMAGE', 'jpeg'],
+  'GIF': ['X.parserIMAGE', 'gif']
 };
@@ -173,6 +173,7 @@ try: # See :pyver:old
 except:
     pass
 import math
+import mmap
 # http://www.python.org/doc/2.4.4/lib/module-operator.html
 import operator
 import struct
@@ -180,9 +181,15 @@ import sys
 import zlib
 # http://www.python.org/doc/2.4.4/lib/module-warnings.html
 import warnings
+# NumPy is optional.  When it can be imported, scanlines are unfiltered
+# with it, see :meth:`Reader.undo_filter_numpy`.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
-__all__ = ['Reader', 'Writer', 'write_chunks']
+__all__ = ['Reader', 'MappedReader', 'Writer', 'write_chunks']
 
 
 # The PNG signature.
@@ -319,7 +326,8 @@ class Writer:
                  planes=None,
                  colormap=None,
                  maxval=None,
-                 chunk_limit=2**20):
+                 chunk_limit=2**20,
+                 filter_type=0):
         """
         Create a PNG encoder object.
 
@@ -349,6 +357,8 @@ class Writer:
           Create an interlaced image.
         chunk_limit
           Write multiple ``IDAT`` chunks to save memory.
+        filter_type
+          Scanline filter: 0 to 4, ``'adaptive'`` or ``'brute'``.
 
         The image size (in pixels) can be specified either by using the
         `width` and `height` arguments, or with the single `size`
@@ -435,6 +445,20 @@ class Writer:
         `chunk_limit` is used to limit the amount of memory used whilst
         compressing the image.  In order to avoid using large amounts of
         memory, multiple ``IDAT`` chunks may be created.
+
+        `filter_type` selects the filter applied to each scanline
+        before compression (see
+        http://www.w3.org/TR/PNG/#9Filters ).  An integer from 0 to 4
+        uses that filter for every scanline; the default, 0, means no
+        filtering.  ``'adaptive'`` picks a filter for each scanline
+        using the minimum sum of absolute differences heuristic
+        recommended by the PNG specification; as recommended there,
+        colour mapped images and images with bit depths less than 8 are
+        not filtered in this mode.  ``'brute'`` compresses each
+        scanline with every filter and keeps the smallest, which is
+        slow.  Filtering usually makes photographic and rendered images
+        considerably smaller.  When NumPy is available it is used to
+        filter whole scanlines at once.
         """
 
         # At the moment the `planes` argument is ignored;
@@ -580,6 +604,10 @@ class Writer:
         self.chunk_limit = chunk_limit
         self.interlace = bool(interlace)
         self.palette = check_palette(palette)
+        if filter_type not in (0,1,2,3,4,'adaptive','brute'):
+            raise ValueError("filter_type must be 0 to 4, "
+              "'adaptive' or 'brute'")
+        self.filter_type = filter_type
 
         self.color_type = 4*self.alpha + 2*(not greyscale) + 1*self.colormap
         assert self.color_type in (0,2,3,4,6)
@@ -739,7 +767,8 @@ class Writer:
                 l = map(lambda e: reduce(lambda x,y:
                                            (x << self.bitdepth) + y, e), l)
                 data.extend(l)
-        if self.rescale:
+        # Packed rows are final, there is nothing to rescale.
+        if self.rescale and not packed:
             oldextend = extend
             factor = \
               float(2**self.rescale[1]-1) / float(2**self.rescale[0]-1)
@@ -774,14 +803,23 @@ class Writer:
             del wrapmapint
             extend(row)
 
+        if self.filter_type:
+            # The filters refer to the previous scanline of the same
+            # pass, the first scanline of a pass has none.
+            firsts = self.pass_starts()
+            previous = self.filter_last(data, 0, None)
+
         for i,row in enumrows:
-            # Add "None" filter type.  Currently, it's essential that
-            # this filter type be used for every scanline as we do not
-            # mark the first row of a reduced pass image; that means we
-            # could accidentally compute the wrong filtered scanline if
-            # we used "up", "average", or "paeth" on such a line.
+            # Add "None" filter type.  When filtering, the scanline is
+            # filtered (and its filter type replaced) once it has been
+            # packed.
+            start = len(data)
             data.append(0)
             extend(row)
+            if self.filter_type:
+                if i in firsts:
+                    previous = None
+                previous = self.filter_last(data, start, previous)
             if len(data) > self.chunk_limit:
                 compressed = compressor.compress(tostring(data))
                 if len(compressed):
@@ -804,6 +842,86 @@ class Writer:
         write_chunk(outfile, 'IEND')
         return i+1
 
+    def pass_starts(self):
+        """Return the set of indexes of the scanlines which start a
+        pass, in the order the scanlines are written.  For a
+        straightlaced image this is just the first scanline.
+        """
+
+        if not self.interlace:
+            return set([0])
+        starts = set()
+        i = 0
+        for xstart, ystart, xstep, ystep in _adam7:
+            if xstart >= self.width:
+                continue
+            starts.add(i)
+            i += len(range(ystart, self.height, ystep))
+        return starts
+
+    def filter_last(self, data, start, previous):
+        """Filter the last scanline in the byte array `data`, which
+        starts with its filter type at index `start`.  `previous` is the
+        (unfiltered) previous scanline of the same pass, or ``None``.
+        The unfiltered scanline is returned.
+        """
+
+        line = data[start+1:]
+        del data[start:]
+        data.extend(self.filter_row(line, previous))
+        return line
+
+    def filter_row(self, line, previous):
+        """Filter a packed scanline as selected by the `filter_type`
+        argument.  Returns the filtered scanline, preceded by its filter
+        type, as an array of bytes.
+        """
+
+        # Filter unit, see :meth:`Reader.undo_filter`.
+        fu = max(1, (self.bitdepth * self.planes) // 8)
+        if self.filter_type in (1,2,3,4):
+            types = (self.filter_type,)
+        elif (self.filter_type == 'adaptive' and
+              (self.colormap or self.bitdepth < 8)):
+            types = (0,)
+        else:
+            types = (0,1,2,3,4)
+
+        if numpy is not None:
+            candidates = _filter_numpy(types, line, fu, previous)
+            if len(types) == 1:
+                best = 0
+            elif self.filter_type == 'adaptive':
+                # The filtered bytes are taken as signed.
+                sums = numpy.abs(candidates[:,1:].view(numpy.int8).astype(
+                  numpy.int32)).sum(axis=1)
+                best = int(sums.argmin())
+            else:
+                best = self.smallest(map(tostring, candidates))
+            return array('B', tostring(candidates[best]))
+
+        candidates = [filter_scanline(t, line, fu, previous) for t in types]
+        if len(types) == 1:
+            best = 0
+        elif self.filter_type == 'adaptive':
+            sums = [sum([min(x, 256-x) for x in c[1:]]) for c in candidates]
+            best = sums.index(min(sums))
+        else:
+            best = self.smallest(map(tostring, candidates))
+        return candidates[best]
+
+    def smallest(self, candidates):
+        """Return the index of the filtered scanline (a string) that
+        compresses best on its own.
+        """
+
+        if self.compression is not None:
+            sizes = [len(zlib.compress(c, self.compression))
+              for c in candidates]
+        else:
+            sizes = [len(zlib.compress(c)) for c in candidates]
+        return sizes.index(min(sizes))
+
     def write_array(self, outfile, pixels):
         """
         Write an array in flat row flat pixel format as a PNG file on
@@ -835,6 +953,76 @@ class Writer:
               self.rescale[0])
         return self.write_passes(outfile, rows, packed=True)
 
+    def write_ndarray(self, outfile, a):
+        """
+        Write a NumPy array as a PNG file to the output file.  `a`
+        should have the shape (*height*, *width*, *planes*), or
+        (*height*, *width*) when there is one plane, as returned by
+        :meth:`Reader.read_array`.  Its size and number of planes must
+        match the writer.
+
+        The values are rescaled, packed (or split into big-endian
+        bytes) and interlaced with whole array operations, then written
+        as packed rows.
+
+        Requires NumPy.
+        """
+
+        if numpy is None:
+            raise Error("write_ndarray requires NumPy.")
+
+        a = numpy.asarray(a)
+        if a.ndim == 2:
+            a = a.reshape(a.shape + (1,))
+        if a.shape != (self.height, self.width, self.planes):
+            raise ValueError("array has shape %s, expected %s" %
+              (a.shape, (self.height, self.width, self.planes)))
+        if self.rescale:
+            factor = \
+              float(2**self.rescale[1]-1) / float(2**self.rescale[0]-1)
+            # Rounds halves up like round() does for these values.
+            a = numpy.floor(a * factor + 0.5)
+
+        if self.interlace:
+            passes = [a[ystart::ystep,xstart::xstep]
+              for xstart, ystart, xstep, ystep in _adam7
+              if xstart < self.width and ystart < self.height]
+        else:
+            passes = [a]
+
+        def rows():
+            for pass_ in passes:
+                packed = self.pack_numpy(pass_)
+                n = packed.shape[1]
+                buf = packed.tostring()
+                for i in range(0, len(buf), n):
+                    yield array('B', buf[i:i+n])
+
+        return self.write_passes(outfile, rows(), packed=True)
+
+    def pack_numpy(self, a):
+        """Pack an array of pixel values of shape (*rows*, *width*,
+        *planes*) into bytes.  Returns a 2-dimensional ``numpy.uint8``
+        array with one row per scanline.
+        """
+
+        rows = a.shape[0]
+        if self.bitdepth == 16:
+            return a.astype('>u2').view(numpy.uint8).reshape(rows, -1)
+        values = a.astype(numpy.uint8).reshape(rows, -1)
+        if self.bitdepth == 8:
+            return values
+        # Samples per byte, the last byte of a row is padded.
+        spb = 8 // self.bitdepth
+        pad = -values.shape[1] % spb
+        if pad:
+            values = numpy.hstack((values,
+              numpy.zeros((rows, pad), dtype=numpy.uint8)))
+        shifts = numpy.arange(8-self.bitdepth, -1, -self.bitdepth,
+          dtype=numpy.uint8)
+        return (values.reshape(rows, -1, spb) << shifts).sum(axis=2,
+          dtype=numpy.uint8)
+
     def convert_pnm(self, infile, outfile):
         """
         Convert a PNM file containing raw pixel data into a PNG file
@@ -1035,7 +1223,7 @@ def filter_scanline(type, line, fo, prev=None):
         # "left" (non-trivial, but true). "average" needs to be handled
         # specially.
         if type == 2: # "up"
-            return line # type = 0
+            prev = [0]*len(line)
         elif type == 3:
             prev = [0]*len(line)
         elif type == 4: # "paeth"
@@ -1053,6 +1241,54 @@ def filter_scanline(type, line, fo, prev=None):
     return out
 
 
+def _filter_numpy(types, line, fo, prev=None):
+    """Apply each of the scanline filters in `types` to a scanline
+    using NumPy.  The arguments are as for :func:`filter_scanline`.
+    Returns a 2-dimensional ``numpy.uint8`` array with one filtered
+    scanline (starting with its filter type) per filter type.
+    """
+
+    def asint16(bytes):
+        if isarray(bytes) and bytes.typecode == 'B':
+            # No copy through Python objects.
+            return numpy.frombuffer(bytes, dtype=numpy.uint8).astype(
+              numpy.int16)
+        return numpy.array(bytes, dtype=numpy.int16)
+
+    x = asint16(line)
+    if prev:
+        b = asint16(prev)
+    else:
+        b = numpy.zeros(len(x), dtype=numpy.int16)
+    # The bytes to the left, off the scanline they are 0.
+    a = numpy.zeros(len(x), dtype=numpy.int16)
+    a[fo:] = x[:-fo]
+    c = numpy.zeros(len(x), dtype=numpy.int16)
+    c[fo:] = b[:-fo]
+
+    out = numpy.empty((len(types), len(x)+1), dtype=numpy.int16)
+    for i,type in enumerate(types):
+        out[i,0] = type
+        if type == 0:
+            out[i,1:] = x
+        elif type == 1:
+            out[i,1:] = x - a
+        elif type == 2:
+            out[i,1:] = x - b
+        elif type == 3:
+            out[i,1:] = x - ((a + b) >> 1)
+        else:
+            # http://www.w3.org/TR/PNG/#9Filter-type-4-Paeth
+            p = a + b - c
+            pa = numpy.abs(p - a)
+            pb = numpy.abs(p - b)
+            pc = numpy.abs(p - c)
+            pr = numpy.where((pa <= pb) & (pa <= pc), a,
+              numpy.where(pb <= pc, b, c))
+            out[i,1:] = x - pr
+    return (out & 0xff).astype(numpy.uint8)
+
+
 class _readable:
     """
     A simple file-like interface for strings and arrays.
@@ -1075,7 +1311,10 @@ class Reader:
     PNG decoder in pure Python.
     """
 
-    def __init__(self, _guess=None, **kw):
+    # The most bytes decompressed at once, see :meth:`iterdecomp`.
+    window = 2**16
+
+    def __init__(self, _guess=None, max_size=None, **kw):
         """
         Create a PNG decoder object.
 
@@ -1090,11 +1329,18 @@ class Reader:
         bytes
           ``array`` or ``string`` with PNG data.
 
+        In addition, `max_size` limits the size in bytes of the
+        decompressed image data (roughly the size of the decoded image);
+        the methods that decode the image raise :class:`FormatError` for
+        a larger image before decompressing anything.  The default,
+        ``None``, means no limit apart from the size of the image.
         """
         if ((_guess is not None and len(kw) != 0) or
             (_guess is None and len(kw) != 1)):
             raise TypeError("Reader() takes exactly 1 argument")
 
+        self.max_size = max_size
+
         # Will be the first 8 bytes, later on.  See validate_signature.
         self.signature = None
         self.transparent = None
@@ -1223,6 +1469,12 @@ class Reader:
         if not previous:
             previous = array('B', [0]*len(scanline))
 
+        if numpy is not None:
+            self.undo_filter_numpy(filter_type,
+              numpy.frombuffer(result, dtype=numpy.uint8),
+              numpy.frombuffer(previous, dtype=numpy.uint8), fu)
+            return result
+
         def sub():
             """Undo sub filter."""
 
@@ -1289,6 +1541,70 @@ class Reader:
         (None, sub, up, average, paeth)[filter_type]()
         return result
 
+    def undo_filter_numpy(self, filter_type, line, prior, fu):
+        """Undo the filter for a scanline using NumPy; used by
+        :meth:`undo_filter` when NumPy is available.  `line` is a
+        ``numpy.uint8`` array holding the filtered scanline and it is
+        reconstructed in place.  `prior` is the reconstructed previous
+        scanline (all zeroes for the first line of a pass) and `fu` is
+        the filter unit.
+
+        The output is exactly the same as that of the pure Python
+        code.  Sub and up are done for whole scanlines at once.
+        Average and Paeth are recurrences along the scanline: the parts
+        that do not depend on the reconstructed bytes are computed with
+        NumPy and the rest with a loop over lists, which is faster than
+        stepping NumPy through the scanline a pixel at a time.
+        """
+
+        # On the first line of a pass the previous line is all zeroes,
+        # so Paeth is the same as sub.
+        if filter_type == 4 and not prior.any():
+            filter_type = 1
+
+        if filter_type == 1:
+            # Each byte of a pixel is the running sum (modulo 256) of
+            # the same byte in the pixels to its left.
+            line[:] = numpy.cumsum(line.reshape(-1, fu), axis=0,
+              dtype=numpy.uint8).ravel()
+            return
+        if filter_type == 2:
+            line += prior
+            return
+
+        x = line.tolist()
+        b = prior.tolist()
+        n = len(x)
+        if filter_type == 3:
+            for i in range(fu):
+                x[i] = (x[i] + (b[i] >> 1)) & 0xff
+            for i in range(fu, n):
+                x[i] = (x[i] + ((x[i-fu] + b[i]) >> 1)) & 0xff
+        else:
+            # With p = a + b - c, pa = abs(p - a) = abs(b - c) does not
+            # depend on a, the reconstructed byte to the left.
+            prior = prior.astype(numpy.int16)
+            c = numpy.zeros(n, dtype=numpy.int16)
+            c[fu:] = prior[:-fu]
+            pa = numpy.abs(prior - c).tolist()
+            c = c.tolist()
+            for i in range(fu):
+                x[i] = (x[i] + b[i]) & 0xff
+            for i in range(fu, n):
+                a = x[i-fu]
+                bi = b[i]
+                ci = c[i]
+                pb = abs(a - ci)
+                pc = abs(a + bi - ci - ci)
+                if pa[i] <= pb and pa[i] <= pc:
+                    pr = a
+                elif pb <= pc:
+                    pr = bi
+                else:
+                    pr = ci
+                x[i] = (x[i] + pr) & 0xff
+        line[:] = x
+
     def deinterlace(self, raw):
         """
         Read raw pixel data, undo filters, deinterlace, and flatten.
@@ -1411,12 +1727,16 @@ class Reader:
         recon = None
         for some in raw:
             a.extend(some)
-            while len(a) >= rb + 1:
-                filter_type = a[0]
-                scanline = a[1:rb+1]
-                del a[:rb+1]
+            # Take all the complete rows, then remove them from the
+            # front of the buffer at once.
+            offset = 0
+            while len(a) - offset >= rb + 1:
+                filter_type = a[offset]
+                scanline = a[offset+1:offset+rb+1]
+                offset += rb + 1
                 recon = self.undo_filter(filter_type, scanline, recon)
                 yield recon
+            del a[:offset]
         if len(a) != 0:
             # :file:format We get here with a file format error: when the
             # available bytes (after decompressing) do not pack into exact
@@ -1602,56 +1922,23 @@ class Reader:
 
         May use excessive memory.
 
-        `pixels` are returned in boxed row flat pixel format.
+        `pixels` are returned in boxed row flat pixel format.  For a
+        straightlaced image, the pixels are decompressed and decoded
+        while the rows are iterated, so only a few rows are held in
+        memory at any time.
         """
 
-        def iteridat():
-            """Iterator that yields all the ``IDAT`` chunks as strings."""
-            while True:
-                try:
-                    type, data = self.chunk()
-                except ValueError, e:
-                    raise ChunkError(e.args[0])
-                if type == 'IEND':
-                    # http://www.w3.org/TR/PNG/#11IEND
-                    break
-                if type != 'IDAT':
-                    continue
-                # type == 'IDAT'
-                # http://www.w3.org/TR/PNG/#11IDAT
-                if self.colormap and not self.plte:
-                    warnings.warn("PLTE chunk is required before IDAT chunk")
-                yield data
-
-        def iterdecomp(idat):
-            """Iterator that yields decompressed strings.  `idat` should
-            be an iterator that yields the ``IDAT`` chunk data.
-            """
-
-            # Currently, with no max_length paramter to decompress, this
-            # routine will do one yield per IDAT chunk.  So not very
-            # incremental.
-            d = zlib.decompressobj()
-            # The decompression loop:
-            # Decompress an IDAT chunk, then decompress any remaining
-            # unused data until the unused data does not get any
-            # smaller.  Add the unused data to the front of the input
-            # and loop to process the next IDAT chunk.
-            cdata = ''
-            for data in idat:
-                # :todo: add a max_length argument here to limit output
-                # size.
-                yield array('B', d.decompress(cdata + data))
-            yield array('B', d.flush())
-
         self.preamble()
-        raw = iterdecomp(iteridat())
+        # Check the size now, the pixels are decoded lazily.
+        self.decompressed_size()
+        raw = self.iterdecomp(self.iteridat())
 
         if self.interlace:
-            raw = array('B', itertools.chain(*raw))
+            raw = array('B', ''.join(raw))
             pixels = group(self.deinterlace(raw), self.width*self.planes)
         else:
-            pixels = self.iterboxed(self.iterstraight(raw))
+            pixels = self.iterboxed(self.iterstraight(
+              itertools.imap(lambda data: array('B', data), raw)))
         meta = dict()
         for attr in 'greyscale alpha planes bitdepth interlace'.split():
             meta[attr] = getattr(self, attr)
@@ -1663,6 +1950,96 @@ class Reader:
         return self.width, self.height, pixels, meta
 
 
+    def iteridat(self):
+        """Iterator that yields the data of all the ``IDAT`` chunks."""
+
+        while True:
+            try:
+                type, data = self.chunk()
+            except ValueError, e:
+                raise ChunkError(e.args[0])
+            if type == 'IEND':
+                # http://www.w3.org/TR/PNG/#11IEND
+                break
+            if type != 'IDAT':
+                continue
+            # type == 'IDAT'
+            # http://www.w3.org/TR/PNG/#11IDAT
+            if self.colormap and not self.plte:
+                warnings.warn("PLTE chunk is required before IDAT chunk")
+            yield data
+
+    def decompressed_size(self):
+        """Return the size in bytes of the decompressed image data (the
+        filtered scanlines of all passes) that the header specifies.
+        Raises :class:`FormatError` if this is larger than the
+        `max_size` given to the constructor.
+        """
+
+        size = 0
+        for xstart, ystart, xstep, ystep, ppr, rows in self.passes():
+            size += (int(math.ceil(self.psize * ppr)) + 1) * rows
+        if self.max_size is not None and size > self.max_size:
+            raise FormatError("Image data of %d bytes exceeds the maximum"
+              " of %d bytes." % (size, self.max_size))
+        return size
+
+    def passes(self):
+        """Return a list of the passes of the image as (*xstart*,
+        *ystart*, *xstep*, *ystep*, *pixels per row*, *rows*) tuples.  A
+        straightlaced image has a single pass.
+        """
+
+        if not self.interlace:
+            return [(0, 0, 1, 1, self.width, self.height)]
+        passes = []
+        for xstart, ystart, xstep, ystep in _adam7:
+            if xstart >= self.width:
+                continue
+            ppr = int(math.ceil((self.width-xstart)/float(xstep)))
+            rows = max(0, (self.height - ystart + ystep - 1) // ystep)
+            passes.append((xstart, ystart, xstep, ystep, ppr, rows))
+        return passes
+
+    def iterdecomp(self, idat):
+        """Iterator that yields the decompressed image data as strings
+        of at most :attr:`window` bytes.  `idat` should be an iterator
+        that yields the ``IDAT`` chunk data (see :meth:`iteridat`).
+
+        The data is decompressed as it is consumed, so a large ``IDAT``
+        chunk is never expanded in one go.  Decompression stops with a
+        :class:`FormatError` as soon as there is more data than the
+        header specifies, which defuses "decompression bombs", and the
+        size itself is limited by `max_size` (see
+        :meth:`decompressed_size`).
+        """
+
+        size = self.decompressed_size()
+        window = self.window
+        d = zlib.decompressobj()
+        total = 0
+        # The pending input, first the IDAT chunks, then nothing to
+        # drain the decompressor.
+        for data in itertools.chain(idat, ['']):
+            while True:
+                # `data` is passed as it is, it may be a ``buffer`` (see
+                # :class:`MappedReader`).
+                out = d.decompress(data, window)
+                data = d.unconsumed_tail
+                if not out:
+                    break
+                total += len(out)
+                if total > size:
+                    raise FormatError(
+                      'Too much data for decompressed IDAT chunk.')
+                yield out
+        out = d.flush()
+        total += len(out)
+        if total != size:
+            raise FormatError('Wrong size for decompressed IDAT chunk.')
+        if out:
+            yield out
+
     def read_flat(self):
         """
         Read a PNG file and decode it into flat row flat pixel format.
@@ -1677,26 +2054,14 @@ class Reader:
         """
 
         self.preamble()
-        compressed = []
-        while True:
-            try:
-                type, data = self.chunk()
-            except ValueError, e:
-                raise ChunkError(e.args[0])
-
-            # print >> sys.stderr, type, len(data)
-            if type == 'IDAT':
-            # http://www.w3.org/TR/PNG/#11IDAT
-                if self.colormap and not self.plte:
-                    warnings.warn("PLTE chunk is required before IDAT chunk")
-                compressed.append(data)
-            elif type == 'IEND': # http://www.w3.org/TR/PNG/#11IEND
-                break
-        packedlines = array('B', zlib.decompress(''.join(compressed)))
+        packedlines = array('B', ''.join(self.iterdecomp(self.iteridat())))
         if self.interlace:
             pixels = self.deinterlace(packedlines)
         else:
-            pixels = self.serialtoflat(self.straightlaced(packedlines))
+            # Undo the filters, then flatten the rows.
+            pixels = array('BH'[self.bitdepth > 8])
+            for row in self.iterboxed(self.iterstraight([packedlines])):
+                pixels.extend(row)
         meta = dict()
         for attr in 'greyscale alpha bitdepth interlace'.split():
             meta[attr] = getattr(self, attr)
@@ -1706,6 +2071,83 @@ class Reader:
                 meta[attr] = a
         return self.width, self.height, pixels, meta
 
+    def read_array(self):
+        """
+        Read the PNG file and decode it into a NumPy array.  Returns a
+        contiguous array of shape (*height*, *width*, *planes*), with
+        dtype ``numpy.uint8`` for bit depths up to 8 and
+        ``numpy.uint16`` for bit depth 16.  Colour mapped images give
+        palette indexes, see :meth:`palette`.  The metadata is
+        available as attributes of the reader afterwards (``width``,
+        ``bitdepth``, ``alpha`` and so on).
+
+        The image is decompressed into one preallocated buffer, and
+        then unfiltered, unpacked and deinterlaced with whole array
+        operations, there are no Python objects per row or pixel.
+
+        Requires NumPy.
+        """
+
+        if numpy is None:
+            raise Error("read_array requires NumPy.")
+
+        self.preamble()
+
+        # The size is checked by iterdecomp.
+        raw = numpy.empty(self.decompressed_size(), dtype=numpy.uint8)
+        offset = 0
+        for out in self.iterdecomp(self.iteridat()):
+            raw[offset:offset+len(out)] = numpy.frombuffer(out,
+              dtype=numpy.uint8)
+            offset += len(out)
+
+        def row_size(ppr):
+            return int(math.ceil(self.psize * ppr))
+
+        a = numpy.empty((self.height, self.width, self.planes),
+          dtype=(numpy.uint8, numpy.uint16)[self.bitdepth > 8])
+        # Filter unit, see :meth:`undo_filter`.
+        fu = max(1, self.psize)
+        offset = 0
+        for xstart, ystart, xstep, ystep, ppr, rows in self.passes():
+            if not rows:
+                # Small interlaced images have empty passes.
+                continue
+            rb = row_size(ppr)
+            lines = raw[offset:offset+(rb+1)*rows].reshape(rows, rb+1)
+            offset += (rb+1)*rows
+            prior = numpy.zeros(rb, dtype=numpy.uint8)
+            for line in lines:
+                filter_type = int(line[0])
+                if filter_type not in (0,1,2,3,4):
+                    raise FormatError('Invalid PNG Filter Type.'
+                      '  See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
+                if filter_type:
+                    self.undo_filter_numpy(filter_type, line[1:], prior, fu)
+                prior = line[1:]
+            a[ystart::ystep,xstart::xstep] = self.unpack_numpy(lines[:,1:],
+              ppr)
+        return a
+
+    def unpack_numpy(self, bytes, width):
+        """Convert the bytes of unfiltered scanlines, a 2-dimensional
+        ``numpy.uint8`` array, to pixel values.  Returns an array of
+        shape (*rows*, `width`, *planes*).
+        """
+
+        rows = bytes.shape[0]
+        if self.bitdepth == 8:
+            return bytes.reshape(rows, width, self.planes)
+        if self.bitdepth == 16:
+            # Big-endian to native byte order.
+            return numpy.ascontiguousarray(bytes).view('>u2').astype(
+              numpy.uint16).reshape(rows, width, self.planes)
+        assert self.bitdepth < 8
+        shifts = numpy.arange(8-self.bitdepth, -1, -self.bitdepth,
+          dtype=numpy.uint8)
+        values = (bytes[:,:,numpy.newaxis] >> shifts) & (2**self.bitdepth-1)
+        return values.reshape(rows, -1)[:,:width].reshape(rows, width, 1)
+
     def palette(self, alpha='natural'):
         """Returns a palette that is a sequence of 3-tuples or 4-tuples,
         synthesizing it from the ``PLTE`` and ``tRNS`` chunks.  These
@@ -1967,6 +2409,130 @@ class Reader:
         return width,height,convert(),meta
 
 
+class MappedReader(Reader):
+    """
+    PNG decoder for files, which memory maps the file instead of
+    reading it.
+    """
+
+    def __init__(self, _guess=None, max_size=None, **kw):
+        """
+        Create a PNG decoder object for a memory mapped file.  Expects
+        exactly one argument, either `filename` or `file` (a real file,
+        with a ``fileno()`` method), or a positional argument of either
+        kind.  `max_size` is as for :class:`Reader`.
+
+        The chunks are found by an index built from the chunk headers
+        alone (see :meth:`chunk_index`), so reading the metadata (with
+        :meth:`preamble`) does not touch the pixel data.  The data of
+        ``IDAT`` chunks is returned as ``buffer`` objects that refer to
+        the mapped file, it is passed to the decompressor without being
+        copied.  The data of all other chunks is returned as strings,
+        as by :class:`Reader`.
+        """
+        if ((_guess is not None and len(kw) != 0) or
+            (_guess is None and len(kw) != 1)):
+            raise TypeError("MappedReader() takes exactly 1 argument")
+
+        if _guess is not None:
+            if isinstance(_guess, str):
+                kw["filename"] = _guess
+            else:
+                kw["file"] = _guess
+
+        if "filename" in kw:
+            f = file(kw["filename"], "rb")
+        elif "file" in kw:
+            f = kw["file"]
+        else:
+            raise TypeError("expecting filename or file")
+
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError), e:
+            # Empty files can not be mapped.
+            raise FormatError("Cannot map PNG file: %s" % e)
+        if "filename" in kw:
+            f.close()
+
+        # The signature is read as from any other string.
+        Reader.__init__(self, bytes=self.map, max_size=max_size)
+        # The chunk index and the position in it.
+        self.index = None
+        self.position = 0
+
+    def chunk_index(self):
+        """Return a list of (*offset*, *length*, *type*) triples for
+        all the chunks in the file, where *offset* is the file offset of
+        the chunk, *length* the length of its data and *type* its type
+        (as a 4 character string).  Only the chunk headers are read.
+        """
+
+        if self.index is not None:
+            return self.index
+        index = []
+        offset = len(_signature)
+        end = len(self.map)
+        while offset < end:
+            if end - offset < 8:
+                raise FormatError(
+                  'End of file whilst reading chunk length and type.')
+            length,type = struct.unpack_from('!I4s', self.map, offset)
+            if length > 2**31-1:
+                raise FormatError('Chunk %s is too large: %d.' % (type,length))
+            index.append((offset, length, type))
+            offset += length + 12
+            if type == 'IEND':
+                break
+        self.index = index
+        return index
+
+    def chunklentype(self):
+        """Return the length and type of the next chunk, as
+        :meth:`Reader.chunklentype` does, from the chunk index.
+        """
+
+        index = self.chunk_index()
+        if self.position >= len(index):
+            return None
+        offset,length,type = index[self.position]
+        return length,type
+
+    def chunk(self, seek=None):
+        """
+        Return the type and data of the next chunk, as
+        :meth:`Reader.chunk` does.  The data of an ``IDAT`` chunk is a
+        ``buffer`` into the mapped file.
+        """
+
+        self.validate_signature()
+        index = self.chunk_index()
+
+        while True:
+            if self.position >= len(index):
+                raise ValueError('End of file whilst reading chunk.')
+            offset,length,type = index[self.position]
+            self.position += 1
+            self.atchunk = None
+            if seek and type != seek:
+                continue
+            start = offset + 8
+            if start + length + 4 > len(self.map):
+                raise ChunkError('Chunk %s too short for required %i octets.'
+                  % (type, length))
+            data = buffer(self.map, start, length)
+            (checksum, ) = struct.unpack_from('!I', self.map, start+length)
+            # See :meth:`Reader.chunk` for the coercion.
+            verify = zlib.crc32(data, zlib.crc32(type)) & (2**32 - 1)
+            if checksum != verify:
+                raise ChunkError(
+                  "Checksum error in %s chunk: 0x%08X != 0x%08X." %
+                  (type, checksum, verify))
+            if type != 'IDAT':
+                data = str(data)
+            return type, data
+
+
 # === Legacy Version Support ===
 
 # :pyver:old:  PyPNG works on Python versions 2.3 and 2.2, but not
@@ -2444,6 +3010,265 @@ class Test(unittest.TestCase):
         rows = [map(numpy.bool, [0,1])]
         b = topngbytes('numpybool.png', rows, 2, 1,
             greyscale=True, alpha=False, bitdepth=1)
+    def testFilterType(self):
+        """Each filter type, straightlaced and interlaced, reads back
+        the same pixels."""
+
+        for name,bytes in _pngsuite.items():
+            if name[3:5] not in ['n0', 'n2', 'n4', 'n6']:
+                continue
+            it = Reader(bytes=bytes)
+            x,y,pixels,meta = it.read()
+            pixels = map(list, pixels)
+            for interlace in (False, True):
+                for filter_type in (1,2,3,4,'adaptive','brute'):
+                    b = topngbytes('filter%s%s%s.png' %
+                      (filter_type, 'ni'[interlace], name), pixels,
+                      x=x, y=y, bitdepth=it.bitdepth,
+                      greyscale=it.greyscale, alpha=it.alpha,
+                      interlace=interlace, filter_type=filter_type)
+                    self.assertEqual(
+                      map(list, Reader(bytes=b).read()[2]), pixels)
+    def testFilterAdaptive(self):
+        """Adaptive filtering makes a gradient smaller."""
+
+        rows = [[(x + y) & 0xff for x in range(64)] for y in range(64)]
+        plain = topngbytes('adaptive0.png', rows, 64, 64, greyscale=True)
+        adaptive = topngbytes('adaptive.png', rows, 64, 64, greyscale=True,
+          filter_type='adaptive')
+        self.assertTrue(len(adaptive) < len(plain))
+        self.assertRaises(ValueError, Writer, 1, 1, filter_type=5)
+    def testDecompressWindow(self):
+        """A single large IDAT chunk is decompressed in windows."""
+
+        rows = [[(x * y) & 0xff for x in range(256)] for y in range(256)]
+        b = topngbytes('window.png', rows, 256, 256, greyscale=True,
+          chunk_limit=2**20)
+        r = Reader(bytes=b)
+        r.preamble()
+        r.window = 1000
+        sizes = map(len, r.iterdecomp(r.iteridat()))
+        self.assertEqual(sum(sizes), 257 * 256)
+        self.assertTrue(max(sizes) <= 1000)
+        r = Reader(bytes=b)
+        r.window = 1000
+        self.assertEqual(map(list, r.read()[2]), rows)
+    def testDecompressBomb(self):
+        """Too much image data is refused while decompressing."""
+
+        def bomb(size):
+            o = StringIO()
+            write_chunks(o, [('IHDR', struct.pack('!2I5B', 1, 1, 8, 0,
+              0, 0, 0)), ('IDAT', zlib.compress('\0' * size)), ('IEND', '')])
+            return o.getvalue()
+        self.assertEqual(map(list, Reader(bytes=bomb(2)).read()[2]), [[0]])
+        b = bomb(2**24)
+        r = Reader(bytes=b)
+        self.assertRaises(FormatError, lambda: list(r.read()[2]))
+        self.assertRaises(FormatError, Reader(bytes=b).read_flat)
+        self.assertRaises(FormatError, Reader(bytes=bomb(1)).read_flat)
+    def testMaxSize(self):
+        """The max_size argument limits the image size."""
+
+        b = _pngsuite['basn2c08']
+        # 32 rows of 96 bytes and the filter type.
+        self.assertRaises(FormatError, Reader(bytes=b, max_size=3103).read)
+        self.assertRaises(FormatError,
+          Reader(bytes=b, max_size=3103).read_flat)
+        x,y,pixels,meta = Reader(bytes=b, max_size=3104).read()
+        self.assertEqual(len(list(pixels)), 32)
+    def helperNumpyless(self, f):
+        """Call `f` with the NumPy scanline code switched off."""
+        module = sys.modules[__name__]
+        saved = module.numpy
+        try:
+            module.numpy = None
+            return f()
+        finally:
+            module.numpy = saved
+    def testNumpyUndoFilter(self):
+        """NumPy and pure Python unfiltering agree for each filter
+        type and filter unit."""
+
+        try:
+            import numpy
+        except ImportError:
+            print >>sys.stderr, "skipping numpy test"
+            return
+
+        import random
+        random.seed(7)
+        for psize in (1, 2, 3, 4, 6, 8):
+            r = Reader(bytes='')
+            r.psize = psize
+            n = psize * 17
+            previous = array('B', [random.randrange(256) for i in range(n)])
+            for filter_type in (0, 1, 2, 3, 4):
+                for prior in (None, previous):
+                    scanline = array('B',
+                      [random.randrange(256) for i in range(n)])
+                    expected = self.helperNumpyless(
+                      lambda: r.undo_filter(filter_type, scanline, prior))
+                    self.assertEqual(
+                      r.undo_filter(filter_type, scanline, prior), expected)
+    def testNumpyRead(self):
+        """NumPy and pure Python decode the PngSuite images the
+        same."""
+
+        try:
+            import numpy
+        except ImportError:
+            print >>sys.stderr, "skipping numpy test"
+            return
+
+        for name,bytes in _pngsuite.items():
+            expected = self.helperNumpyless(
+              lambda: map(list, Reader(bytes=bytes).read()[2]))
+            self.assertEqual(map(list, Reader(bytes=bytes).read()[2]),
+              expected)
+    def testNumpyArray(self):
+        """read_array gives the same pixels as read, and write_ndarray
+        writes the same PNG as write."""
+
+        try:
+            import numpy
+        except ImportError:
+            print >>sys.stderr, "skipping numpy test"
+            return
+
+        for name,bytes in _pngsuite.items():
+            r = Reader(bytes=bytes)
+            x,y,pixels,meta = r.read()
+            pixels = map(list, pixels)
+            a = Reader(bytes=bytes).read_array()
+            self.assertEqual(a.shape, (y, x, meta['planes']))
+            self.assertEqual(a.dtype,
+              (numpy.uint8, numpy.uint16)[meta['bitdepth'] > 8])
+            self.assertTrue(a.flags.c_contiguous)
+            self.assertEqual(a.reshape(y, -1).tolist(), pixels)
+            if r.colormap:
+                continue
+            for interlace in (False, True):
+                k = dict(x=x, y=y, bitdepth=r.bitdepth,
+                  greyscale=r.greyscale, alpha=r.alpha,
+                  interlace=interlace)
+                expected = topngbytes('array%s%s.png' %
+                  ('ni'[interlace], name), pixels, **k)
+                f = StringIO()
+                Writer(x, y, bitdepth=r.bitdepth, greyscale=r.greyscale,
+                  alpha=r.alpha, interlace=interlace).write_ndarray(f, a)
+                self.assertEqual(f.getvalue(), expected)
+        # A rescaled bit depth.
+        a = numpy.arange(32, dtype=numpy.uint8).reshape(2, 16) % 8
+        f = StringIO()
+        Writer(16, 2, greyscale=True, bitdepth=3).write_ndarray(f, a)
+        expected = topngbytes('array3.png', a.tolist(), 16, 2,
+          greyscale=True, bitdepth=3)
+        self.assertEqual(f.getvalue(), expected)
+        self.assertRaises(ValueError,
+          Writer(2, 16, greyscale=True).write_ndarray, StringIO(), a)
+    def testNumpyArraySmall(self):
+        """Small interlaced images, which have empty passes, are
+        handled by read_array and write_ndarray."""
+
+        try:
+            import numpy
+        except ImportError:
+            print >>sys.stderr, "skipping numpy test"
+            return
+
+        for x,y in [(1,1), (3,2), (2,3), (4,4), (8,4), (5,1), (1,5)]:
+            for bitdepth in (1,2,4,8,16):
+                for greyscale in (True, False):
+                    if bitdepth < 8 and not greyscale:
+                        continue
+                    planes = 3 - 2*greyscale
+                    pixels = [[(i*7 + j) % 2**bitdepth
+                      for j in range(x*planes)] for i in range(y)]
+                    for interlace in (False, True):
+                        k = dict(bitdepth=bitdepth, greyscale=greyscale,
+                          interlace=interlace)
+                        expected = topngbytes('small%s%dx%d-%d.png' %
+                          ('ni'[interlace], x, y, bitdepth),
+                          pixels, x, y, **k)
+                        a = Reader(bytes=expected).read_array()
+                        self.assertEqual(a.reshape(y, -1).tolist(),
+                          pixels)
+                        f = StringIO()
+                        Writer(x, y, **k).write_ndarray(f, a)
+                        self.assertEqual(f.getvalue(), expected)
+    def helperMapped(self, bytes):
+        """Return a :class:`MappedReader` for `bytes` written to a
+        temporary file."""
+        f = tempfile.TemporaryFile()
+        f.write(bytes)
+        f.flush()
+        return MappedReader(file=f)
+    def testMappedRead(self):
+        """MappedReader decodes the PngSuite images as Reader does."""
+
+        for name,bytes in _pngsuite.items():
+            expected = Reader(bytes=bytes).read()
+            x,y,pixels,meta = self.helperMapped(bytes).read()
+            self.assertEqual((x, y, meta), expected[:2] + expected[3:])
+            self.assertEqual(map(list, pixels), map(list, expected[2]))
+            x,y,pixels,meta = self.helperMapped(bytes).read_flat()
+            self.assertEqual(list(pixels),
+              list(Reader(bytes=bytes).read_flat()[2]))
+    def testMappedIndex(self):
+        """The metadata of a MappedReader comes from the chunk headers
+        without touching the pixel data."""
+
+        bytes = _pngsuite['basn2c08']
+        r = self.helperMapped(bytes)
+        index = r.chunk_index()
+        self.assertEqual(index[0], (8, 13, 'IHDR'))
+        self.assertEqual(index[-1][2], 'IEND')
+        self.assertEqual(index[-1][0] + 12, len(bytes))
+        # Corrupt the IDAT data, the preamble still works.
+        offset,length,type = [c for c in index if c[2] == 'IDAT'][0]
+        corrupt = bytes[:offset+8] + '\0' * length + bytes[offset+8+length:]
+        r = self.helperMapped(corrupt)
+        r.preamble()
+        self.assertEqual((r.width, r.height, r.bitdepth), (32, 32, 8))
+        self.assertRaises(ChunkError, r.read_flat)
+        # A truncated file.
+        self.assertRaises(ChunkError, self.helperMapped(bytes[:-20]).read_flat)
+    def testNumpyMapped(self):
+        """MappedReader feeds read_array."""
+
+        try:
+            import numpy
+        except ImportError:
+            print >>sys.stderr, "skipping numpy test"
+            return
+
+        for name,bytes in _pngsuite.items():
+            self.assertEqual(self.helperMapped(bytes).read_array().tolist(),
+              Reader(bytes=bytes).read_array().tolist())
+        self.assertRaises(FormatError,
+          Reader(bytes=_pngsuite['basn2c08'], max_size=3103).read_array)
+    def testNumpyFilter(self):
+        """NumPy and pure Python filtering write the same PNG."""
+
+        try:
+            import numpy
+        except ImportError:
+            print >>sys.stderr, "skipping numpy test"
+            return
+
+        for name in ('basn2c08', 'basn6a16', 'basi0g08'):
+            it = Reader(bytes=_pngsuite[name])
+            x,y,pixels,meta = it.read()
+            pixels = map(list, pixels)
+            for filter_type in (1,2,3,4,'adaptive','brute'):
+                k = dict(x=x, y=y, bitdepth=it.bitdepth,
+                  greyscale=it.greyscale, alpha=it.alpha,
+                  interlace=it.interlace, filter_type=filter_type)
+                expected = self.helperNumpyless(
+                  lambda: topngbytes('numpyless.png', pixels, **k))
+                self.assertEqual(topngbytes('numpy.png', pixels, **k),
+                  expected)
 
 
 # === Command Line Support ===
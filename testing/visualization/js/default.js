@@ -48,6 +48,48 @@ function startupTest() {
   // FPS MEASUREMENT
   filterStrength = 20, lastLoop = new Date, thisLoop = 0;
   frameTime = 0;
+  // READINESS, the tester waits for this instead of sleeping
+  test_ready = false;
+  test_frames = 0;
+  test_ready_callbacks = [];
+  
+};
+
+/**
+ * Call a function as soon as the test is ready, this means the loading
+ * completed and enough frames were rendered to measure the FPS. If the test is
+ * ready already, the function gets called right away.
+ * 
+ * @param {Function} callback The function to call.
+ */
+function whenReady(callback) {
+
+  if (test_ready) {
+    
+    callback();
+    return;
+    
+  }
+  
+  test_ready_callbacks.push(callback);
+  
+};
+
+/**
+ * Flag the test as ready and notify everyone who is waiting.
+ */
+function signalReady() {
+
+  test_ready = true;
+  
+  var callbacks = test_ready_callbacks;
+  test_ready_callbacks = [];
+  
+  for ( var i = 0; i < callbacks.length; i++) {
+    
+    callbacks[i]();
+    
+  }
   
 };
 
@@ -68,6 +110,14 @@ function teardownTest() {
     frameTime += (thisFrameTime - frameTime) / filterStrength;
     lastLoop = thisLoop;
     
+    // the test is ready once the filter saw enough frames after the loading
+    if (!test_ready && test_renderer.loadingCompleted &&
+        ++test_frames >= filterStrength) {
+      
+      signalReady();
+      
+    }
+    
   };
   
 };
@@ -1,12 +1,22 @@
 from _builder import Builder
+from _baselinecache import BaselineCache
+from _buildcache import BuildCache
 from _tester import Tester
 from _depsgenerator import DepsGenerator
+from _depscanner import DepsScanner, DepsGraph
 from _documenter import Documenter
 from _entrypoint import Entrypoint
+from _imagecompare import ImageCompare
 from _jsfilefinder import JSFileFinder
+from _modulesplitter import ModuleSplitter
+from _perfhistory import PerfHistory
+from _testselector import TestSelector
 from _colors import Colors
+from _compilerserver import CompilerServer, CompilerClient
 from _uploader import Uploader
+from _watcher import Watcher
 from _cdash import CDash
+from _xmlwriter import XMLWriter
 
 from config import *
 
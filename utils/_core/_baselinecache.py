@@ -0,0 +1,130 @@
+#
+# The XBUILD baseline cache.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import hashlib
+import os
+import tempfile
+
+import config
+from _imagecompare import ImageCompare
+
+#
+#
+#
+class BaselineCache( object ):
+  '''
+  A persistent cache for decoded baselines.
+
+  Each baseline PNG is decoded once and stored as a raw .npy array, keyed by
+  the digest of the PNG. The cached arrays are memory mapped, so comparisons
+  read them without decoding or copying.
+
+  numpy is required.
+  '''
+
+  def __init__( self, path=None ):
+    '''
+    '''
+    if not path:
+      path = config.BASELINE_CACHE_PATH
+
+    self.__path = path
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+
+    options
+      [baseline] the filename of the baseline PNG
+
+    Returns the baseline as a read-only height x width x 4 array.
+    '''
+    import numpy
+
+    baseline = options[0]
+
+    key = self.key( baseline )
+    cachefile = os.path.join( self.__path, key + '.npy' )
+
+    if os.path.isfile( cachefile ):
+
+      try:
+        pixels = numpy.load( cachefile, mmap_mode='r' )
+      except ( IOError, ValueError ):
+        # a broken entry, decode again
+        pixels = None
+
+      if pixels is not None:
+        # mark this entry as recently used
+        os.utime( cachefile, None )
+        return pixels
+
+    self.store( cachefile, ImageCompare().load( baseline ) )
+
+    return numpy.load( cachefile, mmap_mode='r' )
+
+
+  def key( self, baseline ):
+    '''
+    Return the digest of a baseline PNG.
+    '''
+    digest = hashlib.sha1()
+
+    with open( baseline, 'rb' ) as f:
+
+      while True:
+        block = f.read( 65536 )
+        if not block:
+          break
+        digest.update( block )
+
+    return digest.hexdigest()
+
+
+  def store( self, cachefile, pixels ):
+    '''
+    Store a decoded baseline in the cache.
+    '''
+    import numpy
+
+    if not os.path.exists( self.__path ):
+      try:
+        os.makedirs( self.__path )
+      except OSError:
+        # another session was faster
+        pass
+
+    # write to a temporary file first so concurrent sessions never see
+    # incomplete entries
+    fd, tmpfile = tempfile.mkstemp( suffix='.tmp', dir=self.__path )
+
+    with os.fdopen( fd, 'wb' ) as f:
+      numpy.save( f, pixels )
+
+    os.rename( tmpfile, cachefile )
+
+    self.prune()
+
+
+  def prune( self ):
+    '''
+    Remove the least recently used entries if the cache is full.
+    '''
+    entries = [e for e in os.listdir( self.__path ) if e.endswith( '.npy' )]
+
+    if len( entries ) <= config.BASELINE_CACHE_SIZE:
+      return
+
+    entries.sort( key=lambda e: os.path.getmtime( os.path.join( self.__path, e ) ) )
+
+    for e in entries[:-config.BASELINE_CACHE_SIZE]:
+
+      try:
+        os.unlink( os.path.join( self.__path, e ) )
+      except OSError:
+        # removed by another session
+        pass
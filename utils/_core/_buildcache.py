@@ -0,0 +1,156 @@
+#
+# The XBUILD build cache.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import hashlib
+import json
+import os
+import shutil
+
+import config
+
+#
+#
+#
+class BuildCache( object ):
+  '''
+  A persistent cache for compiled files.
+
+  Each entry is keyed by a digest of everything that goes into a compilation:
+  the input files and their contents, the compiler arguments, the closure
+  library and the compiler.jar itself.
+  '''
+
+  def __init__( self, path=None ):
+    '''
+    '''
+    if not path:
+      path = config.BUILD_CACHE_PATH
+
+    self.__path = path
+
+
+  def hashFile( self, digest, filename ):
+    '''
+    Update a digest with the content of a file.
+    '''
+    if not os.path.isfile( filename ):
+      # missing files are part of the key as well
+      digest.update( '\0missing\0' )
+      return
+
+    with open( filename, 'rb' ) as f:
+
+      while True:
+        block = f.read( 65536 )
+        if not block:
+          break
+        digest.update( block )
+
+
+  def key( self, jsfiles, arguments ):
+    '''
+    Return the cache key for a compilation of the given files with the given
+    arguments.
+    '''
+    digest = hashlib.sha1()
+
+    # the arguments, in order
+    for a in arguments:
+      digest.update( a + '\0' )
+
+    # the input files and their contents
+    for j in sorted( jsfiles ):
+      digest.update( j + '\0' )
+      self.hashFile( digest, j )
+
+    # the closure library which is scanned through the --root argument
+    for dirpath, dirnames, filenames in os.walk( config.CLOSURELIBRARY_PATH ):
+
+      # walk in a stable order
+      dirnames.sort()
+
+      for f in sorted( filenames ):
+
+        if not f.endswith( '.js' ):
+          continue
+
+        j = os.path.join( dirpath, f )
+        digest.update( j + '\0' )
+        self.hashFile( digest, j )
+
+    # and the compiler
+    digest.update( config.CLOSURECOMPILER_PATH + '\0' )
+    self.hashFile( digest, config.CLOSURECOMPILER_PATH )
+
+    return digest.hexdigest()
+
+
+  def lookup( self, key ):
+    '''
+    Return the compiler log of a cached compilation or None if the key is not
+    in the cache.
+    '''
+    outputfile = os.path.join( self.__path, key + '.js' )
+    logfile = os.path.join( self.__path, key + '.json' )
+
+    if not os.path.isfile( outputfile ) or not os.path.isfile( logfile ):
+      return None
+
+    with open( logfile, 'r' ) as f:
+      log = [l.encode( 'utf-8' ) for l in json.load( f )]
+
+    # mark this entry as recently used
+    os.utime( outputfile, None )
+
+    return log
+
+
+  def restore( self, key, outputfile ):
+    '''
+    Copy a cached compiled file to the given output file.
+    '''
+    shutil.copyfile( os.path.join( self.__path, key + '.js' ), outputfile )
+
+
+  def store( self, key, outputfile, log ):
+    '''
+    Store a compiled file and its compiler log in the cache.
+    '''
+    if not os.path.exists( self.__path ):
+      os.makedirs( self.__path )
+
+    # write to temporary files first so concurrent builds never see
+    # incomplete entries
+    tmpfile = os.path.join( self.__path, key + '.js.tmp' )
+    shutil.copyfile( outputfile, tmpfile )
+
+    with open( os.path.join( self.__path, key + '.json.tmp' ), 'w' ) as f:
+      json.dump( log, f )
+
+    os.rename( os.path.join( self.__path, key + '.json.tmp' ), os.path.join( self.__path, key + '.json' ) )
+    os.rename( tmpfile, os.path.join( self.__path, key + '.js' ) )
+
+    self.prune()
+
+
+  def prune( self ):
+    '''
+    Remove the least recently used entries if the cache is full.
+    '''
+    entries = [e for e in os.listdir( self.__path ) if e.endswith( '.js' )]
+
+    if len( entries ) <= config.BUILD_CACHE_SIZE:
+      return
+
+    entries.sort( key=lambda e: os.path.getmtime( os.path.join( self.__path, e ) ) )
+
+    for e in entries[:-config.BUILD_CACHE_SIZE]:
+
+      key = os.path.splitext( e )[0]
+
+      for f in [key + '.js', key + '.json']:
+        if os.path.exists( os.path.join( self.__path, f ) ):
+          os.unlink( os.path.join( self.__path, f ) )
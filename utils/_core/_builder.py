@@ -5,16 +5,46 @@
 #
 
 import datetime
+import itertools
+import json
+import multiprocessing
 import os
 import stat
 import sys
 import subprocess
+import threading
+import time
 
 import config
+from _buildcache import BuildCache
 from _cdash import CDash
 from _colors import Colors
+from _compilerserver import CompilerClient, CompilerServer
 from _jsfilefinder import JSFileFinder
 from _licenser import Licenser
+from _modulesplitter import ModuleSplitter
+from _watcher import Watcher
+
+#
+#
+#
+def buildVariant( job ):
+  '''
+  Build a single variant of the build matrix. This runs in a worker process.
+  '''
+  variant, jsfiles, options = job
+
+  start_time = time.time()
+
+  builder = Builder()
+  log, success, cached = builder.build( jsfiles, variant['output'], variant['flags'], variant['defines'], variant['namespaces'], options, variant['name'] + ': ' )
+
+  size = None
+  if success:
+    size = os.path.getsize( variant['output'] )
+
+  return {'name':variant['name'], 'output':variant['output'], 'log':log, 'success':success, 'cached':cached, 'time':time.time() - start_time, 'size':size}
+
 
 #
 #
@@ -22,6 +52,8 @@ from _licenser import Licenser
 class Builder( object ):
   '''
   '''
+  # the modules are located next to the core, which is the last script loaded
+  MODULES_PATH_SCRIPT = '''XTK_MODULES['path'] = (function() { var s = document.getElementsByTagName('script'); var src = s[s.length - 1].src; return src.substring(0, src.lastIndexOf('/') + 1); })();\n'''
 
   def run( self, options=None ):
     '''
@@ -30,15 +62,210 @@ class Builder( object ):
 
     print 'Building ' + config.SOFTWARE_SHORT + '...'
 
+    self.runOnce( options )
+
+    if options.watch:
+      # rebuild on every change
+      self.runWatch( options )
+
+
+  def runOnce( self, options ):
+    '''
+    Perform a single build according to the options.
+    '''
     # grab all js files
     filefinder = JSFileFinder()
     jsfiles = filefinder.run()
 
-    arguments = []          
+    if options.matrix:
+      # build all variants at once
+      self.runMatrix( jsfiles, options )
+      return
+
+    if options.split:
+      # build lazily loadable modules
+      self.runModules( jsfiles, options )
+      return
+
+    flags = []
+
+    # if enabled, set debug options
+    if options.debug:
+      flags.append( '--debug' )
+      flags.append( '--formatting=PRETTY_PRINT' )
+
+    log, success, cached = self.build( jsfiles, config.BUILD_OUTPUT_PATH, flags, [], [], options )
+
+    self.createSubmission( log )
+
+    if success:
+      print Colors.ORANGE + 'Compiled file ' + Colors.CYAN + config.BUILD_OUTPUT_PATH + Colors.ORANGE + ' written. ' + Colors._CLEAR
+
+
+  def runWatch( self, options ):
+    '''
+    Rebuild whenever a file changes. The compilations go through a compiler
+    server, which is started for the time of watching if none is running.
+    '''
+    server = None
+
+    if not CompilerClient().available():
+
+      server = CompilerServer()
+      thread = threading.Thread( target=server.run )
+      thread.start()
+
+      # wait until the server accepts jobs
+      while not CompilerClient().available():
+        if not thread.is_alive():
+          # f.e. the port is taken, we compile without the server then
+          server = None
+          break
+        time.sleep( 0.1 )
+
+    try:
+      watcher = Watcher()
+      watcher.run( [lambda changed: self.runOnce( options )] )
+    finally:
+      if server:
+        server.shutdown()
+        thread.join()
+
+
+  def runMatrix( self, jsfiles, options ):
+    '''
+    Build all variants of config.BUILD_VARIANTS concurrently.
+    '''
+    variants = config.BUILD_VARIANTS
+
+    print Colors.PURPLE + 'Building ' + str( len( variants ) ) + ' variants: ' + ', '.join( [v['name'] for v in variants] ) + Colors._CLEAR
+
+    pool = multiprocessing.Pool( min( len( variants ), multiprocessing.cpu_count() ) )
+
+    try:
+      results = pool.map( buildVariant, [( v, jsfiles, options ) for v in variants] )
+    finally:
+      pool.close()
+      pool.join()
+
+    # the first variant is the one we report to the dashboard
+    self.createSubmission( results[0]['log'] )
+
+    #
+    # print a report
+    #
+    print
+    print Colors.ORANGE + 'VARIANTS:' + Colors._CLEAR
+
+    for r in results:
+
+      if not r['success']:
+        print Colors.RED + '   ' + r['name'] + ': FAILED' + Colors._CLEAR
+        continue
+
+      status = '%.1fs' % r['time']
+      if r['cached']:
+        status += ' (cached)'
+
+      print Colors.CYAN + '   ' + r['name'] + ': ' + Colors._CLEAR + status + ', ' + '%.1f KB' % ( r['size'] / 1024.0 ) + ', ' + Colors.PURPLE + r['output'] + Colors._CLEAR
+
+    print
+
+
+  def runModules( self, jsfiles, options ):
+    '''
+    Build a small core and lazily loadable modules for the parsers, as
+    configured in config.BUILD_MODULES_SPLIT, plus a manifest which allows
+    X.loader to fetch the module for a file extension on demand.
+    '''
+    splitter = ModuleSplitter()
+    modules, manifest = splitter.run( [jsfiles] )
+
+    if not os.path.exists( config.BUILD_MODULES_OUTPUT_PATH ):
+      os.makedirs( config.BUILD_MODULES_OUTPUT_PATH )
+
+    prefix = config.SOFTWARE_SHORT.lower() + '-'
+
+    command = ['java', '-jar', config.CLOSURECOMPILER_PATH]
+
+    for m in modules:
+
+      files = m['files']
+      if m['name'] == 'core':
+        # the closure deps file has to be part of a module as well
+        files = files[:1] + [config.CLOSURELIBRARY_DEPS_PATH] + files[1:]
+
+      for f in files:
+        command.extend( ['--js', f] )
+
+      module = m['name'] + ':' + str( len( files ) )
+      if m['requires']:
+        module += ':' + ','.join( m['requires'] )
+
+      command.extend( ['--module', module] )
+
+    command.extend( [f for f in self.compilerFlags( [], [] ) if not f.startswith( '--js=' )] )
+    command.extend( ['--module_output_path_prefix', os.path.join( config.BUILD_MODULES_OUTPUT_PATH, prefix )] )
+
+    print Colors.PURPLE + 'Compiling ' + str( len( modules ) ) + ' modules: ' + ', '.join( [m['name'] for m in modules] ) + Colors._CLEAR
+
+    process = subprocess.Popen( command, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
+
+    # the log starts with the compiler command, just like the one of closurebuilder
+    log = self.processOutput( itertools.chain( ['Compiling with the following command: ' + ' '.join( command ) + '\n'], process.stdout ), options )
+
+    self.createSubmission( log )
+
+    if process.wait() != 0:
+      print Colors.RED + 'Compilation failed.' + Colors._CLEAR
+      return
+
+    now = datetime.datetime.now()
+    licenser = Licenser()
+
+    for m in modules:
+
+      output = os.path.join( config.BUILD_MODULES_OUTPUT_PATH, prefix + m['name'] + '.js' )
+
+      with open( output, 'r' ) as f:
+        content = f.read()
+
+      content = content.replace( '###TIMESTAMP###', now.strftime( '%Y-%m-%d %H:%M:%S' ) )
+
+      if m['name'] == 'core':
+        # attach the manifest and the location of the modules to the core
+        content = 'var XTK_MODULES = ' + json.dumps( manifest ) + ';\n' + self.MODULES_PATH_SCRIPT + content
+
+      with open( output, 'w' ) as f:
+        f.write( content )
+
+      licenser.run( [output] )
+
+      print Colors.CYAN + '   ' + m['name'] + ': ' + Colors._CLEAR + '%.1f KB' % ( os.path.getsize( output ) / 1024.0 ) + ', ' + str( len( m['files'] ) ) + ' files'
+
+    with open( os.path.join( config.BUILD_MODULES_OUTPUT_PATH, prefix + 'modules.json' ), 'w' ) as f:
+      json.dump( manifest, f, indent=2, sort_keys=True )
 
-    # add js files
-    for j in jsfiles:
-      arguments.extend( ['-i', j] )
+    print Colors.ORANGE + 'Compiled modules written to ' + Colors.CYAN + config.BUILD_MODULES_OUTPUT_PATH + Colors.ORANGE + '. ' + Colors._CLEAR
+
+
+  def arguments( self, jsfiles, output, flags, defines, namespaces ):
+    '''
+    Create the closurebuilder arguments for a compilation.
+
+    If namespaces are given, they are used as entry points instead of all
+    js files.
+    '''
+    arguments = []
+
+    if namespaces:
+      # add the entry points
+      for n in namespaces:
+        arguments.extend( ['-n', n] )
+    else:
+      # add js files
+      for j in jsfiles:
+        arguments.extend( ['-i', j] )
 
     # add the project root
     arguments.extend( ['--root', config.SOFTWARE_PATH] )
@@ -50,38 +277,142 @@ class Builder( object ):
     arguments.extend( ['-c', config.CLOSURECOMPILER_PATH] )
 
     # configure the output file
-    arguments.extend( ['--output_file', config.BUILD_OUTPUT_PATH] )
+    arguments.extend( ['--output_file', output] )
 
     # configure additional compiler arguments
-    arguments.extend( [ '-f', '--warning_level=VERBOSE'] ) # verbose
-    arguments.extend( [ '-f', '--compilation_level=ADVANCED_OPTIMIZATIONS'] ) # advanced compilation
-    arguments.extend( [ '-f', '--jscomp_warning=missingProperties'] ) # enable strict mode 1
-    arguments.extend( [ '-f', '--jscomp_warning=checkTypes'] ) # enable strict mode 2
-    arguments.extend( ['-f', '--summary_detail_level=3'] ) # always show summary
-    arguments.extend( [ '-f', '--define=goog.DEBUG=false'] ) # turn of closure library debugging
+    for f in self.compilerFlags( flags, defines ):
+      arguments.extend( ['-f', f] )
+
+    return arguments
+
+
+  def compilerFlags( self, flags, defines ):
+    '''
+    Create the flags which are passed to the compiler.
+    '''
+    compilerflags = []
+
+    compilerflags.append( '--warning_level=VERBOSE' ) # verbose
+    compilerflags.append( '--compilation_level=ADVANCED_OPTIMIZATIONS' ) # advanced compilation
+    compilerflags.append( '--jscomp_warning=missingProperties' ) # enable strict mode 1
+    compilerflags.append( '--jscomp_warning=checkTypes' ) # enable strict mode 2
+    compilerflags.append( '--summary_detail_level=3' ) # always show summary
+    compilerflags.append( '--define=goog.DEBUG=false' ) # turn of closure library debugging
 
     # add the goog/deps.js file from closure according to
     # https://code.google.com/p/closure-library/wiki/FrequentlyAskedQuestions#When_I_compile_with_type-checking_on,_I_get_warnings_about_unkno
-    arguments.extend( [ '-f', '--js=' + config.CLOSURELIBRARY_DEPS_PATH] )
+    compilerflags.append( '--js=' + config.CLOSURELIBRARY_DEPS_PATH )
 
-    # if enabled, set debug options
-    if options.debug:
-      arguments.extend( ['-f', '--debug'] )
-      arguments.extend( ['-f', '--formatting=PRETTY_PRINT'] )
+    # additional defines
+    for d in defines:
+      compilerflags.append( '--define=' + d )
 
+    # and additional flags
+    compilerflags.extend( flags )
 
-    #
-    # call the compiler (through the closure builder)
-    #
-    
-    # make sure the closurebuilder is executable
-    st = os.stat( config.CLOSUREBUILDER_PATH )
-    os.chmod( config.CLOSUREBUILDER_PATH, st.st_mode | stat.S_IEXEC )
-    
-    command = ['python', config.CLOSUREBUILDER_PATH]
-    command.extend( arguments )
+    return compilerflags
 
-    process = subprocess.Popen( command, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
+
+  def build( self, jsfiles, output, flags, defines, namespaces, options, prefix='' ):
+    '''
+    Compile to the given output file, or restore it from the build cache.
+
+    Returns the log of warnings and errors, if the build succeeded and if it
+    came from the cache.
+    '''
+    arguments = self.arguments( jsfiles, output, flags, defines, namespaces )
+
+    # check if the same compilation is already in the build cache
+    buildcache = BuildCache()
+    cachekey = buildcache.key( jsfiles, arguments )
+
+    log = None
+    if not options.nocache:
+      log = buildcache.lookup( cachekey )
+
+    if log is not None:
+
+      # nothing changed since the cached build, re-use it
+      buildcache.restore( cachekey, output )
+      print prefix + Colors.PURPLE + 'Found an identical build in the cache, skipping compilation.' + Colors._CLEAR
+
+      return log, True, True
+
+    log, success = self.compile( arguments, output, options, prefix )
+
+    if not success:
+      # do not touch a failed build
+      print prefix + Colors.RED + 'Compilation failed.' + Colors._CLEAR
+      return log, False, False
+
+    # and add a timestamp to the compiled file
+    with open( output, 'r' ) as f:
+
+      content = f.read() # read everything in the file
+      now = datetime.datetime.now()
+      content_with_timestamp = content.replace( '###TIMESTAMP###', now.strftime( '%Y-%m-%d %H:%M:%S' ) )
+
+    with open( output, 'w' ) as f:
+
+      f.write( content_with_timestamp ) # write the new stuff
+
+    # and attach the license
+    licenser = Licenser()
+    licenser.run( [output] )
+
+    # remember this build
+    buildcache.store( cachekey, output, log )
+
+    return log, True, False
+
+
+  def compile( self, arguments, output, options, prefix='' ):
+    '''
+    Call the compiler (through the closure builder) with the given arguments.
+    If a compiler server is running, the job is submitted to it instead.
+
+    Returns the log of warnings and errors and if the compilation succeeded.
+    '''
+    compilerclient = CompilerClient()
+
+    if compilerclient.available():
+
+      print prefix + Colors.PURPLE + 'Using the compiler server at ' + Colors.CYAN + '%s:%d' % config.COMPILER_SERVER_ADDRESS + Colors._CLEAR
+
+      if not compilerclient.warm():
+        print prefix + Colors.YELLOW + 'The compiler server has no nailgun, the compiler JVM is not kept warm.' + Colors._CLEAR
+
+      process = None
+      lines = compilerclient.compile( arguments )
+
+    else:
+
+      # make sure the closurebuilder is executable
+      st = os.stat( config.CLOSUREBUILDER_PATH )
+      os.chmod( config.CLOSUREBUILDER_PATH, st.st_mode | stat.S_IEXEC )
+
+      command = ['python', config.CLOSUREBUILDER_PATH]
+      command.extend( arguments )
+
+      process = subprocess.Popen( command, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
+      lines = process.stdout
+
+    log = self.processOutput( lines, options, prefix )
+
+    if process:
+      returncode = process.wait()
+    else:
+      returncode = compilerclient.returncode
+
+    success = ( returncode == 0 and os.path.isfile( output ) )
+
+    return log, success
+
+
+  def processOutput( self, lines, options, prefix='' ):
+    '''
+    Print the compiler output and return the log of warnings and errors.
+    '''
 
     # ignore the next X lines
     ignoreNext = 0
@@ -91,7 +422,7 @@ class Builder( object ):
     log = []
 
     # fancy displaying using ANSI colors
-    for line in process.stdout:
+    for line in lines:
 
       if ignoreNext > 0:
         # we ignore this line
@@ -127,31 +458,17 @@ class Builder( object ):
         log.append( line )
 
       # print colored line
-      print color + line + Colors._CLEAR
+      print prefix + color + line + Colors._CLEAR
 
     # we have errors and warnings logged now
     log = log[1:-1] # remove first and last log entries since they are additional information
 
-    # now we create a dashboard submission file
-    cdasher = CDash()
-    xmlfile = cdasher.run( ['Build', log, True] )
-
-    with open( os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Build.xml' ), 'w' ) as f:
-      f.write( xmlfile )
+    return log
 
-    # and add a timestamp to the compiled file
-    with open( config.BUILD_OUTPUT_PATH, 'r' ) as f:
-
-      content = f.read() # read everything in the file
-      now = datetime.datetime.now()
-      content_with_timestamp = content.replace( '###TIMESTAMP###', now.strftime( '%Y-%m-%d %H:%M:%S' ) )
 
-    with open( config.BUILD_OUTPUT_PATH, 'w' ) as f:
-
-      f.write( content_with_timestamp ) # write the new stuff
-
-    # and attach the license
-    licenser = Licenser()
-    licenser.run()
-
-    print Colors.ORANGE + 'Compiled file ' + Colors.CYAN + config.BUILD_OUTPUT_PATH + Colors.ORANGE + ' written. ' + Colors._CLEAR
+  def createSubmission( self, log ):
+    '''
+    Create a dashboard submission file for a build log.
+    '''
+    cdasher = CDash()
+    cdasher.run( ['Build', log, True, os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Build.xml' )] )
@@ -4,18 +4,21 @@
 # (c) 2012 The XTK Developers <dev@goXTK.com>
 #
 
-import base64
+import gzip
 import hashlib
+import httplib
 import os
 import platform
 import sys
+import tempfile
+import urlparse
+from cStringIO import StringIO
 from socket import getfqdn
-from xml.dom import minidom
 from datetime import datetime
 from time import time, gmtime, strftime
 
-import _colors
 import config
+from _xmlwriter import XMLWriter
 
 #
 #
@@ -24,83 +27,187 @@ class CDash( object ):
   '''
   '''
 
-  def __init__( self ):
-    '''
-    '''
-    # create a new xml structure
-    self.__xml = minidom.Document()
-
+  # the submissions are read in chunks of this size
+  SUBMIT_CHUNK = 64 * 1024
 
-  def createXMLNode( self, name, value ):
+  def __init__( self ):
     '''
-    Returns an xml node with the given name, containing the given value
     '''
-    el = self.__xml.createElement( name )
-    el.appendChild( self.__xml.createTextNode( str( value ) ) )
-    return el
+    # the xml is streamed through this writer
+    self.__xml = None
 
 
   def run( self, options=None ):
     '''
     options
-      [type, log]
+      [type, log, build, filename]
+
+    The XML is written to the file while it is created. Without a filename,
+    it is returned instead.
     '''
     # check if are running something against the build tree
+    against_build = False
     if len( options ) > 2:
       against_build = options[2]
 
+    filename = None
+    if len( options ) > 3:
+      filename = options[3]
+
+    if filename:
+      f = open( filename, 'w' )
+    else:
+      f = StringIO()
+
+    self.__xml = XMLWriter( f )
+
+    try:
+
+      self.__xml.declaration()
+
+      # create the CDash XML elements
+
+      # .. the <Site> element
+      self.startSiteElement( against_build )
+
+      # .. the nested element of a certain type
+      self.startNestedElement( options[0] )
 
-    # create the CDash XML elements
+      if options[0] == 'Build':
+        self.fillBuildElement( options[1] )
+      elif options[0] == 'Testing':
+        self.fillTestingElement( options[1] )
+      elif options[0] == 'Coverage':
+        self.fillCoverageElement( options[1] )
+      elif options[0] == 'CoverageLog':
+        self.fillCoverageLogElement( options[1] )
+
+      # close the nested element and the site element
+      self.__xml.end()
+      self.__xml.end()
+
+      if not filename:
+        return f.getvalue()
+
+    finally:
+      f.close()
+
+    return filename
+
+
+  def connection( self ):
+    '''
+    Open a new connection to the CDash server. It is kept alive, so several
+    submissions can be sent through it.
+    '''
+    url = urlparse.urlsplit( config.CDASH_SUBMIT_URL )
+
+    if url.scheme == 'https':
+      return httplib.HTTPSConnection( url.netloc, timeout=config.UPLOAD_TIMEOUT )
+
+    return httplib.HTTPConnection( url.netloc, timeout=config.UPLOAD_TIMEOUT )
+
+
+  def chunks( self, filename, type ):
+    '''
+    Read a submission file in chunks with the ${BUILDTYPE} set.
+    '''
+    token = '${BUILDTYPE}'
+    rest = ''
 
-    # .. the <Site> element
-    siteElement = self.createSiteElement( against_build )
+    with open( filename, 'rb' ) as f:
 
-    # .. the nested element of a certain type
-    nestedElement = self.createNestedElement( options[0] )
+      while True:
+        chunk = f.read( self.SUBMIT_CHUNK )
+        if not chunk:
+          break
 
-    if options[0] == 'Build':
-      nestedElement = self.fillBuildElement( nestedElement, options[1] )
-    elif options[0] == 'Testing':
-      nestedElement = self.fillTestingElement( nestedElement, options[1] )
-    elif options[0] == 'Coverage':
-      nestedElement = self.fillCoverageElement( nestedElement, options[1] )
-    elif options[0] == 'CoverageLog':
-      nestedElement = self.fillCoverageLogElement( nestedElement, options[1] )
+        data = ( rest + chunk ).replace( token, type )
 
-    # now attach the nested element to the site element
-    siteElement.appendChild( nestedElement )
+        # the token can be split between two chunks, the start of it is kept
+        # back for the next one
+        rest = ''
+        i = data.rfind( '$', max( 0, len( data ) - len( token ) + 1 ) )
+        if i != -1 and token.startswith( data[i:] ):
+          rest = data[i:]
+          data = data[:i]
 
-    # and attach the site element to the xml document
-    self.__xml.appendChild( siteElement )
+        yield data
 
-    return self.__xml.toxml()
+    if rest:
+      yield rest
 
 
-  def submit( self, _data, type='Experimental' ):
+  def submit( self, filename, type='Experimental', connection=None, compress=False ):
     '''
-    Submit data to CDash via HTTP PUT.
+    Submit a file to CDash via HTTP PUT.
+
+    The file is streamed twice, first to hash it and then to send it. With
+    compress, the request is gzip encoded, the server has to decode it.
+
+    Returns True if the submission was accepted. Connection problems raise
+    socket.error or httplib.HTTPException.
     '''
+    md5 = hashlib.md5()
+    length = 0
+
+    if compress:
+      # the compressed length is needed up front
+      body = tempfile.TemporaryFile()
+      gz = gzip.GzipFile( filename='', mode='wb', fileobj=body, mtime=0 )
+
+    for chunk in self.chunks( filename, type ):
+      md5.update( chunk )
+
+      if compress:
+        gz.write( chunk )
+      else:
+        length += len( chunk )
+
+    if compress:
+      gz.close()
+      length = body.tell()
+      body.seek( 0 )
+      chunks = iter( lambda: body.read( self.SUBMIT_CHUNK ), '' )
+    else:
+      chunks = self.chunks( filename, type )
+
+    url = urlparse.urlsplit( config.CDASH_SUBMIT_URL )
+    path = url.path + '?' + url.query
+    if url.query:
+      path += '&'
+
+    close = False
+    if not connection:
+      connection = self.connection()
+      close = True
+
+    try:
 
-    # set the ${BUILDTYPE} in _data
-    _data = _data.replace( '${BUILDTYPE}', type )
+      connection.putrequest( 'PUT', path + 'MD5=' + md5.hexdigest() )
+      connection.putheader( 'Content-Length', str( length ) )
+      if compress:
+        connection.putheader( 'Content-Encoding', 'gzip' )
+      connection.endheaders()
 
-    # md5 hash the _data
-    md5 = hashlib.md5( _data ).hexdigest()
+      for chunk in chunks:
+        connection.send( chunk )
 
-    import urllib2
-    opener = urllib2.build_opener( urllib2.HTTPHandler )
-    request = urllib2.Request( config.CDASH_SUBMIT_URL + '&MD5=' + md5, data=_data )
-    request.get_method = lambda: 'PUT'
-    url = opener.open( request )
-    response = url.read()
+      # the response has to be read completely before the connection can be
+      # used again
+      response = connection.getresponse().read()
+
+    finally:
+      if compress:
+        body.close()
+      if close:
+        connection.close()
 
     # check if the submission was successful
-    if response.find( '<status>OK</status>' ) == -1:
-      print Colors.RED + 'Error: Could not upload to CDash.' + Colors._CLEAR
-      sys.exit( 2 )
+    return response.find( '<status>OK</status>' ) != -1
 
 
-  def fillBuildElement( self, buildElement, log ):
+  def fillBuildElement( self, log ):
     '''
     Checks for build warnings or errors in the error log and creates the proper XML elements.
     '''
@@ -114,14 +221,14 @@ class CDash( object ):
         #
         # create <Warning>
         #
-        element = xml.createElement( 'Warning' )
+        xml.start( 'Warning' )
 
       elif l.find( 'ERROR' ) != -1:
 
         #
         # create <Error>
         #
-        element = xml.createElement( 'Error' )
+        xml.start( 'Error' )
 
       else:
         # no error or warning here
@@ -130,24 +237,22 @@ class CDash( object ):
       # fill the element
 
       # the build log line number
-      element.appendChild( self.createXMLNode( 'BuildLogLine', str( i ) ) )
+      xml.element( 'BuildLogLine', str( i ) )
 
       # the text
-      element.appendChild( self.createXMLNode( 'Text', l ) )
+      xml.element( 'Text', l )
 
       # the source file
-      element.appendChild( self.createXMLNode( 'SourceFile', l.split( ':' )[0] ) )
+      xml.element( 'SourceFile', l.split( ':' )[0] )
 
       # the source line number
-      element.appendChild( self.createXMLNode( 'SourceLineNumber', l.split( ':' )[1].split( ':' )[0] ) )
-
-      # and append it to the <Build> element
-      buildElement.appendChild( element )
+      xml.element( 'SourceLineNumber', l.split( ':' )[1].split( ':' )[0] )
 
-    return buildElement
+      # and close the <Warning> or <Error> element
+      xml.end()
 
 
-  def fillTestingElement( self, testingElement, tests ):
+  def fillTestingElement( self, tests ):
     '''
     Parses tests and creates the proper XML elements.
     
@@ -155,22 +260,22 @@ class CDash( object ):
     
      [
      
-      # The name, Passed/Failed, Testlog, Execution Time [ms], ResultImage, BaselineImage, StartupTime [ms], FPS
-      ['Testname 1', 'passed', 'Testlog\n\nDone', 200, None, None, 616, 57.7],
-      ['Testname 2', 'failed', 'Testlog\n\nblabla', 5599, None, None, None]
+      # The name, Passed/Failed, Testlog, Execution Time [ms], ResultImage (base64), BaselineImage, StartupTime [ms], FPS, DifferenceImage
+      ['Testname 1', 'passed', 'Testlog\n\nDone', 200, None, None, 616, 57.7, None],
+      ['Testname 2', 'failed', 'Testlog\n\nblabla', 5599, None, None, None, None, None]
      
      ]
     '''
     xml = self.__xml
 
     # create the test list
-    test_list_element = xml.createElement( 'TestList' )
+    xml.start( 'TestList' )
 
     for t in tests:
       # .. add to the overall list
-      test_list_element.appendChild( self.createXMLNode( 'Test', t[0] ) )
+      xml.element( 'Test', t[0] )
 
-    testingElement.appendChild( test_list_element )
+    xml.end()
 
     # create entries for each test
     for t in tests:
@@ -179,95 +284,70 @@ class CDash( object ):
       test_status = t[1]
       test_log = t[2]
       test_execution_time = t[3]
-      test_result_image = t[4]
-      test_baseline_image = t[5]
-
 
-      # now parse each test
-      test_element = xml.createElement( 'Test' )
-
-      # passed/failed
-      test_element.setAttribute( 'Status', test_status )
+      # now parse each test, passed/failed
+      xml.start( 'Test', {'Status':test_status} )
 
       # name      
-      test_element.appendChild( self.createXMLNode( 'Name', test_name ) )
+      xml.element( 'Name', test_name )
 
       # results
+      xml.start( 'Results' )
 
       # first the test log
-      results_element = xml.createElement( 'Results' )
-      log_element = xml.createElement( 'Measurement' )
-      log_element.appendChild( self.createXMLNode( 'Value', test_log ) )
-
-      results_element.appendChild( log_element )
+      xml.start( 'Measurement' )
+      xml.element( 'Value', test_log )
+      xml.end()
 
       # then the execution time
-      execution_time_element = xml.createElement( 'NamedMeasurement' )
-      execution_time_element.setAttribute( 'name', 'Execution Time [s]' )
-      execution_time_element.setAttribute( 'type', 'numeric/double' )
-      execution_time_element.appendChild( self.createXMLNode( 'Value', test_execution_time ) )
-
-      results_element.appendChild( execution_time_element )
+      xml.start( 'NamedMeasurement', {'name':'Execution Time [s]', 'type':'numeric/double'} )
+      xml.element( 'Value', test_execution_time )
+      xml.end()
 
       # then the result and baseline images, if there are any
       if t[4]:
-        # convert to base64
-        imageResultPath = t[4]
-        imageResultBase64 = None
-        with open( imageResultPath, "rb" ) as im1:
-          imageResultBase64 = base64.b64encode( im1.read() )
-
-        namedImageResultElement = xml.createElement( 'NamedMeasurement' )
-        namedImageResultElement.setAttribute( 'type', 'image/png' )
-        namedImageResultElement.setAttribute( 'name', 'Result Image' )
-        namedImageResultElement.appendChild( self.createXMLNode( 'Value', str( imageResultBase64 ) ) )
-        results_element.appendChild( namedImageResultElement )
+        # this is base64 already
+        xml.start( 'NamedMeasurement', {'type':'image/png', 'name':'Result Image'} )
+        xml.element( 'Value', t[4] )
+        xml.end()
 
       if t[5]:
-        # convert to base64
-        imageBaselinePath = t[5]
-        imageBaselineBase64 = None
-        with open( imageBaselinePath, "rb" ) as im2:
-          imageBaselineBase64 = base64.b64encode( im2.read() )
-
-        namedImageBaselineElement = xml.createElement( 'NamedMeasurement' )
-        namedImageBaselineElement.setAttribute( 'type', 'image/png' )
-        namedImageBaselineElement.setAttribute( 'name', 'Baseline Image' )
-        namedImageBaselineElement.appendChild( self.createXMLNode( 'Value', str( imageBaselineBase64 ) ) )
-        results_element.appendChild( namedImageBaselineElement )
+        # convert to base64 while writing
+        xml.start( 'NamedMeasurement', {'type':'image/png', 'name':'Baseline Image'} )
+        xml.start( 'Value' )
+        xml.base64( t[5] )
+        xml.end()
+        xml.end()
+
+      if t[8]:
+        # convert to base64 while writing
+        xml.start( 'NamedMeasurement', {'type':'image/png', 'name':'Difference Image'} )
+        xml.start( 'Value' )
+        xml.base64( t[8] )
+        xml.end()
+        xml.end()
 
       # if we have measurements for the startup time, add these
       if t[6]:
-        startup_time_element = xml.createElement( 'NamedMeasurement' )
-        startup_time_element.setAttribute( 'name', 'Start-up Time [s]' )
-        startup_time_element.setAttribute( 'type', 'numeric/double' )
-        startup_time_element.appendChild( self.createXMLNode( 'Value', str( float( t[6] ) / 1000.0 ) ) )
-        results_element.appendChild( startup_time_element )
+        xml.start( 'NamedMeasurement', {'name':'Start-up Time [s]', 'type':'numeric/double'} )
+        xml.element( 'Value', str( float( t[6] ) / 1000.0 ) )
+        xml.end()
 
       # .. same for the FPS
       if t[7]:
-        fps_element = xml.createElement( 'NamedMeasurement' )
-        fps_element.setAttribute( 'name', 'FPS' )
-        fps_element.setAttribute( 'type', 'numeric/double' )
-        fps_element.appendChild( self.createXMLNode( 'Value', str( round( t[7], 1 ) ) ) )
-        results_element.appendChild( fps_element )
-
+        xml.start( 'NamedMeasurement', {'name':'FPS', 'type':'numeric/double'} )
+        xml.element( 'Value', str( round( t[7], 1 ) ) )
+        xml.end()
 
-      accurate_time_element = xml.createElement( 'NamedMeasurement' )
-      accurate_time_element.setAttribute( 'name', 'Accurate Execution Time [s]' )
-      accurate_time_element.setAttribute( 'type', 'text/string' )
-      accurate_time_element.appendChild( self.createXMLNode( 'Value', test_execution_time ) )
-      results_element.appendChild( accurate_time_element )
+      xml.start( 'NamedMeasurement', {'name':'Accurate Execution Time [s]', 'type':'text/string'} )
+      xml.element( 'Value', test_execution_time )
+      xml.end()
 
-      # .. append the results
-      test_element.appendChild( results_element )
+      # .. close the results and the test
+      xml.end()
+      xml.end()
 
-      # .. add it to 'Testing'
-      testingElement.appendChild( test_element )
-
-    return testingElement
-
-  def fillCoverageElement( self, coverageElement, cov_log ):
+  def fillCoverageElement( self, cov_log ):
     '''
     Parses a coverage log and creates the proper XML elements.
     
@@ -275,15 +355,15 @@ class CDash( object ):
     
      [
      
-      # filepath | lines_tested | lines_untested | percent_covered | lines
-      ['/X.js', 10, 0, 100, lines],
-      ['/X2.js', 21, 0, 100, lines],
+      # filepath | lines_tested | lines_untested | percent_covered | hits | code
+      ['/X.js', 10, 0, 100, hits, code],
+      ['/X2.js', 21, 0, 100, hits, code],
      
      ]    
 
     # 
-    # lines is a sublist, structured like this
-    #  line_number | count (-1 for ignored) | code     
+    # hits is an array with the count of each line (-1 for ignored) and code
+    # the list of the lines, the log can be any iterable
      
     '''
     xml = self.__xml
@@ -302,18 +382,15 @@ class CDash( object ):
       percentage = int( c[3] )
 
       # identification
-      file_element = xml.createElement( 'File' )
-      file_element.setAttribute( 'Name', os.path.split( file_name )[1] )
-      file_element.setAttribute( 'FullPath', file_name )
-      file_element.setAttribute( 'Covered', 'true' )
+      xml.start( 'File', {'Name':os.path.split( file_name )[1], 'FullPath':file_name, 'Covered':'true'} )
 
       # now the real values
-      file_element.appendChild( self.createXMLNode( 'LOCTested', str( lines_tested ) ) )
-      file_element.appendChild( self.createXMLNode( 'LOCUntested', str( lines_untested ) ) )
-      file_element.appendChild( self.createXMLNode( 'PercentCoverage', str( percentage ) ) )
+      xml.element( 'LOCTested', str( lines_tested ) )
+      xml.element( 'LOCUntested', str( lines_untested ) )
+      xml.element( 'PercentCoverage', str( percentage ) )
 
-      # ..append this entry
-      coverageElement.appendChild( file_element )
+      # ..close this entry
+      xml.end()
 
       # and update the total counters
       total_lines_tested += lines_tested
@@ -321,18 +398,17 @@ class CDash( object ):
 
     # and a summary for the whole submission
     total_lines = total_lines_tested + total_lines_untested
-    total_percentage = ( total_lines_tested / total_lines ) * 100
-    total_percentage = int( round( total_percentage ) )
-
-    coverageElement.appendChild( self.createXMLNode( 'LOCTested', str( total_lines_tested ) ) )
-    coverageElement.appendChild( self.createXMLNode( 'LOCUntested', str( total_lines_untested ) ) )
-    coverageElement.appendChild( self.createXMLNode( 'LOC', str( total_lines ) ) )
-    coverageElement.appendChild( self.createXMLNode( 'PercentCoverage', str( total_percentage ) ) )
+    total_percentage = 0
+    if total_lines:
+      total_percentage = int( round( 100.0 * total_lines_tested / total_lines ) )
 
-    return coverageElement
+    xml.element( 'LOCTested', str( total_lines_tested ) )
+    xml.element( 'LOCUntested', str( total_lines_untested ) )
+    xml.element( 'LOC', str( total_lines ) )
+    xml.element( 'PercentCoverage', str( total_percentage ) )
 
 
-  def fillCoverageLogElement( self, coverageLogElement, cov_log ):
+  def fillCoverageLogElement( self, cov_log ):
     '''
     Parses a coverage log and creates the proper XML elements.
     
@@ -340,15 +416,15 @@ class CDash( object ):
     
      [
      
-      # filepath | lines_tested | lines_untested | percent_covered | lines
-      ['/X.js', 10, 0, 100, lines],
-      ['/X2.js', 21, 0, 100, lines],
+      # filepath | lines_tested | lines_untested | percent_covered | hits | code
+      ['/X.js', 10, 0, 100, hits, code],
+      ['/X2.js', 21, 0, 100, hits, code],
      
      ]    
 
     # 
-    # lines is a sublist, structured like this
-    #  line_number | count (-1 for ignored) | code     
+    # hits is an array with the count of each line (-1 for ignored) and code
+    # the list of the lines, the log can be any iterable
      
     '''
     xml = self.__xml
@@ -359,33 +435,24 @@ class CDash( object ):
       file_name = c[0]
 
       # identification
-      file_element = xml.createElement( 'File' )
-      file_element.setAttribute( 'Name', os.path.split( file_name )[1] )
-      file_element.setAttribute( 'FullPath', file_name )
+      xml.start( 'File', {'Name':os.path.split( file_name )[1], 'FullPath':file_name} )
 
       # now for each LOC
-      for l in c[4]:
-
-        line_element = self.createXMLNode( 'Line', l[2] )
-        line_element.setAttribute( 'Number', str( l[0] - 1 ) ) # there is the offset of 1
-        line_element.setAttribute( 'Count', str( l[1] ) )
+      for i, ( hits, code ) in enumerate( zip( c[4], c[5] ) ):
 
-        file_element.appendChild( line_element )
+        # there is the offset of 1
+        xml.element( 'Line', code, {'Number':str( i - 1 ), 'Count':str( hits )} )
 
-      # ..append this entry
-      coverageLogElement.appendChild( file_element )
+      # ..close this entry
+      xml.end()
 
-    return coverageLogElement
 
-
-  def createSiteElement( self, build ):
+  def startSiteElement( self, build ):
     '''
-    Creates the top level CDash Site Element.
-    
-    Returns the <Site> element.
+    Starts the top level CDash Site Element.
     '''
 
-    # grab the current xml structure
+    # grab the current xml writer
     xml = self.__xml
 
     # check if we run against a build tree
@@ -406,21 +473,13 @@ class CDash( object ):
     # grab the current buildtime
     buildtime = datetime.now().strftime( "%Y%m%d-%H%M" )
 
-    siteElement = xml.createElement( 'Site' )
-    # .. and the attributes for it
-    siteElement.setAttribute( 'BuildName', os_platform + '-' + os_version + '-' + type )
-    siteElement.setAttribute( 'BuildStamp', buildtime + '-${BUILDTYPE}' )
-    siteElement.setAttribute( 'Hostname', hostname )
-    siteElement.setAttribute( 'Name', hostname )
+    # .. with the attributes for it
+    xml.start( 'Site', {'BuildName':os_platform + '-' + os_version + '-' + type, 'BuildStamp':buildtime + '-${BUILDTYPE}', 'Hostname':hostname, 'Name':hostname} )
 
-    return siteElement
 
-
-  def createNestedElement( self, type ):
+  def startNestedElement( self, type ):
     '''
-    Creates a nested element of a certain type.
-    
-    Returns the nested element.    
+    Starts a nested element of a certain type.
     '''
 
     xml = self.__xml
@@ -428,40 +487,38 @@ class CDash( object ):
     #
     # create <Build> or <Testing> or <Coverage>
     #
-    nestedElement = xml.createElement( type )
+    xml.start( type )
 
     #
     # <StartDateTime>
-    nestedElement.appendChild( self.createXMLNode( 'StartDateTime', strftime( "%b %d %H:%M %Z", gmtime() ) ) )
+    xml.element( 'StartDateTime', strftime( "%b %d %H:%M %Z", gmtime() ) )
 
     #
     # <EndDateTime>
-    nestedElement.appendChild( self.createXMLNode( 'EndDateTime', strftime( "%b %d %H:%M %Z", gmtime() ) ) )
+    xml.element( 'EndDateTime', strftime( "%b %d %H:%M %Z", gmtime() ) )
 
     if type == 'Build':
       #
       # <StartBuildTime>
-      nestedElement.appendChild( self.createXMLNode( 'StartBuildTime', str ( time() ) ) )
+      xml.element( 'StartBuildTime', str ( time() ) )
 
       #
       # <BuildCommand>
-      nestedElement.appendChild( self.createXMLNode( 'BuildCommand', ' '.join( sys.argv ) ) )
+      xml.element( 'BuildCommand', ' '.join( sys.argv ) )
 
       #
       # <EndBuildTime>
-      nestedElement.appendChild( self.createXMLNode( 'EndBuildTime', str ( time() ) ) )
+      xml.element( 'EndBuildTime', str ( time() ) )
 
     if type == 'Testing':
       #
       # <StartTestTime>
-      nestedElement.appendChild( self.createXMLNode( 'StartTestTime', str ( time() ) ) )
+      xml.element( 'StartTestTime', str ( time() ) )
 
       #
       # <EndTestTime>
-      nestedElement.appendChild( self.createXMLNode( 'EndTestTime', str ( time() ) ) )
+      xml.element( 'EndTestTime', str ( time() ) )
 
     #
     # <ElapsedMinutes>
-    nestedElement.appendChild( self.createXMLNode( 'ElapsedMinutes', '0' ) )
-
-    return nestedElement
+    xml.element( 'ElapsedMinutes', '0' )
@@ -0,0 +1,510 @@
+#
+# The XBUILD compiler server.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import json
+import os
+import socket
+import SocketServer
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import config
+from _colors import Colors
+
+#
+#
+#
+class CompilerClient( object ):
+  '''
+  Submits compile jobs to a running compiler server.
+  '''
+
+  def __init__( self ):
+    '''
+    '''
+    self.returncode = None
+
+
+  def available( self ):
+    '''
+    Check if a compiler server is listening.
+    '''
+    try:
+      s = socket.create_connection( config.COMPILER_SERVER_ADDRESS, 0.5 )
+      s.close()
+      return True
+    except socket.error:
+      return False
+
+
+  def request( self, job ):
+    '''
+    Send a job to the server and yield its replies.
+    '''
+    s = socket.create_connection( config.COMPILER_SERVER_ADDRESS )
+
+    try:
+      s.sendall( json.dumps( job ) + '\n' )
+
+      for reply in s.makefile( 'r' ):
+        yield json.loads( reply )
+
+    finally:
+      s.close()
+
+
+  def compile( self, arguments ):
+    '''
+    Compile using closurebuilder arguments and yield the output lines, just
+    like closurebuilder would print them. The exit code is stored in
+    returncode afterwards.
+    '''
+    self.returncode = None
+
+    for reply in self.request( {'command':'compile', 'arguments':arguments, 'cwd':os.getcwd()} ):
+
+      if 'exit' in reply:
+        self.returncode = reply['exit']
+        break
+
+      yield reply['line'].encode( 'utf-8' ) + '\n'
+
+    if self.returncode is None:
+      # the server went away
+      self.returncode = 1
+
+
+  def warm( self ):
+    '''
+    Check if the server keeps the compiler JVM warm.
+    '''
+    warm = False
+
+    for reply in self.request( {'command':'status'} ):
+      warm = reply.get( 'warm', False )
+
+    return warm
+
+
+  def stop( self ):
+    '''
+    Shutdown the server.
+    '''
+    for reply in self.request( {'command':'stop'} ):
+      pass
+
+
+#
+#
+#
+class CompilerTCPServer( SocketServer.ThreadingTCPServer ):
+  '''
+  The TCP server which handles each job in its own thread.
+  '''
+  allow_reuse_address = True
+  daemon_threads = True
+
+
+#
+#
+#
+class CompilerServer( object ):
+  '''
+  A long-lived compiler server which keeps the closure dependency scan and,
+  if nailgun is available, the compiler JVM warm between builds. Nailgun is
+  not part of the tree, see lib/nailgun/README for how to set it up.
+
+  Jobs are submitted by the CompilerClient using the same arguments as for
+  closurebuilder. Any local user can connect, so jobs may only read and write
+  files below config.SOFTWARE_PATH and only pass the COMPILER_FLAGS to the
+  compiler.
+  '''
+
+  # the compiler flags a job may use, with or without a value
+  COMPILER_FLAGS = ['--compilation_level', '--debug', '--define', '--formatting', '--js', '--jscomp_error', '--jscomp_off', '--jscomp_warning', '--summary_detail_level', '--warning_level']
+
+  def __init__( self ):
+    '''
+    '''
+    # the scanned closure sources as path -> (mtime, size, source)
+    self.__sources = {}
+    self.__sourcesLock = threading.Lock()
+
+    self.__nailgun = None
+    self.__server = None
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+    '''
+    if options and options.stop:
+
+      client = CompilerClient()
+      if client.available():
+        client.stop()
+        print Colors.ORANGE + 'Compiler server stopped.' + Colors._CLEAR
+      else:
+        print Colors.RED + 'No compiler server running.' + Colors._CLEAR
+
+      return
+
+    # we need to import some closure python classes here
+    sys.path.append( config.CLOSURELIBRARY_PYTHON_PATH )
+
+    self.startNailgun()
+
+    self.__server = CompilerTCPServer( config.COMPILER_SERVER_ADDRESS, self.handlerClass() )
+
+    print Colors.ORANGE + 'Compiler server listening on ' + Colors.CYAN + '%s:%d' % config.COMPILER_SERVER_ADDRESS + Colors._CLEAR
+
+    try:
+      self.__server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.__server.server_close()
+      self.stopNailgun()
+
+    print Colors.ORANGE + 'Compiler server stopped.' + Colors._CLEAR
+
+
+  def handlerClass( self ):
+    '''
+    Return a request handler class bound to this server.
+    '''
+    server = self
+
+    class Handler( SocketServer.StreamRequestHandler ):
+
+      def handle( self ):
+
+        request = self.rfile.readline()
+        if not request:
+          # just a check if we are alive
+          return
+
+        job = json.loads( request )
+
+        def reply( message ):
+          self.wfile.write( json.dumps( message ) + '\n' )
+          self.wfile.flush()
+
+        if job['command'] == 'status':
+          reply( {'warm':server.warm(), 'exit':0} )
+
+        elif job['command'] == 'stop':
+          reply( {'exit':0} )
+          # shutdown blocks until serve_forever returns, so do it elsewhere
+          threading.Thread( target=server.shutdown ).start()
+
+        elif job['command'] == 'compile':
+          try:
+            returncode = server.compile( [str( a ) for a in job['arguments']], job['cwd'], lambda line: reply( {'line':line} ) )
+          except Exception as e:
+            reply( {'line':'ERROR: ' + str( e )} )
+            returncode = 1
+
+          reply( {'exit':returncode} )
+
+    return Handler
+
+
+  def shutdown( self ):
+    '''
+    Stop serving.
+    '''
+    self.__server.shutdown()
+
+
+  def warm( self ):
+    '''
+    Check if the compiler JVM is kept warm.
+    '''
+    return self.__nailgun is not None
+
+
+  def startNailgun( self ):
+    '''
+    Start a nailgun server hosting the compiler, if nailgun is installed.
+    '''
+    if not os.path.isfile( config.NAILGUN_PATH ):
+      print Colors.YELLOW + 'Nailgun not found at ' + config.NAILGUN_PATH + ', the compiler JVM will be started for every job.' + Colors._CLEAR
+      print Colors.YELLOW + 'See ' + os.path.join( os.path.dirname( config.NAILGUN_PATH ), 'README' ) + ' for how to set it up.' + Colors._CLEAR
+      return
+
+    classpath = os.pathsep.join( [config.NAILGUN_PATH, config.CLOSURECOMPILER_PATH] )
+    address = '%s:%d' % ( socket.gethostbyname( config.NAILGUN_ADDRESS[0] ), config.NAILGUN_ADDRESS[1] )
+
+    self.__nailgun = subprocess.Popen( ['java', '-server', '-cp', classpath, 'com.martiansoftware.nailgun.NGServer', address] )
+
+    # wait until the JVM accepts connections
+    for i in range( 100 ):
+      try:
+        socket.create_connection( config.NAILGUN_ADDRESS, 0.5 ).close()
+        print Colors.PURPLE + 'Compiler JVM started.' + Colors._CLEAR
+        return
+      except socket.error:
+        time.sleep( 0.1 )
+
+    print Colors.RED + 'Could not connect to nailgun, the compiler JVM will be started for every job.' + Colors._CLEAR
+    self.stopNailgun()
+
+
+  def stopNailgun( self ):
+    '''
+    Shutdown the nailgun server.
+    '''
+    if not self.__nailgun:
+      return
+
+    try:
+      self.nail( 'ng-stop', [], os.getcwd(), lambda line: None )
+    except socket.error:
+      self.__nailgun.terminate()
+
+    self.__nailgun.wait()
+    self.__nailgun = None
+
+
+  def sendChunk( self, s, type, payload='' ):
+    '''
+    Send a nailgun protocol chunk.
+    '''
+    s.sendall( struct.pack( '>ic', len( payload ), type ) + payload )
+
+
+  def receive( self, s, length ):
+    '''
+    Receive exactly length bytes.
+    '''
+    data = ''
+    while len( data ) < length:
+      block = s.recv( length - len( data ) )
+      if not block:
+        raise socket.error( 'nailgun connection closed' )
+      data += block
+
+    return data
+
+
+  def nail( self, command, arguments, cwd, log ):
+    '''
+    Run a command in the nailgun JVM. Stderr lines are passed to log.
+
+    Returns the exit code and the stdout output.
+    '''
+    s = socket.create_connection( config.NAILGUN_ADDRESS )
+
+    try:
+      for a in arguments:
+        self.sendChunk( s, 'A', a )
+      self.sendChunk( s, 'D', cwd )
+      self.sendChunk( s, 'C', command )
+
+      stdout = []
+      stderr = ''
+
+      while True:
+
+        length, type = struct.unpack( '>ic', self.receive( s, 5 ) )
+        payload = self.receive( s, length )
+
+        if type == '1':
+          stdout.append( payload )
+
+        elif type == '2':
+          stderr += payload
+          lines = stderr.split( '\n' )
+          stderr = lines.pop()
+          for l in lines:
+            log( l )
+
+        elif type == 'S':
+          # the compiler never reads from stdin
+          self.sendChunk( s, '.' )
+
+        elif type == 'X':
+          if stderr:
+            log( stderr )
+          return int( payload.strip() ), ''.join( stdout )
+
+    finally:
+      s.close()
+
+
+  def java( self, arguments, cwd, log ):
+    '''
+    Run the compiler in a new JVM. Stderr lines are passed to log.
+
+    Returns the exit code and the stdout output.
+    '''
+    command = ['java', '-jar', config.CLOSURECOMPILER_PATH]
+    command.extend( arguments )
+
+    process = subprocess.Popen( command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+
+    # read stdout in the background to avoid blocking on full pipes
+    stdout = []
+    reader = threading.Thread( target=lambda: stdout.append( process.stdout.read() ) )
+    reader.start()
+
+    for line in iter( process.stderr.readline, '' ):
+      log( line.rstrip( '\n' ) )
+
+    reader.join()
+
+    return process.wait(), ''.join( stdout )
+
+
+  def scan( self, roots, inputs ):
+    '''
+    Scan the roots for closure sources, re-reading only changed files.
+    '''
+    import closurebuilder
+    import treescan
+
+    paths = set( inputs )
+    for r in roots:
+      paths.update( treescan.ScanTreeForJsFiles( r ) )
+
+    with self.__sourcesLock:
+
+      sources = {}
+
+      for p in paths:
+
+        st = os.stat( p )
+
+        cached = self.__sources.get( p )
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+          sources[p] = cached
+        else:
+          sources[p] = ( st.st_mtime, st.st_size, closurebuilder._PathSource( p ) )
+
+      self.__sources = sources
+
+      return [s[2] for s in sources.itervalues()]
+
+
+  def inside( self, path ):
+    '''
+    Check if a path is below config.SOFTWARE_PATH, following symlinks.
+    '''
+    root = os.path.realpath( config.SOFTWARE_PATH )
+    path = os.path.realpath( path )
+
+    return path == root or path.startswith( root + os.sep )
+
+
+  def allowed( self, flag, cwd ):
+    '''
+    Check if a job in cwd may pass a flag to the compiler.
+    '''
+    name, separator, value = flag.partition( '=' )
+
+    if name not in self.COMPILER_FLAGS:
+      return False
+
+    if name == '--js':
+      # no sources from elsewhere
+      return self.inside( os.path.join( cwd, value ) )
+
+    return True
+
+
+  def compile( self, arguments, cwd, log ):
+    '''
+    Perform a compile job with the given closurebuilder arguments. Output is
+    passed to log, line by line.
+
+    Returns the exit code.
+    '''
+    import closurebuilder
+    import depstree
+
+    if not os.path.isabs( cwd ) or not self.inside( cwd ):
+      log( 'ERROR: The compiler server only compiles in ' + config.SOFTWARE_PATH + '.' )
+      return 2
+
+    try:
+      options, args = closurebuilder._GetOptionsParser().parse_args( arguments )
+    except SystemExit:
+      log( 'ERROR: Invalid compiler arguments.' )
+      return 2
+
+    if not options.output_file or options.output_mode != 'compiled':
+      log( 'ERROR: The compiler server only supports compiled output to a file.' )
+      return 2
+
+    inputs = [os.path.join( cwd, i ) for i in ( options.inputs or [] ) + args]
+    roots = [os.path.join( cwd, r ) for r in options.roots]
+    output = os.path.join( cwd, options.output_file )
+
+    outside = [p for p in inputs + roots + [output] if not self.inside( p )]
+    if outside:
+      log( 'ERROR: The compiler server only uses files in ' + config.SOFTWARE_PATH + ', not ' + outside[0] + '.' )
+      return 2
+
+    flags = [f for f in options.compiler_flags or [] if not self.allowed( f, cwd )]
+    if flags:
+      log( 'ERROR: The compiler server does not allow the compiler flag ' + flags[0] + '.' )
+      return 2
+
+    log( 'Scanning paths...' )
+    sources = self.scan( roots, inputs )
+    log( '%s sources scanned.' % len( sources ) )
+
+    log( 'Building dependency tree..' )
+    tree = depstree.DepsTree( sources )
+
+    namespaces = set( options.namespaces )
+    for i in inputs:
+
+      matches = [s for s in sources if os.path.abspath( s.GetPath() ) == os.path.abspath( i )]
+      if not matches:
+        log( 'ERROR: No source matched input ' + i )
+        return 1
+
+      namespaces.update( matches[0].provides )
+
+    # the closure library base file must go first
+    base = [s for s in sources if os.path.basename( s.GetPath() ) == 'base.js' and s.provides == set( ['goog'] )]
+    if len( base ) != 1:
+      log( 'ERROR: Could not find the closure base file.' )
+      return 1
+
+    try:
+      deps = base + tree.GetDependencies( namespaces )
+    except Exception as e:
+      log( 'ERROR: ' + str( e ) )
+      return 1
+
+    compilerArguments = []
+    for d in deps:
+      compilerArguments.extend( ['--js', d.GetPath()] )
+    compilerArguments.extend( options.compiler_flags or [] )
+
+    log( 'Compiling with the following command: ' + ' '.join( compilerArguments ) )
+
+    if self.__nailgun:
+      returncode, compiled = self.nail( 'com.google.javascript.jscomp.CommandLineRunner', compilerArguments, cwd, log )
+    else:
+      returncode, compiled = self.java( compilerArguments, cwd, log )
+
+    if returncode != 0:
+      log( 'JavaScript compilation failed.' )
+      return 1
+
+    with open( output, 'w' ) as f:
+      f.write( compiled )
+
+    log( 'JavaScript compilation succeeded.' )
+
+    return 0
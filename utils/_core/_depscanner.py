@@ -0,0 +1,350 @@
+#
+# The XBUILD dependency scanner.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import json
+import multiprocessing
+import os
+import re
+
+import config
+
+# the same patterns closure's source.py uses
+PROVIDE_REGEX = re.compile( r'^\s*goog\.provide\(\s*[\'"](.+)[\'"]\s*\)', re.MULTILINE )
+REQUIRE_REGEX = re.compile( r'^\s*goog\.require\(\s*[\'"](.+)[\'"]\s*\)', re.MULTILINE )
+COMMENT_REGEX = re.compile( r'/\*.*?\*/', re.DOTALL )
+GOOG_BASE_LINE = 'var goog = goog || {}; // Identifies this file as the Closure base.'
+
+#
+#
+#
+def scanFile( filename ):
+  '''
+  Return the provided and required namespaces of a file. This runs in worker
+  processes as well.
+  '''
+  with open( filename, 'r' ) as f:
+    content = f.read()
+
+  # ignore everything in block comments
+  content = COMMENT_REGEX.sub( '', content )
+
+  provides = sorted( set( PROVIDE_REGEX.findall( content ) ) )
+  requires = sorted( set( REQUIRE_REGEX.findall( content ) ) )
+
+  # closure's base file implicitly provides 'goog'
+  if GOOG_BASE_LINE in content.splitlines():
+    provides.append( 'goog' )
+
+  return provides, requires
+
+
+#
+#
+#
+class DepsGraph( object ):
+  '''
+  The goog.provide/goog.require graph of a set of files.
+  '''
+
+  def __init__( self, files ):
+    '''
+    files maps each filename to a ( provides, requires ) tuple.
+    '''
+    self.__files = files
+
+    # namespace -> filename
+    self.__providers = {}
+    for f in sorted( files ):
+      for p in files[f][0]:
+        self.__providers[p] = f
+
+    # filename -> filenames it depends on, and the other way round
+    self.__edges = {}
+    self.__reverseEdges = dict( [( f, set() ) for f in files] )
+
+    for f in files:
+      self.__edges[f] = set( [self.__providers[r] for r in files[f][1] if self.__providers.has_key( r )] )
+      for d in self.__edges[f]:
+        self.__reverseEdges[d].add( f )
+
+
+  def files( self ):
+    '''
+    Return all files of the graph.
+    '''
+    return sorted( self.__files.keys() )
+
+
+  def provides( self, filename ):
+    '''
+    Return the namespaces provided by a file.
+    '''
+    return self.__files[filename][0]
+
+
+  def requires( self, filename ):
+    '''
+    Return the namespaces required by a file.
+    '''
+    return self.__files[filename][1]
+
+
+  def provider( self, namespace ):
+    '''
+    Return the file providing a namespace or None.
+    '''
+    return self.__providers.get( namespace )
+
+
+  def missing( self ):
+    '''
+    Return the required namespaces which are provided by no file as a
+    dictionary namespace -> requiring files.
+    '''
+    missing = {}
+    for f in self.__files:
+      for r in self.__files[f][1]:
+        if not self.__providers.has_key( r ):
+          missing.setdefault( r, [] ).append( f )
+
+    return missing
+
+
+  def __walk( self, filenames, edges, cut ):
+    '''
+    Return all files transitively reachable from the given files without
+    passing through the cut files.
+    '''
+    visited = set()
+    stack = list( filenames )
+
+    while stack:
+      f = stack.pop()
+      for d in edges.get( f, () ):
+        if d not in visited and d not in cut:
+          visited.add( d )
+          stack.append( d )
+
+    return visited
+
+
+  def dependencies( self, filenames, cut=() ):
+    '''
+    Return all files the given files transitively depend on, optionally
+    without passing through the cut files.
+    '''
+    return self.__walk( filenames, self.__edges, cut )
+
+
+  def reverseDependencies( self, filenames, cut=() ):
+    '''
+    Return all files which transitively depend on the given files, optionally
+    without passing through the cut files.
+    '''
+    return self.__walk( filenames, self.__reverseEdges, cut )
+
+
+  def order( self ):
+    '''
+    Return all files in topological order, dependencies first. Files which
+    are part of a cycle are ordered arbitrarily among each other.
+    '''
+    order = []
+    visited = set()
+
+    for f in sorted( self.__files ):
+
+      if f in visited:
+        continue
+
+      # iterative depth first search
+      visited.add( f )
+      stack = [( f, iter( sorted( self.__edges[f] ) ) )]
+
+      while stack:
+
+        node, children = stack[-1]
+
+        for c in children:
+          if c not in visited:
+            visited.add( c )
+            stack.append( ( c, iter( sorted( self.__edges[c] ) ) ) )
+            break
+        else:
+          stack.pop()
+          order.append( node )
+
+    return order
+
+
+  def cycles( self ):
+    '''
+    Return all dependency cycles as lists of files.
+
+    This uses Tarjan's strongly connected components algorithm.
+    '''
+    index = {}
+    lowlink = {}
+    onstack = set()
+    stack = []
+    cycles = []
+    counter = [0]
+
+    for f in sorted( self.__files ):
+
+      if f in index:
+        continue
+
+      # iterative version to avoid the recursion limit
+      work = [( f, iter( sorted( self.__edges[f] ) ) )]
+      index[f] = lowlink[f] = counter[0]
+      counter[0] += 1
+      stack.append( f )
+      onstack.add( f )
+
+      while work:
+
+        node, children = work[-1]
+
+        for c in children:
+
+          if c not in index:
+            index[c] = lowlink[c] = counter[0]
+            counter[0] += 1
+            stack.append( c )
+            onstack.add( c )
+            work.append( ( c, iter( sorted( self.__edges[c] ) ) ) )
+            break
+
+          elif c in onstack:
+            lowlink[node] = min( lowlink[node], index[c] )
+
+        else:
+
+          work.pop()
+
+          if work:
+            parent = work[-1][0]
+            lowlink[parent] = min( lowlink[parent], lowlink[node] )
+
+          if lowlink[node] == index[node]:
+
+            component = []
+            while True:
+              c = stack.pop()
+              onstack.discard( c )
+              component.append( c )
+              if c == node:
+                break
+
+            if len( component ) > 1 or node in self.__edges[node]:
+              cycles.append( sorted( component ) )
+
+    return cycles
+
+
+#
+#
+#
+class DepsScanner( object ):
+  '''
+  Scans files for goog.provide and goog.require statements.
+
+  The results are cached per file by mtime and size, files which changed are
+  scanned in parallel.
+  '''
+
+  # scan in worker processes only if there is enough to do
+  PARALLEL_THRESHOLD = 64
+
+  def __init__( self, cachefile=None ):
+    '''
+    '''
+    if not cachefile:
+      cachefile = config.DEPS_CACHE_PATH
+
+    self.__cachefile = cachefile
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+
+    options
+      [files]
+
+    Returns the DepsGraph of the files.
+    '''
+    filenames = options[0]
+
+    cache = self.load()
+
+    files = {}
+    changed = []
+
+    for f in filenames:
+
+      st = os.stat( f )
+
+      entry = cache.get( f )
+      if entry and entry[0] == st.st_mtime and entry[1] == st.st_size:
+        files[f] = ( entry[2], entry[3] )
+      else:
+        changed.append( ( f, st ) )
+
+    if changed:
+
+      if len( changed ) >= self.PARALLEL_THRESHOLD:
+        pool = multiprocessing.Pool()
+        try:
+          results = pool.map( scanFile, [c[0] for c in changed] )
+        finally:
+          pool.close()
+          pool.join()
+      else:
+        results = [scanFile( c[0] ) for c in changed]
+
+      for ( f, st ), ( provides, requires ) in zip( changed, results ):
+        files[f] = ( provides, requires )
+        cache[f] = [st.st_mtime, st.st_size, provides, requires]
+
+      self.save( cache )
+
+    return DepsGraph( files )
+
+
+  def load( self ):
+    '''
+    Load the scan cache.
+    '''
+    if not os.path.isfile( self.__cachefile ):
+      return {}
+
+    try:
+      with open( self.__cachefile, 'r' ) as f:
+        cache = json.load( f )
+    except ValueError:
+      # a broken cache is no cache
+      return {}
+
+    # json gives us unicode strings
+    for f in cache:
+      cache[f][2] = [str( p ) for p in cache[f][2]]
+      cache[f][3] = [str( r ) for r in cache[f][3]]
+
+    return dict( [( str( f ), cache[f] ) for f in cache] )
+
+
+  def save( self, cache ):
+    '''
+    Save the scan cache.
+    '''
+    tmpfile = self.__cachefile + '.tmp'
+
+    with open( tmpfile, 'w' ) as f:
+      json.dump( cache, f )
+
+    os.rename( tmpfile, self.__cachefile )
@@ -5,14 +5,14 @@
 #
 
 import os
-import stat
 import sys
-import subprocess
 
 import config
 from _cdash import CDash
 from _colors import Colors
+from _depscanner import DepsScanner
 from _jsfilefinder import JSFileFinder
+from _watcher import Watcher
 
 #
 #
@@ -21,6 +21,13 @@ class DepsGenerator( object ):
   '''
   '''
 
+  def __init__( self ):
+    '''
+    '''
+    # the dependencies of the last generated file
+    self.__dependencies = None
+
+
   def run( self, options=None ):
     '''
     Performs the action.
@@ -28,53 +35,79 @@ class DepsGenerator( object ):
 
     print 'Generating dependency file for ' + config.SOFTWARE_SHORT + '...'
 
+    self.generate()
+
+    # all good and done
+    print Colors.ORANGE + 'Dependency file ' + Colors.PURPLE + config.DEPS_OUTPUT_PATH + Colors.ORANGE + ' generated. ' + Colors._CLEAR
+    print Colors.ORANGE + 'Usage:' + Colors._CLEAR
+    print Colors.CYAN + '  <script type="text/javascript" src="' + os.path.relpath( config.CLOSUREGOOGBASE_PATH, os.path.join( config.SOFTWARE_PATH, '../' ) ) + '"></script>' + Colors._CLEAR
+    print Colors.CYAN + '  <script type="text/javascript" src="' + os.path.relpath( config.DEPS_OUTPUT_PATH, os.path.join( config.SOFTWARE_PATH, '../' ) ) + '"></script>' + Colors._CLEAR
+
+    if options.watch:
+      # regenerate on every change
+      watcher = Watcher()
+      watcher.run( [self.update] )
+
+
+  def update( self, changed ):
+    '''
+    Regenerate the dependency file after the given files changed.
+    '''
+    if self.generate():
+      print Colors.ORANGE + 'Dependency file ' + Colors.PURPLE + config.DEPS_OUTPUT_PATH + Colors.ORANGE + ' updated. ' + Colors._CLEAR
+    else:
+      print Colors.ORANGE + 'No goog.provide or goog.require changed.' + Colors._CLEAR
+
+
+  def generate( self ):
+    '''
+    Write the dependency file, if the dependencies changed since the last
+    call.
+
+    Returns True if the file was written.
+    '''
     # grab all js files
     filefinder = JSFileFinder()
     jsfiles = filefinder.run( ['USE_INCLUDES'] )
 
-    arguments = []
+    # scan the files for goog.provide and goog.require
+    depsscanner = DepsScanner()
+    graph = depsscanner.run( [jsfiles] )
 
     # closure base path
     basepath = os.path.dirname( os.path.dirname( config.CLOSUREDEPSWRITER_PATH ) )
 
-    # set the output file
-    arguments.extend( ['--output_file=' + config.DEPS_OUTPUT_PATH] )
+    # report cycles and unknown namespaces in red since they indicate errors
+    for c in graph.cycles():
+      print Colors.RED + 'Circular dependency: ' + ' -> '.join( [os.path.relpath( f, config.SOFTWARE_PATH ) for f in c] ) + Colors._CLEAR
+
+    missing = graph.missing()
+    for m in sorted( missing ):
+      if m.startswith( 'goog.' ):
+        # these are provided by the closure library
+        continue
+      print Colors.RED + 'Namespace ' + m + ' is required by ' + ', '.join( [os.path.relpath( f, config.SOFTWARE_PATH ) for f in missing[m]] ) + ' but never provided.' + Colors._CLEAR
 
-    # add js files
+    # write the deps file just like the closure depswriter
+    lines = []
     for j in jsfiles:
-      arguments.extend( ['--path_with_depspath=' + j + ' ' + os.path.relpath( j, basepath )] )
-
-    #
-    # call the closure depswriter
-    #
-    
-    # make sure the depswriter is executable
-    st = os.stat( config.CLOSUREDEPSWRITER_PATH )
-    os.chmod( config.CLOSUREDEPSWRITER_PATH, st.st_mode | stat.S_IEXEC )    
-    
-    command = [config.CLOSUREDEPSWRITER_PATH]
-    command.extend( arguments )
-
-    process = subprocess.Popen( command, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
-
-    # no output is good
-    noOutput = True
-
-    # print any output in red since it probably indicates an error
-    for line in process.stdout:
-      line = line.strip( '\n' )
-      print Colors.RED + line + Colors._CLEAR
-      noOutput = False
-
-    if noOutput:
-
-      # all good and done
-      print Colors.ORANGE + 'Dependency file ' + Colors.PURPLE + config.DEPS_OUTPUT_PATH + Colors.ORANGE + ' generated. ' + Colors._CLEAR
-      print Colors.ORANGE + 'Usage:' + Colors._CLEAR
-      print Colors.CYAN + '  <script type="text/javascript" src="' + os.path.relpath( config.CLOSUREGOOGBASE_PATH, os.path.join( config.SOFTWARE_PATH, '../' ) ) + '"></script>' + Colors._CLEAR
-      print Colors.CYAN + '  <script type="text/javascript" src="' + os.path.relpath( config.DEPS_OUTPUT_PATH, os.path.join( config.SOFTWARE_PATH, '../' ) ) + '"></script>' + Colors._CLEAR
+      if graph.provides( j ):
+        lines.append( ( os.path.relpath( j, basepath ).replace( os.sep, '/' ), graph.provides( j ), graph.requires( j ) ) )
 
-    else:
+    lines.sort()
+
+    if lines == self.__dependencies:
+      # nothing to do
+      return False
+
+    with open( config.DEPS_OUTPUT_PATH, 'w' ) as f:
+
+      f.write( '// This file was autogenerated by %s.\n' % sys.argv[0] )
+      f.write( '// Please do not edit.\n' )
+
+      for path, provides, requires in lines:
+        f.write( 'goog.addDependency(\'%s\', %s, %s);\n' % ( path, provides, requires ) )
+
+    self.__dependencies = lines
 
-      # maybe an error
-      print Colors.ORANGE + 'Could not generate dependency file.' + Colors._CLEAR
+    return True
@@ -4,14 +4,29 @@
 # (c) 2012 The XTK Developers <dev@goXTK.com>
 #
 
+import hashlib
+import json
+import multiprocessing
 import os
-import sys
 import subprocess
 import shutil
 
 import config
 from _colors import Colors
 from _jsfilefinder import JSFileFinder
+from _watcher import Watcher
+
+#
+#
+#
+def parseFile( filename ):
+  '''
+  Find the classes and symbols of a single file. This runs in a worker
+  process.
+  '''
+  documenter = Documenter()
+  return documenter.parse( filename )
+
 
 #
 #
@@ -38,9 +53,23 @@ class Documenter( object ):
   TYPES = {'undefined':-1, 'constructor':0, 'static':5, 'function':3, 'gettersetter':2, 'property':1}
   PRIVACY = {'private':0, 'public':1}
 
+  # parse in worker processes only if there is enough to do
+  PARALLEL_THRESHOLD = 16
+
+  # the symbol index
+  SEARCH_FOLDER = 'search'
+  SEARCH_FIELDS = ['class', 'member', 'type', 'privacy', 'params', 'inherited', 'source']
+
   def __init__( self ):
     '''
     '''
+    self.reset()
+
+
+  def reset( self ):
+    '''
+    Forget all files, classes and symbols.
+    '''
     # create global dictionaries to track all files, classes and symbols
 
     self.__totalSymbols = 0
@@ -50,6 +79,9 @@ class Documenter( object ):
     self.__inheritances = {}
     self.__exportations = {}
 
+    # the class which defines each symbol, by the id of the symbol
+    self.__owners = {}
+
     self.__leftMenu = {}
 
 
@@ -59,262 +91,362 @@ class Documenter( object ):
     '''
     print 'Documenting ' + config.SOFTWARE_SHORT + '...'
 
-    if options.remove:
+    if options.remove and os.path.exists( config.DOC_OUTPUT_PATH ):
       # remove old documentation, if requested
       print Colors.ORANGE + 'Removing existing documentation.. ' + Colors.PURPLE + 'Done!' + Colors._CLEAR
       shutil.rmtree( config.DOC_OUTPUT_PATH )
 
-    if os.path.exists( config.DOC_OUTPUT_PATH ):
-      # output folder exists, we can not continue
-      print Colors.RED + 'Output folder ' + Colors.CYAN + config.DOC_OUTPUT_PATH + Colors.RED + ' exists.' + Colors._CLEAR
-      print Colors.ORANGE + 'Try the ' + Colors.RED + '-r' + Colors.ORANGE + ' option to remove any existing documentation.'
-      sys.exit( 2 )
-
     # lookup the symbols
     self.findSymbols()
     # write the documentation to disk
-    self.createContent()
+    count = self.createContent()
+    # and the symbol index
+    self.createIndex()
 
     # all done
     print Colors.CYAN + 'Total Symbols Documented: ' + str( self.__totalSymbols ) + Colors._CLEAR
+    print Colors.CYAN + 'Pages Written: ' + str( count ) + Colors._CLEAR
     print Colors.ORANGE + 'Documentation written to ' + Colors.PURPLE + config.DOC_OUTPUT_PATH + Colors.ORANGE + '!' + Colors._CLEAR
 
+    if options.watch:
+      # re-document on every change
+      watcher = Watcher()
+      watcher.run( [self.update] )
+
+
+  def update( self, changed ):
+    '''
+    Re-create the documentation pages affected by the given files.
+    '''
+    # parse everything again since symbols are inherited across files, the
+    # unchanged files come from the cache
+    self.reset()
+    self.findSymbols()
+
+    count = self.createContent()
+    self.createIndex()
+
+    print Colors.ORANGE + str( count ) + ' documentation pages updated.' + Colors._CLEAR
+
 
   def findSymbols( self ):
     '''
     Find and lookup symbols including inheritance relations.
+
+    The files are parsed in parallel and the results are cached by content,
+    so only changed files are parsed again.
     '''
 
     # grab all js files
     filefinder = JSFileFinder()
     jsfiles = filefinder.run()
 
+    cache = self.loadCache()
 
-    #    jsfiles = ['/chb/users/daniel.haehn/Projects/X/math/matrix.js']
+    # the cache keys include the parser, so changes to it invalidate the cache
+    with open( os.path.splitext( __file__ )[0] + '.py', 'rb' ) as f:
+      parser = f.read()
 
-    # .. and loop through them
+    keys = {}
     for filename in jsfiles:
+      with open( filename, 'rb' ) as f:
+        keys[filename] = hashlib.sha1( parser + '\0' + filename + '\0' + f.read() ).hexdigest()
+
+    # parse the files which are not in the cache
+    changed = [j for j in jsfiles if not cache['files'].has_key( keys[j] )]
+
+    if len( changed ) >= self.PARALLEL_THRESHOLD:
+      pool = multiprocessing.Pool()
+      try:
+        results = pool.map( parseFile, changed )
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      results = [self.parse( j ) for j in changed]
 
-      # classes for this file
-      classes = {}
+    for j, result in zip( changed, results ):
+      # the same form as when loaded from the cache
+      cache['files'][keys[j]] = self.plain( result )
 
-      with open( filename, 'r' ) as f:
+    # only keep what is still in use
+    cache['files'] = dict( [( keys[j], cache['files'][keys[j]] ) for j in jsfiles] )
 
-        # read the whole file
-        lines = f.readlines()
+    # save before the results are modified below
+    self.saveCache( cache )
 
-      # state switches
-      jsdocActive = False
-      queryIdentifier = False
-      jsdocBuffer = ''
+    # .. and merge them in order
+    for filename in jsfiles:
 
-      # class information (use the filename by default)
-      classname = os.path.splitext( os.path.split( filename )[1] )[0]
-      inherits = []
-      exports = []
+      result = cache['files'][keys[filename]]
 
-      # symbol information
-      type = self.TYPES['undefined']
-      privacy = self.PRIVACY['private']  # by default private
-      params = []  # store the parameters of functions
-      returns = []  # and if the function has a return value
+      for classname, inherits in result['inheritances']:
 
-      # forward loop through file
-      for line in lines:
+        # add to inheritances
+        if not self.__inheritances.has_key( classname ):
+          self.__inheritances[classname] = []
 
-        line = line.strip()
-        if line:
-          # ignore blank lines
+        self.__inheritances[classname].extend( inherits )
 
-          # check for GOOGEXPORT
-          if line[0:len( self.GOOGEXPORT )] == self.GOOGEXPORT:
-            exports.append( line[len( self.GOOGEXPORT ):].split( ',' )[0].strip( "'" ).split( '.' )[-1] )
-            continue
+      # always add to classes
+      self.__allclasses.extend( result['allclasses'] )
 
-          # check for JSDOC
-          if line[0:len( self.JSDOCSTART )] == self.JSDOCSTART:
-            # found start of JSDOC
-            jsdocBuffer += line[0:len( self.JSDOCSTART )]
-            jsdocActive = True
-            continue
+      for subfolder, classname in result['leftMenu']:
 
-          if jsdocActive:
-            # this is part of the JSDOC
+        # check if we have already files from this subfolder
+        if not self.__leftMenu.has_key( subfolder ):
+          self.__leftMenu[subfolder] = []
 
-            # remove possible <pre></pre> tags since we don't use them
-            jsdocBuffer += '\n' + line.replace( '<pre>', '' ).replace( '</pre>', '' )
+        # add this file if it does not exist
+        if self.__leftMenu[subfolder].count( classname ) == 0:
+          self.__leftMenu[subfolder].append( classname )
 
-            #
-            # check for special jsdoc tags inside the comments
-            #
+      self.__totalSymbols += result['totalSymbols']
 
-            # @param
-            param = line.find( self.PARAMJSDOC )
-            if param != -1:
-              paramName = line[param + len( self.PARAMJSDOC ):].strip().split( ' ' )[1]
-              params.append( '$' + paramName )
+      # add to files
+      classes = result['classes']
+      self.__files[filename] = classes
+      self.__exportations[result['classname']] = result['exports']
 
-            # @return
-            return_ = line.find( self.RETURNJSDOC )
-            if return_ != -1:
-              returns.append( True )
+      #
+      # mark all exported symbols automatically as public
+      #
+      for c in classes.keys():
+        # check all detected classes
+        self.__updatePrivacy( c )
 
-            # @extends
-            extends = line.find( self.EXTENDSJSDOC )
-            if extends != -1:
-              inheritsClass = line[extends + len( self.EXTENDSJSDOC ):].strip()
+        # remember where the symbols come from since inheritance shares them
+        for symbol in classes[c].itervalues():
+          self.__owners.setdefault( id( symbol ), c )
+
+    #
+    # now all files have been parsed
+    #
 
-              # strip the namespace
-              inheritsClass = inheritsClass.replace( self.NAMESPACE + '.', '' )
+    # map symbols along the inheritance tree
+    for i in self.__inheritances:
+      self.inherit( i )
 
-              inherits.append( inheritsClass )
 
-            # @mixin
-            mixin = line.find( self.MIXINJSDOC )
-            if mixin != -1:
-              inheritsClass = line[mixin + len( self.MIXINJSDOC ):].strip()
+  def parse( self, filename ):
+    '''
+    Find the classes and symbols of a single file. This runs in worker
+    processes as well.
+    '''
+    # classes for this file
+    classes = {}
+
+    # the information for the global tables
+    inheritances = []
+    allclasses = []
+    leftMenu = []
+    totalSymbols = 0
+
+    with open( filename, 'r' ) as f:
+
+      # read the whole file
+      lines = f.readlines()
+
+    # state switches
+    jsdocActive = False
+    queryIdentifier = False
+    paramPending = False
+    jsdocBuffer = ''
+
+    # class information (use the filename by default)
+    classname = os.path.splitext( os.path.split( filename )[1] )[0]
+    inherits = []
+    exports = []
+
+    # symbol information
+    type = self.TYPES['undefined']
+    privacy = self.PRIVACY['private']  # by default private
+    params = []  # store the parameters of functions
+    returns = []  # and if the function has a return value
+
+    # forward loop through file
+    for line in lines:
+
+      line = line.strip()
+      if line:
+        # ignore blank lines
+
+        # check for GOOGEXPORT
+        if line[0:len( self.GOOGEXPORT )] == self.GOOGEXPORT:
+          exports.append( line[len( self.GOOGEXPORT ):].split( ',' )[0].strip( "'" ).split( '.' )[-1] )
+          continue
 
-              # strip the namespace
-              inheritsClass = inheritsClass.replace( self.NAMESPACE + '.', '' )
+        # check for JSDOC
+        if line[0:len( self.JSDOCSTART )] == self.JSDOCSTART:
+          # found start of JSDOC
+          jsdocBuffer += line[0:len( self.JSDOCSTART )]
+          jsdocActive = True
+          continue
 
-              inherits.append( inheritsClass )
+        if jsdocActive:
+          # this is part of the JSDOC
 
-          if jsdocActive and line[0:len( self.JSDOCEND )] == self.JSDOCEND:
-            # end of JSDOC
-            jsdocActive = False
-            queryIdentifier = True
-            continue
+          # remove possible <pre></pre> tags since we don't use them
+          jsdocBuffer += '\n' + line.replace( '<pre>', '' ).replace( '</pre>', '' )
 
-          if queryIdentifier:
-            # store the Identifier and the corresponding JSDOC
+          #
+          # check for special jsdoc tags inside the comments
+          #
 
-            identifier = line.split( ' ' )[0]  # split by blank
-            identifierSplitted = identifier.split( '.' )  # split by dot
-            # classname = identifierSplitted[1] # should always be the classname
-            identifier = identifierSplitted[-1]
+          # @param
+          param = line.find( self.PARAMJSDOC )
+          if param != -1:
+            paramName = line[param + len( self.PARAMJSDOC ):].split()
+            if len( paramName ) > 1:
+              params.append( '$' + paramName[1] )
+            else:
+              # the name is on the next line
+              paramPending = True
+          elif paramPending:
+            paramName = line.lstrip( '*' ).split()
+            if paramName:
+              params.append( '$' + paramName[0] )
+            paramPending = False
+
+          # @return
+          return_ = line.find( self.RETURNJSDOC )
+          if return_ != -1:
+            returns.append( True )
+
+          # @extends
+          extends = line.find( self.EXTENDSJSDOC )
+          if extends != -1:
+            inheritsClass = line[extends + len( self.EXTENDSJSDOC ):].strip()
+
+            # strip the namespace
+            inheritsClass = inheritsClass.replace( self.NAMESPACE + '.', '' )
+
+            inherits.append( inheritsClass )
+
+          # @mixin
+          mixin = line.find( self.MIXINJSDOC )
+          if mixin != -1:
+            inheritsClass = line[mixin + len( self.MIXINJSDOC ):].strip()
+
+            # strip the namespace
+            inheritsClass = inheritsClass.replace( self.NAMESPACE + '.', '' )
+
+            inherits.append( inheritsClass )
+
+        if jsdocActive and line[0:len( self.JSDOCEND )] == self.JSDOCEND:
+          # end of JSDOC
+          jsdocActive = False
+          queryIdentifier = True
+          continue
 
-            # check for namespace
-            if line[0] != self.NAMESPACE:
+        if queryIdentifier:
+          # store the Identifier and the corresponding JSDOC
 
-              # check if this is a public property
-              if line[0:4] == self.THIS:
+          identifier = line.split( ' ' )[0]  # split by blank
+          identifierSplitted = identifier.split( '.' )  # split by dot
+          # classname = identifierSplitted[1] # should always be the classname
+          identifier = identifierSplitted[-1]
 
-                # check if the property has a constant name aka. is defined with a string
-                if line[4:6] == "['" or line[4:6] == '["':
-                  # this is a public property property
-                  privacy = 1
-                  # todo set correct identifier
+          # check for namespace
+          if line[0] != self.NAMESPACE:
 
-                type = self.TYPES['property']
+            # check if this is a public property
+            if line[0:4] == self.THIS:
 
-              else:
-                # no namespace so we reset the buffer
-                jsdocBuffer = ''
-                queryIdentifier = False
-                continue
+              # check if the property has a constant name aka. is defined with a string
+              if line[4:6] == "['" or line[4:6] == '["':
+                # this is a public property property
+                privacy = 1
+                # todo set correct identifier
 
-            elif identifierSplitted[-2] != self.PROTOTYPE:
+              type = self.TYPES['property']
 
-              # static method or constructor
-              if jsdocBuffer.find( self.CONSTRUCTORJSDOC ) != -1:
-                # this is a constructor
-                type = self.TYPES['constructor']
-                classname = identifier
+            else:
+              # no namespace so we reset the buffer
+              jsdocBuffer = ''
+              queryIdentifier = False
+              continue
 
-                # check if we have parent classes, then update the inheritance table
-                if len( inherits ) > 0:
-                  # add to inheritances
-                  if not self.__inheritances.has_key( classname ):
-                    self.__inheritances[classname] = []
+          elif identifierSplitted[-2] != self.PROTOTYPE:
 
-                  self.__inheritances[classname].extend( inherits )
-                  inherits = []  # reset the inheritances
+            # static method or constructor
+            if jsdocBuffer.find( self.CONSTRUCTORJSDOC ) != -1:
+              # this is a constructor
+              type = self.TYPES['constructor']
+              classname = identifier
 
-                # always add to classes
-                self.__allclasses.append( classname )
+              # check if we have parent classes, then update the inheritance table
+              if len( inherits ) > 0:
+                # add to inheritances
+                inheritances.append( ( classname, inherits ) )
+                inherits = []  # reset the inheritances
 
-              else:
-                # this is a static method
-                type = self.TYPES['static']
+              # always add to classes
+              allclasses.append( classname )
 
             else:
-              # a prototype method
-              type = self.TYPES['function']
-
-              # check for getters/setters
-              if identifier[0:len( self.DEFINEGETTER )] == self.DEFINEGETTER:
-                # a getter
-                identifier = identifier[len( self.DEFINEGETTER ):].split( "'" )[1] + '_get'
-                type = self.TYPES['gettersetter']
-                privacy = self.PRIVACY['public']
-
-              elif identifier[0:len( self.DEFINESETTER )] == self.DEFINESETTER:
-                # a setter
-                identifier = identifier[len( self.DEFINESETTER ):].split( "'" )[1] + '_set'
-                type = self.TYPES['gettersetter']
-                privacy = self.PRIVACY['public']
-
-            if not classes.has_key( classname ):
-              # no symbols for this class yet
-              classes[classname] = {}
-
-            # grab the subfolder name
-            subfolder = os.path.dirname( filename ).split( os.sep )[-1]
-
-            # ignore toplevel files and also the NAMESPACE declaration
-            if not subfolder == '..' and not classname == self.NAMESPACE:
-
-              # check if we have already files from this subfolder
-              if not self.__leftMenu.has_key( subfolder ):
-                self.__leftMenu[subfolder] = []
-
-              # add this file if it does not exist
-              if self.__leftMenu[subfolder].count( classname ) == 0:
-                self.__leftMenu[subfolder].append( classname )
-
-            # add the current symbol
-            classes[classname][identifier] = {'public':privacy, 'type':type, 'doc':jsdocBuffer, 'params':params, 'returns':returns}
-
-            self.__totalSymbols += 1
-
-            # clear the buffer and all other symbol specific data
-            jsdocBuffer = ''
-            type = -1
-            privacy = 0
-            returns = []
-            params = []
-            # clear the state switches
-            queryIdentifier = False
+              # this is a static method
+              type = self.TYPES['static']
 
-      # add to files
-      # filename = os.path.basename( filename )
-      self.__files[filename] = classes
-      self.__exportations[classname] = exports
+          else:
+            # a prototype method
+            type = self.TYPES['function']
 
-      #
-      # mark all exported symbols automatically as public
-      #
-      for c in classes.keys():
-        # check all detected classes
-        self.__updatePrivacy( c )
+            # check for getters/setters
+            if identifier[0:len( self.DEFINEGETTER )] == self.DEFINEGETTER:
+              # a getter
+              identifier = identifier[len( self.DEFINEGETTER ):].split( "'" )[1] + '_get'
+              type = self.TYPES['gettersetter']
+              privacy = self.PRIVACY['public']
 
-    #
-    # now all files have been parsed
-    #
+            elif identifier[0:len( self.DEFINESETTER )] == self.DEFINESETTER:
+              # a setter
+              identifier = identifier[len( self.DEFINESETTER ):].split( "'" )[1] + '_set'
+              type = self.TYPES['gettersetter']
+              privacy = self.PRIVACY['public']
 
-    # map symbols along the inheritance tree
-    for i in self.__inheritances:
-      self.inherit( i )
+          if not classes.has_key( classname ):
+            # no symbols for this class yet
+            classes[classname] = {}
+
+          # grab the subfolder name
+          subfolder = os.path.dirname( filename ).split( os.sep )[-1]
 
+          # ignore toplevel files and also the NAMESPACE declaration
+          if not subfolder == '..' and not classname == self.NAMESPACE:
+
+            # add this file to the menu
+            if leftMenu.count( ( subfolder, classname ) ) == 0:
+              leftMenu.append( ( subfolder, classname ) )
+
+          # add the current symbol
+          classes[classname][identifier] = {'public':privacy, 'type':type, 'doc':jsdocBuffer, 'params':params, 'returns':returns}
+
+          totalSymbols += 1
+
+          # clear the buffer and all other symbol specific data
+          jsdocBuffer = ''
+          type = -1
+          privacy = 0
+          returns = []
+          params = []
+          # clear the state switches
+          queryIdentifier = False
+
+    return {'classes':classes, 'classname':classname, 'exports':exports, 'inheritances':inheritances, 'allclasses':allclasses, 'leftMenu':leftMenu, 'totalSymbols':totalSymbols}
 
 
   def createContent( self ):
     '''
-    Create the HTML content and write the output files. 
+    Create the HTML content and write the output files. Pages are only
+    written if anything they show changed since the last run.
+
+    Returns the number of pages written.
     '''
 
     # create the output folder
-    os.mkdir( config.DOC_OUTPUT_PATH )
+    if not os.path.exists( config.DOC_OUTPUT_PATH ):
+      os.mkdir( config.DOC_OUTPUT_PATH )
 
     # copy templates over
     shutil.copy( os.path.join( config.DOC_TEMPLATES_PATH, 'doc.css' ), config.DOC_OUTPUT_PATH )
@@ -323,16 +455,31 @@ class Documenter( object ):
     # path to the html template file
     templateFile = os.path.join( config.DOC_TEMPLATES_PATH, 'doc.html' )
 
+    # load the template
+    with open( templateFile, 'r' ) as t:
+      template = t.read()
+
+    title = config.SOFTWARE + ' API'
+
     #
     # create the left menu
     #
-    leftMenuContent = ''
+    leftMenu = []
     for folder in sorted( self.__leftMenu.iterkeys() ):
-      leftMenuContent += '<b>' + folder.upper() + '</b><br>'
+      leftMenu.append( '<b>' + folder.upper() + '</b><br>' )
       for classname in sorted( self.__leftMenu[folder], key=str.lower ):
-        leftMenuContent += '<span class="menuitem"><a href="' + classname + '.html">' + self.NAMESPACE + '.' + classname + '</a></span><br>'
-      leftMenuContent += '<br>'
+        leftMenu.append( '<span class="menuitem"><a href="' + classname + '.html">' + self.NAMESPACE + '.' + classname + '</a></span><br>' )
+      leftMenu.append( '<br>' )
+
+    leftMenuContent = ''.join( leftMenu )
+
 
+    # the digests of the pages of the last run
+    cache = self.loadCache()
+    pages = cache['pages'].get( config.DOC_OUTPUT_PATH, {} )
+    written = {}
+
+    count = 0
 
     #
     # main content loop
@@ -347,11 +494,18 @@ class Documenter( object ):
 
         symbols = self.__files[f][c]
 
-        # load the template
-        with open( templateFile, 'r' ) as t:
-          output = t.read()
+        # everything this page shows: the symbols including the inherited
+        # and exported ones, the ancestors, the links to other classes and
+        # the menu
+        digest = self.digest( [template, f, c, sorted( [( s, sorted( symbols[s].items() ) ) for s in symbols] ), self.inheritanceChart( c ), sorted( self.__allclasses ), leftMenuContent] )
+        written[c + '.html'] = digest
+
+        if pages.get( c + '.html' ) == digest and os.path.exists( os.path.join( config.DOC_OUTPUT_PATH, c + '.html' ) ):
+          # this page is up to date
+          continue
+
+        output = template
 
-        title = config.SOFTWARE + ' API'
         classname = c  # the classname
         content = ''
         hasPublic = False
@@ -463,19 +617,32 @@ class Documenter( object ):
 
           outputf.write( output )
 
+        count += 1
+
+    # remove the pages of classes which are gone
+    for page in pages:
+      if not written.has_key( page ) and page != 'index.html' and os.path.exists( os.path.join( config.DOC_OUTPUT_PATH, page ) ):
+        os.remove( os.path.join( config.DOC_OUTPUT_PATH, page ) )
+
 
     # create index.html
+    digest = self.digest( [template, leftMenuContent, config.SOFTWARE_DESCRIPTION, config.SOFTWARE_HOMEPAGE] )
+    written['index.html'] = digest
 
-    # load the template
-    with open( templateFile, 'r' ) as t:
-      output = t.read()
+    cache['pages'][config.DOC_OUTPUT_PATH] = written
+    self.saveCache( cache )
+
+    if pages.get( 'index.html' ) == digest and os.path.exists( os.path.join( config.DOC_OUTPUT_PATH, 'index.html' ) ):
+      # the index is up to date
+      return count
+
+    output = template
 
     # modify template
     output = output.replace( '${TITLE}', title )
     output = output.replace( '${CLASSNAME}', '' )
     output = output.replace( '${SOURCELINK}', self.REPO_URL )
 
-    diagram = self.inheritanceChart( classname )
     output = output.replace( '${DIAGRAM}', '' )
 
     # right menu
@@ -496,6 +663,152 @@ class Documenter( object ):
 
       outputf.write( output )
 
+    return count + 1
+
+
+  def createIndex( self ):
+    '''
+    Write the symbol index for searching. The symbols are sharded by the
+    first character of their name (ignoring underscores), so a search only
+    has to load the shard it needs. The shards are listed in index.json.
+
+    Returns the number of shards written.
+    '''
+    typenames = dict( [( v, k ) for k, v in self.TYPES.iteritems()] )
+
+    shards = {}
+
+    for f in self.__files:
+
+      source = os.path.relpath( f, config.SOFTWARE_PATH ).replace( os.sep, '/' )
+
+      for c in self.__files[f]:
+
+        if not c:
+          # skip empty classnames
+          continue
+
+        symbols = self.__files[f][c]
+        members = {}
+
+        for s in sorted( symbols ):
+
+          # getters and setters are the same member
+          member = s
+          if symbols[s]['type'] == self.TYPES['gettersetter']:
+            member = s.replace( '_get', '' ).replace( '_set', '' )
+
+          inherited = self.__owners.get( id( symbols[s] ) )
+          if inherited == c:
+            inherited = None
+
+          entry = [c, member, typenames[symbols[s]['type']], symbols[s]['public'] and 'public' or 'private', [p.lstrip( '$' ) for p in symbols[s]['params']], inherited, source]
+
+          if members.has_key( member ):
+            # merge the getter and the setter
+            entry[3] = 'public' in ( entry[3], members[member][3] ) and 'public' or 'private'
+            entry[4] = entry[4] or members[member][4]
+
+          members[member] = entry
+
+        for member in members:
+
+          # private members are found by their name without underscores
+          key = member.lstrip( '_' )[:1].lower()
+          if not key.isalnum():
+            key = '_'
+
+          shards.setdefault( key, [] ).append( members[member] )
+
+    searchPath = os.path.join( config.DOC_OUTPUT_PATH, self.SEARCH_FOLDER )
+    if not os.path.exists( searchPath ):
+      os.mkdir( searchPath )
+
+    files = {'index.json':json.dumps( {'fields':self.SEARCH_FIELDS, 'repository':self.REPO_URL, 'shards':dict( [( k, {'file':k + '.json', 'count':len( shards[k] )} ) for k in shards] )}, sort_keys=True, separators=( ',', ':' ) )}
+
+    for k in shards:
+      files[k + '.json'] = json.dumps( sorted( shards[k] ), separators=( ',', ':' ) )
+
+    count = 0
+
+    for name in os.listdir( searchPath ):
+      if not files.has_key( name ):
+        # a shard which is not needed anymore
+        os.remove( os.path.join( searchPath, name ) )
+
+    for name in files:
+
+      filename = os.path.join( searchPath, name )
+
+      if os.path.exists( filename ):
+        with open( filename, 'r' ) as f:
+          if f.read() == files[name]:
+            # this shard is up to date
+            continue
+
+      with open( filename, 'w' ) as f:
+        f.write( files[name] )
+
+      count += 1
+
+    return count
+
+
+  def digest( self, data ):
+    '''
+    Return a digest of the given data.
+    '''
+    return hashlib.sha1( repr( data ) ).hexdigest()
+
+
+  def loadCache( self ):
+    '''
+    Load the cache of parsed files and written pages.
+    '''
+    if not os.path.isfile( config.DOC_CACHE_PATH ):
+      return {'files':{}, 'pages':{}}
+
+    try:
+      with open( config.DOC_CACHE_PATH, 'r' ) as f:
+        cache = json.load( f )
+    except ( IOError, ValueError ):
+      # a broken cache is no cache
+      return {'files':{}, 'pages':{}}
+
+    if not isinstance( cache, dict ) or not isinstance( cache.get( 'files' ), dict ) or not isinstance( cache.get( 'pages' ), dict ):
+      return {'files':{}, 'pages':{}}
+
+    return self.plain( cache )
+
+
+  def saveCache( self, cache ):
+    '''
+    Save the cache of parsed files and written pages.
+    '''
+    tmpfile = config.DOC_CACHE_PATH + '.tmp'
+
+    with open( tmpfile, 'w' ) as f:
+      json.dump( cache, f )
+
+    os.rename( tmpfile, config.DOC_CACHE_PATH )
+
+
+  def plain( self, value ):
+    '''
+    Return a value with the strings json gives us as str and the tuples as
+    lists, so cached and freshly parsed results look the same.
+    '''
+    if isinstance( value, unicode ):
+      return value.encode( 'utf-8' )
+
+    if isinstance( value, dict ):
+      return dict( [( self.plain( k ), self.plain( v ) ) for k, v in value.iteritems()] )
+
+    if isinstance( value, ( list, tuple ) ):
+      return [self.plain( v ) for v in value]
+
+    return value
+
 
   def __findClass( self, classname ):
     '''
@@ -0,0 +1,298 @@
+#
+# The XBUILD image comparison.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import array
+import sys
+
+import config
+
+# pypng
+sys.path.append( config.PYPNG_PATH )
+
+#
+#
+#
+class ImageCompare( object ):
+  '''
+  Compares a screenshot with its baseline.
+
+  Pixels are compared per channel with a tolerance. The images are then split
+  into tiles and each tile with differing pixels is checked for the fraction
+  of these pixels and its structural similarity (SSIM of the luminance), so
+  that local regressions are found even if the overall image looks the same.
+  The tiles are checked band by band and the comparison stops at the first
+  band with a failing tile.
+
+  numpy is required.
+  '''
+
+  # the SSIM constants for 8 bit images
+  SSIM_C1 = ( 0.01 * 255 ) ** 2
+  SSIM_C2 = ( 0.03 * 255 ) ** 2
+
+  def __init__( self, tolerance=None, tile=None, threshold=None, similarity=None ):
+    '''
+    '''
+    if tolerance is None:
+      tolerance = config.IMAGE_PIXEL_TOLERANCE
+    if tile is None:
+      tile = config.IMAGE_TILE_SIZE
+    if threshold is None:
+      threshold = config.IMAGE_TILE_THRESHOLD
+    if similarity is None:
+      similarity = config.IMAGE_SSIM_THRESHOLD
+
+    self.__tolerance = tolerance
+    self.__tile = tile
+    self.__threshold = threshold
+    self.__similarity = similarity
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+
+    options
+      [image, baseline, heatmap] where image and baseline are filenames or
+      RGBA arrays and heatmap is the filename for a difference image which is
+      only written if the comparison failed, or None
+
+    Returns a dictionary with
+      passed       True if the images match
+      message      a description of the failure or ''
+      pixels       the number of pixels which differ more than the tolerance
+      difference   the maximum difference of a channel
+      similarity   the lowest SSIM of all tiles with differing pixels
+      tile         the first failing tile as ( x, y, width, height ) or None
+      heatmap      the filename of the difference image or None
+    '''
+    image = options[0]
+    baseline = options[1]
+    heatmap = len( options ) > 2 and options[2] or None
+
+    if isinstance( image, basestring ):
+      image = self.load( image )
+    if isinstance( baseline, basestring ):
+      baseline = self.load( baseline )
+
+    result = self.compare( image, baseline )
+
+    if not result['passed'] and heatmap and image.shape == baseline.shape:
+      self.heatmap( image, baseline, result['tile'], heatmap )
+      result['heatmap'] = heatmap
+
+    return result
+
+
+  def load( self, filename ):
+    '''
+    Decode a PNG file to a height x width x 4 array.
+    '''
+    import png
+
+    return self.pixels( png.MappedReader( filename ) )
+
+
+  def decode( self, data ):
+    '''
+    Decode PNG data in memory to a height x width x 4 array.
+    '''
+    import png
+
+    return self.pixels( png.Reader( bytes=data ) )
+
+
+  def pixels( self, reader ):
+    '''
+    Return the pixels of a png.Reader as height x width x 4 array.
+    '''
+    import numpy
+
+    reader.preamble()
+
+    # the usual 8 bit RGB and RGBA images are decoded as a whole
+    if reader.bitdepth == 8 and reader.color_type in ( 2, 6 ) and not reader.trns:
+
+      pixels = reader.read_array()
+
+      if reader.planes == 4:
+        return pixels
+
+      rgba = numpy.empty( ( reader.height, reader.width, 4 ), dtype=numpy.uint8 )
+      rgba[:, :, :3] = pixels
+      rgba[:, :, 3] = 255
+      return rgba
+
+    width, height, rows, meta = reader.asRGBA8()
+
+    # depending on the format, the rows are arrays or lists
+    data = ''.join( [isinstance( row, array.array ) and row.tostring() or array.array( 'B', row ).tostring() for row in rows] )
+
+    return numpy.frombuffer( data, dtype=numpy.uint8 ).reshape( height, width, 4 )
+
+
+  def compare( self, image, baseline ):
+    '''
+    Compare two RGBA arrays.
+    '''
+    import numpy
+
+    result = {'passed':True, 'message':'', 'pixels':0, 'difference':0, 'similarity':1.0, 'tile':None, 'heatmap':None}
+
+    if image.shape != baseline.shape:
+      result['passed'] = False
+      result['message'] = 'The image has ' + self.size( image ) + ' pixels but the baseline has ' + self.size( baseline ) + '.'
+      return result
+
+    height, width = image.shape[:2]
+
+    pixels1 = numpy.ascontiguousarray( image ).reshape( -1, 4 )
+    pixels2 = numpy.ascontiguousarray( baseline ).reshape( -1, 4 )
+
+    # find the changed pixels by comparing all 4 channels at once
+    changed = numpy.flatnonzero( pixels1.view( numpy.uint32 ).ravel() != pixels2.view( numpy.uint32 ).ravel() )
+
+    if not len( changed ):
+      # identical
+      return result
+
+    # the largest difference of any channel for each changed pixel
+    if len( changed ) * 8 < height * width:
+
+      difference = numpy.abs( pixels1[changed].astype( numpy.int16 ) - pixels2[changed] ).max( axis=1 )
+
+      different = numpy.zeros( height * width, dtype=numpy.bool_ )
+      different[changed[difference > self.__tolerance]] = True
+
+    else:
+
+      # most pixels changed, indexing them is slower than looking at all
+      difference = numpy.maximum( pixels1, pixels2 )
+      difference -= numpy.minimum( pixels1, pixels2 )
+      difference = numpy.maximum( numpy.maximum( difference[:, 0], difference[:, 1] ), numpy.maximum( difference[:, 2], difference[:, 3] ) )
+
+      different = difference > self.__tolerance
+
+    result['difference'] = int( difference.max() )
+
+    different = different.reshape( height, width )
+
+    result['pixels'] = int( numpy.count_nonzero( different ) )
+
+    # only bands with changes need to be checked
+    changedRows = numpy.zeros( height, dtype=numpy.bool_ )
+    changedRows[changed // width] = True
+
+    columns = numpy.arange( 0, width, self.__tile )
+    tileWidths = numpy.diff( numpy.append( columns, width ) )
+
+    for y in xrange( 0, height, self.__tile ):
+
+      band = slice( y, y + self.__tile )
+
+      if not changedRows[band].any():
+        continue
+
+      bandHeight = min( self.__tile, height - y )
+      count = ( tileWidths * bandHeight ).astype( numpy.float64 )
+
+      # the fraction of differing pixels for each tile of this band
+      fraction = numpy.add.reduceat( different[band].sum( axis=0 ), columns ) / count
+
+      if not fraction.any():
+        # only changes within the tolerance, f.e. noise
+        continue
+
+      # the structural similarity of each tile of this band, this only
+      # matters for tiles with differing pixels
+      ssim = self.ssim( self.luminance( image[band] ), self.luminance( baseline[band] ), columns, count )
+      ssim[fraction == 0] = 1.0
+
+      result['similarity'] = min( result['similarity'], float( ssim.min() ) )
+
+      failed = numpy.flatnonzero( ( fraction > self.__threshold ) | ( ssim < self.__similarity ) )
+
+      if len( failed ):
+
+        # early exit, this is bad enough
+        i = failed[0]
+
+        result['passed'] = False
+        result['tile'] = ( int( columns[i] ), y, int( tileWidths[i] ), bandHeight )
+        result['message'] = 'The tile at ' + str( result['tile'][0] ) + ',' + str( y ) + ' differs from the baseline: ' + str( int( round( fraction[i] * 100 ) ) ) + '% of the pixels differ by more than ' + str( self.__tolerance ) + ', SSIM ' + str( round( ssim[i], 3 ) ) + '.'
+
+        break
+
+    return result
+
+
+  def luminance( self, image ):
+    '''
+    Return the luminance of RGBA pixels.
+    '''
+    import numpy
+
+    rgb = image[:, :, :3].astype( numpy.float32 )
+
+    return rgb[:, :, 0] * 0.299 + rgb[:, :, 1] * 0.587 + rgb[:, :, 2] * 0.114
+
+
+  def ssim( self, luminance1, luminance2, columns, count ):
+    '''
+    Return the structural similarity of the tiles of a band. The tiles start
+    at the given columns and have count pixels each.
+    '''
+    import numpy
+
+    def tiles( values ):
+      return numpy.add.reduceat( values.sum( axis=0, dtype=numpy.float64 ), columns ) / count
+
+    mean1 = tiles( luminance1 )
+    mean2 = tiles( luminance2 )
+
+    variance1 = tiles( luminance1 * luminance1 ) - mean1 * mean1
+    variance2 = tiles( luminance2 * luminance2 ) - mean2 * mean2
+    covariance = tiles( luminance1 * luminance2 ) - mean1 * mean2
+
+    return ( ( 2 * mean1 * mean2 + self.SSIM_C1 ) * ( 2 * covariance + self.SSIM_C2 ) ) / ( ( mean1 * mean1 + mean2 * mean2 + self.SSIM_C1 ) * ( variance1 + variance2 + self.SSIM_C2 ) )
+
+
+  def heatmap( self, image, baseline, tile, filename ):
+    '''
+    Write a difference image: the baseline is shown dimmed in gray, the
+    differences in red and the failing tile is framed in yellow.
+    '''
+    import numpy
+    import png
+
+    difference = numpy.abs( image.astype( numpy.int16 ) - baseline ).max( axis=2 )
+
+    gray = self.luminance( baseline ) / 3
+
+    heatmap = numpy.empty( difference.shape + ( 3, ), dtype=numpy.uint8 )
+    heatmap[:, :, 0] = numpy.maximum( gray, numpy.where( difference > self.__tolerance, 255, difference ) )
+    heatmap[:, :, 1] = gray
+    heatmap[:, :, 2] = gray
+
+    if tile:
+      x, y, w, h = tile
+      yellow = ( 255, 255, 0 )
+      heatmap[y, x:x + w] = yellow
+      heatmap[y + h - 1, x:x + w] = yellow
+      heatmap[y:y + h, x] = yellow
+      heatmap[y:y + h, x + w - 1] = yellow
+
+    height, width = difference.shape
+
+    with open( filename, 'wb' ) as f:
+      png.Writer( width, height ).write( f, [array.array( 'B', row.tostring() ) for row in heatmap.reshape( height, width * 3 )] )
+
+
+  def size( self, image ):
+    '''
+    Return the size of an image as text, f.e. 800x600.
+    '''
+    return str( image.shape[1] ) + 'x' + str( image.shape[0] )
@@ -4,52 +4,172 @@
 # (c) 2012 The XTK Developers <dev@goXTK.com>
 #
 
-import sys
+import fnmatch
+import json
+import os
+import re
 
 import config
 
+# the results of this process, so that one command scans the tree only once
+_results = {}
+
 #
 #
 #
 class JSFileFinder( object ):
   '''
   Finds JS Files in directory.
+
+  The directory listings are kept in a persistent index which is revalidated
+  using the directory modification times, so only changed directories are
+  listed again.
   '''
 
+  def __init__( self, indexfile=None ):
+    '''
+    '''
+    if not indexfile:
+      indexfile = config.JSFILES_INDEX_PATH
+
+    self.__indexfile = indexfile
+
+
   def run( self, options=None ):
     '''
     Performs the action.
+
+    options
+      ['USE_INCLUDES'] to force inclusion of config.INCLUDES_PATH
+      ['ALL'] to skip the excludes completely
     '''
+    mode = options and options[0] or None
 
-    # we need to import some closure python classes here
-    sys.path.append( config.CLOSURELIBRARY_PYTHON_PATH )
-    import treescan
+    if not _results.has_key( mode ):
 
-    # scan for .js files
-    jsFilesGenerator = treescan.ScanTreeForJsFiles( config.SOFTWARE_PATH )
+      if not _results.has_key( 'ALL' ):
+        # scan for .js files
+        _results['ALL'] = self.scan()
 
-    # list of final .js files to compile    
-    jsFiles = []
+      if mode != 'ALL':
+        excludes = self.compile( config.EXCLUDES_PATH )
+        includes = self.compile( config.INCLUDES_PATH )
 
-    # apply ignores
-    for j in jsFilesGenerator:
+        # apply ignores
+        _results[mode] = [j for j in _results['ALL'] if not self.matches( j, excludes ) or ( mode == 'USE_INCLUDES' and self.matches( j, includes ) )]
 
-      ignore = False
+    # return filtered list
+    return list( _results[mode] )
 
-      for e in config.EXCLUDES_PATH:
-        if j.find( e ) != -1:
-          # ignore this guy
-          ignore = True
 
-      if options and options[0] == 'USE_INCLUDES':
-        for i in config.INCLUDES_PATH:
-          if j.find( i ) != -1:
-            # force inclusion for this guy
-            ignore = False
+  def invalidate( self ):
+    '''
+    Forget the results of this process, f.e. if files were added or removed.
+    '''
+    _results.clear()
 
-      if not ignore:
-        # add this guy to the valid files
-        jsFiles.append( j )
 
-    # return filtered list
-    return jsFiles
+  def compile( self, patterns ):
+    '''
+    Compile shell-style patterns to one regular expression which matches
+    single path components.
+    '''
+    return re.compile( '|'.join( ['(?:' + fnmatch.translate( p ) + ')' for p in patterns] ) )
+
+
+  def matches( self, jsfile, regex ):
+    '''
+    Check if any path component of a file below config.SOFTWARE_PATH matches.
+    '''
+    return any( regex.match( c ) for c in os.path.relpath( jsfile, config.SOFTWARE_PATH ).split( os.sep ) )
+
+
+  def scan( self ):
+    '''
+    Return all .js files below config.SOFTWARE_PATH, ignoring hidden files
+    and directories just like closure's treescan.
+    '''
+    index = self.load()
+    changed = False
+
+    jsfiles = []
+    pending = ['']
+
+    while pending:
+
+      directory = pending.pop()
+      path = os.path.join( config.SOFTWARE_PATH, directory )
+
+      try:
+        mtime = os.stat( path ).st_mtime
+      except OSError:
+        # removed while scanning
+        continue
+
+      entry = index.get( directory )
+
+      if not entry or entry[0] != mtime:
+
+        # list this directory again
+        subdirectories = []
+        files = []
+
+        for e in sorted( os.listdir( path ) ):
+
+          if e.startswith( '.' ):
+            continue
+
+          if os.path.isdir( os.path.join( path, e ) ):
+            subdirectories.append( e )
+          elif e.endswith( '.js' ):
+            files.append( e )
+
+        entry = [mtime, subdirectories, files]
+        index[directory] = entry
+        changed = True
+
+      jsfiles.extend( [os.path.join( path, f ) for f in entry[2]] )
+      pending.extend( [os.path.join( directory, d ) for d in reversed( entry[1] )] )
+
+    if changed:
+      self.save( index )
+
+    return jsfiles
+
+
+  def load( self ):
+    '''
+    Load the index.
+    '''
+    if not os.path.isfile( self.__indexfile ):
+      return {}
+
+    try:
+      with open( self.__indexfile, 'r' ) as f:
+        index = json.load( f )
+    except ValueError:
+      # a broken index is no index
+      return {}
+
+    # the index is only valid for the tree it was created for
+    if index.get( 'root' ) != config.SOFTWARE_PATH:
+      return {}
+
+    # json gives us unicode strings
+    directories = {}
+    for d, ( mtime, subdirectories, files ) in index['directories'].iteritems():
+      directories[str( d )] = [mtime, [str( s ) for s in subdirectories], [str( f ) for f in files]]
+
+    return directories
+
+
+  def save( self, directories ):
+    '''
+    Save the index.
+    '''
+    tmpfile = self.__indexfile + '.tmp'
+
+    with open( tmpfile, 'w' ) as f:
+      json.dump( {'root':config.SOFTWARE_PATH, 'directories':directories}, f )
+
+    os.rename( tmpfile, self.__indexfile )
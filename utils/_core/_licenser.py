@@ -17,8 +17,15 @@ class Licenser( object ):
   def run( self, options=None ):
     '''
     Performs the action.
+
+    options
+      [outputfile] (optional, defaults to the build output)
     '''
-    with open( config.BUILD_OUTPUT_PATH, 'r+' ) as f:
+    outputfile = config.BUILD_OUTPUT_PATH
+    if options:
+      outputfile = options[0]
+
+    with open( outputfile, 'r+' ) as f:
 
       old = f.read() # read everything in the file
       f.seek( 0 ) # rewind
@@ -0,0 +1,184 @@
+#
+# The XBUILD module splitter.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import os
+import re
+
+import config
+from _depscanner import DepsScanner
+from _jsfilefinder import JSFileFinder
+
+#
+#
+#
+class ModuleSplitter( object ):
+  '''
+  Splits the sources into a core module and lazily loadable modules, one for
+  each namespace matching config.BUILD_MODULES_SPLIT, following the
+  goog.require graph.
+
+  Code which is required by more than one lazy module but not by the core
+  goes into a shared 'common' module.
+  '''
+
+  # the pattern to find the parser for each file extension in X.loader
+  EXTENSION_REGEX = re.compile( r"'(\w*)'\s*:\s*\[\s*'([\w.]+)'" )
+
+  def __init__( self ):
+    '''
+    '''
+    self.__graph = None
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+
+    options
+      [jsfiles]
+
+    Returns the modules in load order as dictionaries with name, files and
+    requires, and a manifest mapping file extensions to modules.
+    '''
+    jsfiles = options[0]
+
+    # scan everything below the project root, like closurebuilder does
+    self.__graph = DepsScanner().run( [JSFileFinder().run( ['ALL'] )] )
+
+    # the namespaces of the build
+    namespaces = set()
+    for j in jsfiles:
+      namespaces.update( self.__graph.provides( os.path.abspath( j ) ) )
+
+    # the namespaces which get their own module
+    split = set( [n for n in namespaces for prefix in config.BUILD_MODULES_SPLIT if n.startswith( prefix ) and n != prefix] )
+
+    # all sources in dependency order, the closure base file goes first
+    base = self.__graph.provider( 'goog' )
+    if not base:
+      raise Exception( 'Could not find the closure base file.' )
+
+    order = dict( [( f, i ) for i, f in enumerate( self.__graph.order() )] )
+    order[base] = -1
+
+    # the core contains everything which is reachable without entering a split namespace
+    core = self.reachable( namespaces - split, split )
+    core.add( base )
+
+    # each split namespace gets all its sources which are not in the core
+    modules = {}
+    for n in split:
+
+      files = self.reachable( [n], split - set( [n] ) ) - core
+
+      # direct requirements of other split namespaces become module dependencies
+      requires = set()
+      for f in files:
+        requires.update( [self.moduleName( r ) for r in self.__graph.requires( f ) if r in split and r != n] )
+
+      modules[self.moduleName( n )] = {'files':files, 'requires':requires, 'namespace':n}
+
+    # move code shared by several modules to the common module
+    count = {}
+    for m in modules.itervalues():
+      for f in m['files']:
+        count[f] = count.get( f, 0 ) + 1
+
+    common = set( [f for f in count if count[f] > 1] )
+
+    if common:
+      for m in modules.itervalues():
+        if m['files'] & common:
+          m['files'] = m['files'] - common
+          m['requires'].add( 'common' )
+
+    # sort the modules so that each one comes after its requirements
+    result = [{'name':'core', 'files':core, 'requires':[]}]
+    if common:
+      result.append( {'name':'common', 'files':common, 'requires':['core']} )
+
+    done = set( [m['name'] for m in result] )
+    pending = sorted( modules.keys() )
+
+    while pending:
+
+      ready = [m for m in pending if modules[m]['requires'] <= done]
+      if not ready:
+        raise Exception( 'Circular module dependencies between ' + ', '.join( pending ) )
+
+      for m in ready:
+        result.append( {'name':m, 'files':modules[m]['files'], 'requires':['core'] + sorted( modules[m]['requires'] )} )
+        done.add( m )
+        pending.remove( m )
+
+    # sort the files of each module in dependency order
+    for m in result:
+      m['files'] = sorted( m['files'], key=lambda f: order[f] )
+
+    return result, self.manifest( result, modules )
+
+
+  def moduleName( self, namespace ):
+    '''
+    Return the module name for a split namespace.
+    '''
+    return namespace.split( '.' )[-1]
+
+
+  def reachable( self, namespaces, cut ):
+    '''
+    Return all files reachable from the given namespaces without passing
+    through the cut namespaces.
+    '''
+    visited = set()
+    stack = list( namespaces )
+
+    while stack:
+
+      n = stack.pop()
+
+      f = self.__graph.provider( n )
+      if not f:
+        raise Exception( 'Namespace ' + n + ' is required but never provided.' )
+
+      if f in visited:
+        continue
+
+      visited.add( f )
+
+      stack.extend( [r for r in self.__graph.requires( f ) if r not in cut] )
+
+    return visited
+
+
+  def extensions( self ):
+    '''
+    Return the parser namespace for each file extension in X.loader.
+    '''
+    with open( os.path.join( config.SOFTWARE_PATH, 'io', 'loader.js' ), 'r' ) as f:
+      loader = f.read()
+
+    return dict( self.EXTENSION_REGEX.findall( loader[loader.find( 'X.loader.extensions = {' ):] ) )
+
+
+  def manifest( self, result, modules ):
+    '''
+    Create the manifest which maps file extensions to modules.
+    '''
+    namespaces = dict( [( modules[m]['namespace'], m ) for m in modules] )
+
+    extensions = {}
+    for extension, namespace in self.extensions().iteritems():
+      if namespaces.has_key( namespace ):
+        extensions[extension] = namespaces[namespace]
+
+    prefix = config.SOFTWARE_SHORT.lower() + '-'
+
+    lazy = {}
+    for m in result[1:]:
+      lazy[m['name']] = {'file':prefix + m['name'] + '.js', 'requires':[r for r in m['requires'] if r != 'core']}
+
+    return {'core':prefix + 'core.js', 'modules':lazy, 'extensions':extensions}
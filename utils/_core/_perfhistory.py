@@ -0,0 +1,195 @@
+#
+# The XBUILD performance history.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import math
+import sqlite3
+import subprocess
+import time
+
+import config
+
+#
+#
+#
+class PerfHistory( object ):
+  '''
+  Records the startup time, the FPS and the execution time of the visual
+  tests per test, browser and commit in a local SQLite database and detects
+  regressions.
+
+  The number of browser sessions which ran the tests concurrently is recorded
+  too, since it changes the contention for the CPU and the GPU. Values are
+  only compared with runs which had as many sessions.
+
+  A value is a regression if it is worse than the median of the last runs of
+  other commits (the rolling baseline) by more than
+  config.PERF_REGRESSION_THRESHOLD robust standard deviations (estimated
+  through the median absolute deviation) and by more than
+  config.PERF_REGRESSION_MINIMUM relative to the median.
+  '''
+
+  # the metrics, their columns in the test log and if higher values are better
+  METRICS = [( 'startup', 6, False ), ( 'fps', 7, True ), ( 'execution', 3, False )]
+
+  def __init__( self, path=None ):
+    '''
+    '''
+    if not path:
+      path = config.PERF_HISTORY_PATH
+
+    self.__path = path
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+
+    options
+      [log, browser, sessions] where log is the log of the Tester, only
+      entries with a startup time or FPS are recorded, and sessions is the
+      number of browser sessions which ran the tests concurrently
+
+    Returns the regressions as a list of dictionaries with test, metric,
+    value, baseline (the median) and change (relative to the median).
+    '''
+    log = options[0]
+    browser = options[1]
+    sessions = options[2]
+
+    revision = self.revision()
+    regressions = []
+
+    connection = self.connect()
+
+    try:
+
+      with connection:
+
+        for t in log:
+
+          if t[6] is None and t[7] is None:
+            # no performance test
+            continue
+
+          values = {}
+          for metric, column, higherIsBetter in self.METRICS:
+            values[metric] = self.number( t[column] )
+
+          for metric, column, higherIsBetter in self.METRICS:
+
+            if values[metric] is None:
+              continue
+
+            regression = self.detect( connection, t[0], browser, sessions, revision, metric, values[metric], higherIsBetter )
+            if regression:
+              regressions.append( regression )
+
+          connection.execute( 'INSERT INTO measurements ( time, test, browser, sessions, revision, startup, fps, execution ) VALUES ( ?, ?, ?, ?, ?, ?, ?, ? )', ( time.time(), t[0], browser, sessions, revision, values['startup'], values['fps'], values['execution'] ) )
+
+    finally:
+      connection.close()
+
+    return regressions
+
+
+  def connect( self ):
+    '''
+    Open the database and create the table if necessary.
+    '''
+    connection = sqlite3.connect( self.__path )
+
+    connection.execute( 'CREATE TABLE IF NOT EXISTS measurements ( id INTEGER PRIMARY KEY, time REAL, test TEXT, browser TEXT, sessions INTEGER, revision TEXT, startup REAL, fps REAL, execution REAL )' )
+
+    # older databases have no sessions, their runs never form a baseline
+    columns = [c[1] for c in connection.execute( 'PRAGMA table_info( measurements )' )]
+    if 'sessions' not in columns:
+      connection.execute( 'ALTER TABLE measurements ADD COLUMN sessions INTEGER' )
+
+    connection.execute( 'CREATE INDEX IF NOT EXISTS measurements_test ON measurements ( test, browser, time )' )
+
+    return connection
+
+
+  def revision( self ):
+    '''
+    Return the current git commit or 'unknown'.
+    '''
+    try:
+      process = subprocess.Popen( ['git', 'rev-parse', 'HEAD'], cwd=config.SOFTWARE_PATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+      output = process.communicate()[0].strip()
+    except OSError:
+      # no git
+      return 'unknown'
+
+    if process.returncode != 0 or not output:
+      return 'unknown'
+
+    return output
+
+
+  def number( self, value ):
+    '''
+    Return a value as float or None if it is not a finite number.
+    '''
+    try:
+      value = float( value )
+    except ( TypeError, ValueError ):
+      return None
+
+    if math.isinf( value ) or math.isnan( value ):
+      return None
+
+    return value
+
+
+  def median( self, values ):
+    '''
+    Return the median of a list of values.
+    '''
+    values = sorted( values )
+    middle = len( values ) // 2
+
+    if len( values ) % 2:
+      return values[middle]
+
+    return ( values[middle - 1] + values[middle] ) / 2.0
+
+
+  def detect( self, connection, test, browser, sessions, revision, metric, value, higherIsBetter ):
+    '''
+    Compare a value with the rolling baseline of the runs with the same number
+    of sessions and return a regression or None.
+    '''
+    # metric is one of our column names, never user input
+    rows = connection.execute( 'SELECT ' + metric + ' FROM measurements WHERE test = ? AND browser = ? AND sessions = ? AND revision != ? AND ' + metric + ' IS NOT NULL ORDER BY time DESC LIMIT ?', ( test, browser, sessions, revision, config.PERF_HISTORY_WINDOW ) ).fetchall()
+
+    if len( rows ) < config.PERF_HISTORY_MINIMUM:
+      # not enough history yet
+      return None
+
+    baseline = [r[0] for r in rows]
+
+    median = self.median( baseline )
+    deviation = 1.4826 * self.median( [abs( b - median ) for b in baseline] )
+
+    worse = value - median
+    if higherIsBetter:
+      worse = -worse
+
+    if worse <= 0 or median == 0:
+      return None
+
+    change = worse / abs( median )
+
+    if change <= config.PERF_REGRESSION_MINIMUM:
+      # not relevant
+      return None
+
+    if deviation > 0 and worse / deviation <= config.PERF_REGRESSION_THRESHOLD:
+      # within the usual noise
+      return None
+
+    return {'test':test, 'metric':metric, 'value':value, 'baseline':median, 'change':change}
@@ -4,7 +4,10 @@
 # (c) 2012 The XTK Developers <dev@goXTK.com>
 #
 
+import array
+import base64
 import json
+import math
 import os
 import platform
 import re
@@ -12,19 +15,25 @@ import shutil
 import sys
 import subprocess
 import tempfile
+import threading
 import time
 
 import config
+from _baselinecache import BaselineCache
 from _cdash import CDash
 from _colors import Colors
+from _imagecompare import ImageCompare
 from _jsfilefinder import JSFileFinder
 from _licenser import Licenser
+from _perfhistory import PerfHistory
+from _testselector import TestSelector
 
 # we also need selenium specific stuff
 sys.path.append( config.SELENIUM_PATH )
 import selenium
 from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver import ActionChains
 # and pypng
@@ -38,6 +47,12 @@ class Tester( object ):
   '''
   '''
 
+  # strip html from http://stackoverflow.com/a/4869782/1183453
+  HTML_REGEX = re.compile( '<[^<]+?>' )
+
+  # the coverage is read in chunks of this size
+  COVERAGE_CHUNK = 1024 * 1024
+
   def __init__( self ):
     '''
     '''
@@ -81,7 +96,7 @@ class Tester( object ):
         browser = webdriver.Firefox()
 
     except Exception as e:
-      print 'ERROR: Could not start ' + browserString
+      print 'ERROR: Could not start ' + name
       browser = None
 
     return browser
@@ -102,40 +117,116 @@ class Tester( object ):
     return jsCoverageExecutable
 
 
-  def setupEnvironment( self, name ):
+  def setupEnvironment( self, instrument=True ):
     '''
-    Setup the testing environment. This includes Selenium and the JSCoverage server.
+    Setup the testing environment. This is the JSCoverage server which is
+    shared by all browser sessions.
+
+    Without instrumentation, the server just serves the files.
     '''
 
     # remove all old coverage output
     if os.path.exists( config.JSCOVERAGE_OUTPUT_PATH ):
       shutil.rmtree( config.JSCOVERAGE_OUTPUT_PATH )
 
+    arguments = config.JSCOVERAGE_ARGUMENTS
+    if not instrument:
+      arguments = ' --no-instrument=/' + arguments
+
     # start the jscoverage server
-    os.system( self.getCoverageServer() + config.JSCOVERAGE_ARGUMENTS )
+    os.system( self.getCoverageServer() + arguments )
 
+
+  def teardownEnvironment( self ):
+    '''
+    Tear down the testing environment.
+    '''
+
+    # shutdown coverage server
+    os.system( self.getCoverageServer() + " --shutdown" )
+
+
+  def startBrowser( self, name ):
+    '''
+    Start a browser session.
+    '''
     self.__browser = self.getBrowser( name )
 
+    if not self.__browser:
+      raise Exception( 'Could not start ' + name )
+
     # use a fixed window size
     self.__browser.set_window_size( 800, 600 )
 
 
-  def teardownEnvironment( self, browser ):
+  def stopBrowser( self ):
     '''
-    Tear down the testing environment.
+    Store the coverage results of this browser session and quit it. The
+    coverage server merges the results of all sessions.
     '''
+    if not self.__browser:
+      return
 
-    # save jscoverage results
-    self.__browser.switch_to_window( self.__browser.window_handles[0] )
-    self.__browser.execute_script( 'jscoverage_storeButton_click();' )
+    if self.__jscoverage_loaded:
+      # save jscoverage results
+      self.__browser.switch_to_window( self.__browser.window_handles[0] )
+      messages = self.__browser.execute_script( 'return document.getElementById("storeDiv").childNodes.length;' )
+      self.__browser.execute_script( 'jscoverage_storeButton_click();' )
 
-    time.sleep( 1 )
+      # jscoverage reports in the store div when the results were sent
+      self.waitFor( 'document.getElementById("storeDiv").childNodes.length > ' + str( messages ) )
 
     # quit browser
     self.__browser.quit()
+    self.__browser = None
 
-    # shutdown coverage server
-    os.system( self.getCoverageServer() + " --shutdown" )
+
+  def waitFor( self, condition, script=None, timeout=None ):
+    '''
+    Wait until a condition, a javascript expression, is true in the current
+    browser window. Return False if it did not happen within the timeout.
+
+    The waiting happens in the page: the script (or a script checking the
+    condition every few milliseconds) gets executed asynchronously and has to
+    call its last argument as soon as the page is ready. If this is not
+    possible, f.e. because the page was still loading, the condition is polled
+    from here in growing intervals instead.
+    '''
+    if not timeout:
+      timeout = config.TEST_TIMEOUT
+
+    if not script:
+      script = 'var callback = arguments[arguments.length - 1];'
+      script += '(function check() { if (' + condition + ') { callback(true); } else { setTimeout(check, 10); } })();'
+
+    start_time = time.time()
+
+    try:
+      self.__browser.set_script_timeout( timeout )
+      if self.__browser.execute_async_script( script ):
+        return True
+    except TimeoutException:
+      return False
+    except Exception:
+      # fall back to polling
+      pass
+
+    interval = config.TEST_POLL_INTERVAL[0]
+
+    while True:
+
+      try:
+        if self.__browser.execute_script( 'return !!(' + condition + ');' ):
+          return True
+      except Exception:
+        # f.e. the page is not there yet
+        pass
+
+      if time.time() - start_time > timeout:
+        return False
+
+      time.sleep( interval )
+      interval = min( interval * 2, config.TEST_POLL_INTERVAL[1] )
 
 
   def visit( self, url ):
@@ -170,6 +261,13 @@ class Tester( object ):
     self.__browser.switch_to_window( self.__browser.window_handles[-1] )
 
 
+  def load( self, url ):
+    '''
+    Load an url in the current browser window, without JSCoverage.
+    '''
+    self.__browser.get( 'http://localhost:8080' + url.replace( os.sep, '/' ) )
+
+
   def interact_keyboard( self ):
     '''
     Perform some keyboard interaction in the current active browser window.
@@ -229,7 +327,9 @@ class Tester( object ):
     actions.click( canvas )    
     actions.move_to_element_with_offset( canvas, int(canvas_width)/2, int(canvas_height)/2 )
     actions.perform()
-    time.sleep(3)
+
+    # wait for the caption, but not every object has one
+    self.waitFor( 'document.getElementsByClassName("x-tooltip").length > 0', timeout=config.TEST_HOVER_TIMEOUT )
 
     #
     # rotate, pan, zoom
@@ -260,42 +360,22 @@ class Tester( object ):
     actions.perform()
 
 
-  def compare_images( self, image1, image2 ):
+  def screenshot( self ):
     '''
-    Check if 2 images are identical. Return TRUE if they are, FALSE otherwise.
-    
-    We use RMS comparison.
+    Take a screenshot of the browser and return it as base64 encoded PNG, just
+    like the browser delivers it.
     '''
-    import png
-    i1 = png.Reader( image1 )
-    i2 = png.Reader( image2 )
-
-    import numpy
-    import itertools
-
-    pixelsIterator1 = i1.asRGBA()
-    pixelsIterator2 = i2.asRGBA()
-
-    # make 2d arrays
-    image1 = numpy.vstack( itertools.imap( numpy.uint16, pixelsIterator1[2] ) )
-    image2 = numpy.vstack( itertools.imap( numpy.uint16, pixelsIterator2[2] ) )
-
-    rms1 = numpy.sqrt( numpy.mean( image1 ** 2 ) )
-    rms2 = numpy.sqrt( numpy.mean( image2 ** 2 ) )
+    return self.__browser.get_screenshot_as_base64()
 
-    return numpy.abs( rms1 - rms2 ) <= 0.1
 
-
-  def screenshot( self, testFileId ):
+  def spill( self, testFileId, png ):
     '''
-    Take a screenshot of the browser and return it's filename.
+    Write a PNG to a file in the tmp dir and return it's filename.
     '''
+    fd, tmpfile = tempfile.mkstemp( suffix='.png', prefix='xtk_' + testFileId )
 
-    # create a screenshot file in the tmp dir
-    tmpfile = tempfile.mkstemp( suffix='.png', prefix='xtk_' + testFileId )[1]
-
-    # .. and now capture!!
-    self.__browser.save_screenshot( tmpfile )
+    with os.fdopen( fd, 'wb' ) as f:
+      f.write( png )
 
     return tmpfile
 
@@ -336,11 +416,11 @@ class Tester( object ):
 
       if len( l_arr ) == 5 and l_arr[4] == 'PASSED':
         # this is a passed test
-        log.append( [l_arr[2], 'passed', '', 1, None, None, None, None] )
+        log.append( [l_arr[2], 'passed', '', 1, None, None, None, None, None] )
       elif len( l_arr ) == 5 and l_arr[4] == 'FAILED':
         # this is a failed test
         error_in_test = True
-        log.append( [l_arr[2], 'failed', '', 1, None, None, None, None] )
+        log.append( [l_arr[2], 'failed', '', 1, None, None, None, None, None] )
 
     return log
 
@@ -384,100 +464,128 @@ class Tester( object ):
     print Colors._CLEAR
 
 
-  def parse_coverage( self ):
+  def print_regressions( self, regressions ):
     '''
-    Parse the json output of the coverage server and return a list containing
-    all important information.
-    
-    This is very restrictive and rather doesn't count than counts coverage.
+    Print the performance regressions.
     '''
 
-    # log format:
-    # filepath | lines_tested | lines_untested | percent_covered | lines
-    # lines is a sublist, structured like this
-    #  line_number | count (-1 for ignored) | code
-    log = []
+    if not regressions:
+      return
 
-    with open( os.path.join( config.JSCOVERAGE_OUTPUT_PATH, 'jscoverage.json' ) ) as f:
+    print Colors.RED + 'PERFORMANCE REGRESSIONS:' + Colors._CLEAR
 
-      json_content = json.loads( f.read() )
+    for r in regressions:
+      print Colors.ORANGE + r['test'] + ': ' + Colors._CLEAR + r['metric'] + ' ' + str( round( r['value'], 2 ) ) + ' vs. ' + str( round( r['baseline'], 2 ) ) + Colors.RED + ' (' + str( int( round( r['change'] * 100 ) ) ) + '% worse)' + Colors._CLEAR
 
+    print
 
-    for j in json_content:
 
-      # grab each file and parse the coverage information
-      f = json_content[j]
+  def read_coverage( self, filename ):
+    '''
+    Yield the ( filepath, coverage ) pairs of the json output of the coverage
+    server one by one, without loading the whole document.
+    '''
+    decoder = json.JSONDecoder()
 
-      _lines_tested = 0
-      _lines_untested = 0
-      _percent_coverage = 0
+    with open( filename, 'r' ) as f:
 
-      _lines = f['source']
-      _count = f['coverage']
+      # the unparsed part of the document
+      state = {'buffer':'', 'eof':False}
 
-      lines = []
+      def fill():
+        # read more of the document, returns False at the end
+        if state['eof']:
+          return False
+        chunk = f.read( self.COVERAGE_CHUNK )
+        if not chunk:
+          state['eof'] = True
+          return False
+        state['buffer'] += chunk
+        return True
 
-      # loop through lines
-      for i, l in enumerate( _lines ):
+      def skip():
+        # skip whitespace and return the next character
+        while True:
+          state['buffer'] = state['buffer'].lstrip()
+          if state['buffer'] or not fill():
+            return state['buffer'][:1]
 
-        # strip html from http://stackoverflow.com/a/4869782/1183453
-        l = re.sub( '<[^<]+?>', '', l )
+      def decode():
+        # decode the next json value, reading more until it is complete
+        while True:
+          try:
+            value, end = decoder.raw_decode( state['buffer'] )
+          except ValueError:
+            if not fill():
+              raise
+            continue
+          state['buffer'] = state['buffer'][end:]
+          return value
 
-        # there can be a case were the last line was not counted
-        # when nothing was exported
-        if i > len( _count ) - 1:
-          hits = None
-        else:
-          hits = _count[i]
-
-        if hits == None:
-          # ignored (comment etc.)
-          hits = -1
-        elif hits == 0:
-          # not tested
-          _lines_untested += 1
-        else:
-          # tested
-          _lines_tested += 1
+      if skip() != '{':
+        raise ValueError( 'The coverage of ' + filename + ' is not a json object.' )
+      state['buffer'] = state['buffer'][1:]
 
-        lines.append( [i, hits, l] )
+      while True:
 
-      percent_covered = _lines_tested / ( _lines_tested + _lines_untested )
-      percent_covered = round( percent_covered * 100 )
+        character = skip()
 
-      # now we can attach to the log
-      log.append( [j, _lines_tested, _lines_untested, percent_covered, lines] )
+        if character == '}':
+          return
+        elif character == ',':
+          state['buffer'] = state['buffer'][1:]
+          skip()
 
-    return log
+        filepath = decode()
 
+        if skip() != ':':
+          raise ValueError( 'The coverage of ' + filename + ' is broken.' )
+        state['buffer'] = state['buffer'][1:]
+        skip()
 
-  def run( self, options=None ):
+        yield filepath, decode()
+
+
+  def parse_coverage( self ):
     '''
-    Performs the action.
+    Parse the json output of the coverage server and yield the important
+    information of each file.
+
+    This is very restrictive and rather doesn't count than counts coverage.
     '''
 
-    print 'Testing ' + config.SOFTWARE_SHORT + '...'
+    # log format:
+    # filepath | lines_tested | lines_untested | percent_covered | hits | code
+    # hits is an array with the count of each line (-1 for ignored), code is
+    # the list of the lines
+    for j, f in self.read_coverage( os.path.join( config.JSCOVERAGE_OUTPUT_PATH, 'jscoverage.json' ) ):
 
-    browser = 'chrome'
-    if options.firefox:
-      browser = 'firefox'
+      _lines = f['source']
+      _count = f['coverage']
 
-    # sanity check when testing against the build
-    if options.build:
-      # make sure there is xtk.js
-      if not os.path.exists(config.BUILD_OUTPUT_PATH):
-        print Colors.RED + 'Could not find ' + Colors.ORANGE + 'xtk.js' + Colors.RED + '!'
-        print Colors.RED + 'Make sure to run ' + Colors.CYAN + './build.py' + Colors.RED + ' before!' + Colors._CLEAR
-        sys.exit(2)
+      # there can be a case were the last lines were not counted
+      # when nothing was exported
+      _count = _count[:len( _lines )] + [None] * ( len( _lines ) - len( _count ) )
 
-    # setup environment
-    self.setupEnvironment( browser )
+      hits = array.array( 'i', [c is None and -1 or c for c in _count] )
 
-    #
-    # UNIT TESTS
-    #
+      _lines_tested = sum( 1 for c in hits if c > 0 )
+      _lines_untested = hits.count( 0 )
+
+      # strip the html
+      code = [self.HTML_REGEX.sub( '', l ) for l in _lines]
+
+      percent_covered = 0
+      if _lines_tested + _lines_untested:
+        percent_covered = round( 100.0 * _lines_tested / ( _lines_tested + _lines_untested ) )
+
+      yield [j, _lines_tested, _lines_untested, percent_covered, hits, code]
 
-    # run the unit tests
+
+  def runUnitTests( self, options ):
+    '''
+    Run the unit tests in this browser session and return the log.
+    '''
     if options.build:
       # against the build
       self.visit( config.UNIT_TESTS_BUILD )
@@ -486,85 +594,397 @@ class Tester( object ):
       self.visit( config.UNIT_TESTS )
 
     # wait for unit tests
-    time.sleep( 3 )
+    if not self.waitFor( 'window.G_testRunner && G_testRunner.isFinished()' ):
+      raise Exception( 'The unit tests did not finish within ' + str( config.TEST_TIMEOUT ) + ' seconds.' )
 
     # .. grab the result
     result_unit = self.__browser.execute_script( 'return window.G_testRunner.getReport(true);' )
     # .. and fill our log
-    log = self.parse_unit_results( result_unit )
+    return self.parse_unit_results( result_unit )
+
+
+  def runVisualTest( self, t, browser, options ):
+    '''
+    Run a visual test in this browser session and return its log entry.
+    '''
+    _test = config.VISUAL_TESTS_BASEPATH + t
+
+    testId = os.path.splitext( t )[0]
+    testFileId = testId + '_' + browser
+
+    # clock it
+    start_time = time.time()
+
+    if options.build:
+      # if we test against the build tree, append ?build to the url
+      self.visit( _test + '?build' )
+    else:
+      self.visit( _test )
+
+    # wait until loading fully completed and the first frames were rendered,
+    # the test page signals this
+    ready = 'var callback = arguments[arguments.length - 1];'
+    ready += 'if (window.whenReady) { whenReady(function() { callback(true); }); } else { callback(false); }'
+
+    if not self.waitFor( 'window.test_ready', ready ):
+      raise Exception( 'Loading did not complete within ' + str( config.TEST_TIMEOUT ) + ' seconds.' )
+
+    #
+    # perform some interaction
+
+    # press some keys
+    self.interact_keyboard()
+
+    # compare a screenshot vs. the baseline, the screenshot stays in memory
+    screenshot = self.screenshot()
+    screenshot_png = base64.b64decode( screenshot )
+    baseline_file = self.baseline( testFileId )
+
+    # check if the baseline exists
+    if not os.path.exists(baseline_file):
+      # if not, use the current screenshot
+      with open( baseline_file, 'wb' ) as f:
+        f.write( screenshot_png )
+
+    comparer = ImageCompare()
+    image = comparer.decode( screenshot_png )
+    baseline = BaselineCache().run( [baseline_file] )
+
+    comparison = comparer.run( [image, baseline] )
+
+    # grab the FPS and the startup time
+    fps = self.__browser.execute_script( 'return 1000/frameTime;' )
+    startup_time = self.__browser.execute_script( 'return startup;' )
 
     #
-    # VISUAL TESTS
+    # add log entry
     #
-    if not options.novisual:
+    end_time = time.time()
+    execution_time = end_time - start_time
 
-      for t in config.VISUAL_TESTS:
+    test_result = 'passed'
+    test_log = ''
+    heatmap_file = None
+
+    if not comparison['passed']:
+      # keep the screenshot and the differences on disk for inspection
+      test_result = 'failed'
+      screenshot_file = self.spill( testFileId, screenshot_png )
+      test_log = 'Comparison of ' + screenshot_file + ' and ' + baseline_file + ' failed!\n' + comparison['message']
+
+      if comparison['tile']:
+        heatmap_file = os.path.splitext( screenshot_file )[0] + '_diff.png'
+        comparer.heatmap( image, baseline, comparison['tile'], heatmap_file )
+        test_log += '\nThe differences are shown in ' + heatmap_file + '.'
+
+    # use the mouse but only in chrome (firefox might crash)
+    # this is just to increase testing coverage of interactors
+    if browser == 'chrome':
+      self.interact_mouse()
+
+    return ['Visualization' + testFileId, test_result, test_log, execution_time, screenshot, baseline_file, startup_time, fps, heatmap_file]
+
+
+  def measure( self, t, options ):
+    '''
+    Load a visual test and return its startup time [ms], FPS and used JS heap
+    [bytes]. The heap size is None if the browser does not report it.
+    '''
+    _test = config.VISUAL_TESTS_BASEPATH + t
+
+    if options.build:
+      _test += '?build'
+
+    self.load( _test )
+
+    ready = 'var callback = arguments[arguments.length - 1];'
+    ready += 'if (window.whenReady) { whenReady(function() { callback(true); }); } else { callback(false); }'
+
+    if not self.waitFor( 'window.test_ready', ready ):
+      raise Exception( 'Loading did not complete within ' + str( config.TEST_TIMEOUT ) + ' seconds.' )
+
+    return self.__browser.execute_script( 'return [startup, 1000/frameTime, window.performance && performance.memory ? performance.memory.usedJSHeapSize : null];' )
+
+
+  def statistics( self, samples ):
+    '''
+    Return the median, the 95th percentile, the mean and the 95% confidence
+    interval of the median of some samples.
+
+    The confidence interval is distribution free, it is given by the order
+    statistics around the median.
+    '''
+    samples = sorted( samples )
+    n = len( samples )
+
+    if not n:
+      return None
+
+    middle = n // 2
+    median = samples[middle]
+    if not n % 2:
+      median = ( samples[middle - 1] + samples[middle] ) / 2.0
+
+    # the nearest rank
+    p95 = samples[int( math.ceil( 0.95 * n ) ) - 1]
+
+    # the ranks of the confidence interval, normal approximation of the binomial distribution
+    spread = 1.96 * math.sqrt( n ) / 2
+    lower = max( 0, int( math.floor( n / 2.0 - spread ) ) )
+    upper = min( n - 1, int( math.ceil( n / 2.0 + spread ) ) - 1 )
+
+    return {'samples':samples, 'median':median, 'p95':p95, 'mean':sum( samples ) / float( n ), 'ci':[samples[lower], samples[upper]]}
 
-        _test = config.VISUAL_TESTS_BASEPATH + t
+
+  def runBenchmark( self, browser, options ):
+    '''
+    Load each visual test config.BENCHMARK_RUNS times after
+    config.BENCHMARK_WARMUP discarded runs and write a JSON report with
+    statistics of the startup time, the FPS and the used JS heap.
+
+    The runs happen one after another in one browser session, without
+    coverage instrumentation, so that they do not disturb each other.
+    '''
+    self.setupEnvironment( False )
+
+    report = {'browser':browser, 'build':options.build, 'revision':PerfHistory().revision(), 'runs':config.BENCHMARK_RUNS, 'warmup':config.BENCHMARK_WARMUP, 'tests':{}}
+
+    try:
+
+      self.startBrowser( browser )
+
+      for t in config.VISUAL_TESTS:
 
         testId = os.path.splitext( t )[0]
-        testFileId = testId + '_' + browser
 
-        # clock it
+        samples = {'startup':[], 'fps':[], 'memory':[]}
+
+        for i in range( config.BENCHMARK_WARMUP + config.BENCHMARK_RUNS ):
+
+          startup, fps, memory = self.measure( t, options )
+
+          if i < config.BENCHMARK_WARMUP:
+            continue
+
+          samples['startup'].append( startup )
+          samples['fps'].append( fps )
+          if memory is not None:
+            samples['memory'].append( memory )
+
+        report['tests'][testId] = dict( [( m, self.statistics( samples[m] ) ) for m in samples] )
+
+        startup = report['tests'][testId]['startup']
+        fps = report['tests'][testId]['fps']
+
+        print Colors.ORANGE + testId + ': ' + Colors._CLEAR + 'startup ' + str( startup['median'] ) + ' ms [' + str( startup['ci'][0] ) + ', ' + str( startup['ci'][1] ) + '], FPS ' + str( round( fps['median'], 1 ) ) + ' [' + str( round( fps['ci'][0], 1 ) ) + ', ' + str( round( fps['ci'][1], 1 ) ) + ']'
+
+    finally:
+      self.stopBrowser()
+      self.teardownEnvironment()
+
+    with open( config.BENCHMARK_REPORT_PATH, 'w' ) as f:
+      json.dump( report, f, indent=2 )
+
+    print Colors.ORANGE + 'Benchmark report written to ' + config.BENCHMARK_REPORT_PATH + '.' + Colors._CLEAR
+
+
+  def jobId( self, job, browser ):
+    '''
+    Return a unique identifier for a job, f.e. test_nrrd_chrome.
+    '''
+    if job == 'unit':
+      return 'unit_' + browser
+
+    return os.path.splitext( job )[0] + '_' + browser
+
+
+  def jobName( self, job, browser ):
+    '''
+    Return the name of a job in the log.
+    '''
+    if job == 'unit':
+      return 'Unit' + self.jobId( job, browser )
+
+    return 'Visualization' + self.jobId( job, browser )
+
+
+  def runJobs( self, jobs, browser, options ):
+    '''
+    Run the jobs (the unit tests or visual tests) in a pool of browser
+    sessions and return the merged log in the order of the jobs.
+
+    The jobs are distributed to the sessions longest first, according to
+    their durations in previous runs.
+    '''
+    durations = {}
+    if os.path.exists( config.TEST_DURATIONS_PATH ):
+      try:
+        with open( config.TEST_DURATIONS_PATH, 'r' ) as f:
+          durations = json.load( f )
+      except ValueError:
+        # broken durations are no durations
+        pass
+
+    # jobs which never ran are assumed to take as long as the average job
+    known = [durations[self.jobId( j, browser )] for j in jobs if durations.has_key( self.jobId( j, browser ) )]
+    default = known and sum( known ) / len( known ) or 1.0
+
+    expected = [durations.get( self.jobId( j, browser ), default ) for j in jobs]
+
+    sessions = self.sessions( jobs, options )
+
+    # longest processing time first
+    shards = [[] for i in range( sessions )]
+    load = [0.0] * sessions
+
+    for i in sorted( range( len( jobs ) ), key=lambda i: expected[i], reverse=True ):
+      s = load.index( min( load ) )
+      shards[s].append( i )
+      load[s] += expected[i]
+
+    print Colors.PURPLE + 'Running ' + str( len( jobs ) ) + ' test jobs in ' + str( sessions ) + ' browser sessions.' + Colors._CLEAR
+
+    results = [None] * len( jobs )
+    threads = [threading.Thread( target=self.runShard, args=( [( i, jobs[i] ) for i in shard], browser, options, results ) ) for shard in shards]
+
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    # remember the durations for the next run, the jobs which did not run
+    # through keep their previous estimate
+    for j, r in zip( jobs, results ):
+      if r['time'] is not None:
+        durations[self.jobId( j, browser )] = r['time']
+
+    tmpfile = config.TEST_DURATIONS_PATH + '.tmp'
+
+    with open( tmpfile, 'w' ) as f:
+      json.dump( durations, f )
+
+    os.rename( tmpfile, config.TEST_DURATIONS_PATH )
+
+    log = []
+    for r in results:
+      log.extend( r['log'] )
+
+    return log
+
+
+  def sessions( self, jobs, options ):
+    '''
+    Return the number of browser sessions running the jobs concurrently.
+    '''
+    sessions = config.TEST_SESSIONS
+    if options.parallel:
+      sessions = config.TEST_PARALLEL_SESSIONS
+
+    return max( 1, min( sessions, len( jobs ) ) )
+
+
+  def runShard( self, shard, browser, options, results ):
+    '''
+    Run some jobs in a new browser session. This runs in a thread, the
+    results are stored by the index of each job.
+    '''
+    # each session is driven by its own tester
+    tester = Tester()
+
+    try:
+      tester.startBrowser( browser )
+    except Exception as e:
+      for i, job in shard:
+        results[i] = {'log':[[self.jobName( job, browser ), 'failed', str( e ), 0, None, None, None, None, None]], 'time':None}
+      return
+
+    try:
+
+      for i, job in shard:
+
         start_time = time.time()
 
-        if options.build:
-          # if we test against the build tree, append ?build to the url
-          self.visit( _test + '?build' )
-        else:
-          self.visit( _test )
-
-        # wait until loading fully completed
-        timer = 0
-        while not self.__browser.execute_script( 'return test_renderer.loadingCompleted' ) and timer < 5:
-          time.sleep( 1 ) # loading did not complete yet
-          timer += 1
-        time.sleep( 1 )
-
-        #
-        # perform some interaction
-
-        # press some keys
-        self.interact_keyboard()
-
-        # compare a screenshot vs. the baseline
-        screenshot_file = self.screenshot( testFileId )
-        baseline_file = self.baseline( testFileId )
-        
-        # check if the baseline exists
-        if not os.path.exists(baseline_file):
-          # if not, copy the current screnshot over
-          shutil.copy(screenshot_file, baseline_file);
-        
-        result_image = self.compare_images( screenshot_file, baseline_file )
-
-        # grab the FPS and the startup time
-        fps = self.__browser.execute_script( 'return 1000/frameTime;' )
-        startup_time = self.__browser.execute_script( 'return startup;' )
-
-        #
-        # add log entry
-        #
-        end_time = time.time()
-        execution_time = end_time - start_time
-
-        test_result = 'failed'
-        test_log = 'Comparison of ' + screenshot_file + ' and ' + baseline_file + ' failed!'
-
-        if result_image:
-          # this means the test passed
-          test_result = 'passed'
-          test_log = ''
-
-        log.append( ['Visualization' + testFileId, test_result, test_log, execution_time, screenshot_file, baseline_file, startup_time, fps] )
-
-        # use the mouse but only in chrome (firefox might crash)
-        # this is just to increase testing coverage of interactors
-        if browser == 'chrome':
-          self.interact_mouse()
+        try:
+          if job == 'unit':
+            log = tester.runUnitTests( options )
+          else:
+            log = [tester.runVisualTest( job, browser, options )]
+          job_time = time.time() - start_time
+        except Exception as e:
+          # this job failed but the others can go on, its duration says
+          # nothing about the next run
+          job_time = None
+          log = [[self.jobName( job, browser ), 'failed', str( e ), time.time() - start_time, None, None, None, None, None]]
+
+        results[i] = {'log':log, 'time':job_time}
+
+    finally:
+      tester.stopBrowser()
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+    '''
+
+    print 'Testing ' + config.SOFTWARE_SHORT + '...'
+
+    browser = 'chrome'
+    if options.firefox:
+      browser = 'firefox'
+
+    # sanity check when testing against the build
+    if options.build:
+      # make sure there is xtk.js
+      if not os.path.exists(config.BUILD_OUTPUT_PATH):
+        print Colors.RED + 'Could not find ' + Colors.ORANGE + 'xtk.js' + Colors.RED + '!'
+        print Colors.RED + 'Make sure to run ' + Colors.CYAN + './build.py' + Colors.RED + ' before!' + Colors._CLEAR
+        sys.exit(2)
+
+    if options.benchmark:
+      # only measure the performance
+      self.runBenchmark( browser, options )
+      return
+
+    # setup environment
+    self.setupEnvironment()
+
+    # the unit tests and the visual tests
+    jobs = ['unit']
+    if not options.novisual:
+      jobs.extend( config.VISUAL_TESTS )
+
+    # maybe only the ones affected by changes
+    selector = None
+    if options.changed:
+      selector = TestSelector()
+      jobs = selector.run( [jobs, options.build] )
+
+      if not jobs:
+        self.teardownEnvironment()
+        print Colors.ORANGE + 'Testing done, nothing to test.' + Colors._CLEAR
+        return
+
+    # run them concurrently
+    log = self.runJobs( jobs, browser, options )
 
     # teardown environment
-    self.teardownEnvironment( browser )
+    self.teardownEnvironment()
+
+    # record the performance, the dev tree and the build are tracked separately
+    # and the runs are only compared with the ones which had the same number
+    # of concurrent sessions
+    history = browser
+    if options.build:
+      history += '_build'
+
+    regressions = PerfHistory().run( [log, history, self.sessions( jobs, options )] )
+
+    # .. and mention regressions in the test log
+    for r in regressions:
+      for t in log:
+        if t[0] == r['test']:
+          t[2] += '\nPerformance regression: ' + r['metric'] + ' ' + str( round( r['value'], 2 ) ) + ' vs. ' + str( round( r['baseline'], 2 ) ) + ' in previous runs.'
 
     # print the results in verbose mode
     if options.verbose:
@@ -572,32 +992,26 @@ class Tester( object ):
 
     # but always print the summary
     self.print_summary( log )
+    self.print_regressions( regressions )
 
-    # parse the coverage analysis
-    coverage_log = self.parse_coverage()
+    # the next selection can start from here
+    if selector and not [t for t in log if t[1] == 'failed']:
+      selector.remember()
 
-    # now we create a dashboard submission file
+    # now we create a dashboard submission file, it is streamed to disk
     cdasher = CDash()
-    xmlfile = cdasher.run( ['Testing', log, options.build] )
-
-    with open( os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Test.xml' ), 'w' ) as f:
-      f.write( xmlfile )
+    cdasher.run( ['Testing', log, options.build, os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Test.xml' )] )
 
-    # .. and two coverage submission files, but only in dev mode
+    # .. and two coverage submission files, but only in dev mode, the coverage
+    # analysis is parsed for each of them, one file at a time
 
     if not options.build:
       # first is the summary
       cdasher = CDash()
-      xmlfile = cdasher.run( ['Coverage', coverage_log, options.build] )
-  
-      with open( os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Coverage.xml' ), 'w' ) as f:
-        f.write( xmlfile )
-  
+      cdasher.run( ['Coverage', self.parse_coverage(), options.build, os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Coverage.xml' )] )
+
       # second is the log for each LOC
       cdasher = CDash()
-      xmlfile = cdasher.run( ['CoverageLog', coverage_log, options.build] )
-  
-      with open( os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_CoverageLog.xml' ), 'w' ) as f:
-        f.write( xmlfile )
+      cdasher.run( ['CoverageLog', self.parse_coverage(), options.build, os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_CoverageLog.xml' )] )
 
     print Colors.ORANGE + 'Testing done.' + Colors._CLEAR
@@ -0,0 +1,260 @@
+#
+# The XBUILD test selector.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+
+import config
+from _colors import Colors
+from _depscanner import DepsScanner
+from _jsfilefinder import JSFileFinder
+from _modulesplitter import ModuleSplitter
+
+#
+#
+#
+class TestSelector( object ):
+  '''
+  Selects the test jobs which are affected by changes.
+
+  Each test page depends on the files it includes, the files these require
+  through the goog.require graph and the data files the tests load. The
+  parsers are not required by the loader in this graph but by the tests
+  which load files with their extensions, otherwise every test would depend
+  on every parser.
+
+  The changes are taken from git, relative to config.TEST_SELECTION_BASE. If
+  git is not available, the files are compared to their digests from the
+  last successful selected run instead.
+  '''
+
+  # the includes of a page and the files loaded by a test
+  INCLUDE_REGEX = re.compile( r'(?:src|href)\s*=\s*["\']([^"\']+)["\']' )
+  DATA_REGEX = re.compile( r'["\'](data/[^"\']+)["\']' )
+
+  def __init__( self ):
+    '''
+    '''
+    self.__files = {}
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+
+    options
+      [jobs, build] where jobs are the test jobs ('unit' or the filename of a
+      visual test) and build is True if the tests run against the build
+
+    Returns the affected jobs.
+    '''
+    jobs = options[0]
+    build = options[1]
+
+    graph = DepsScanner().run( [JSFileFinder().run( ['ALL'] )] )
+
+    # the files of each job
+    self.__files = {}
+    for j in jobs:
+
+      if j == 'unit':
+        page = build and config.UNIT_TESTS_BUILD or config.UNIT_TESTS
+        self.__files[j] = self.pageFiles( page, graph )
+      else:
+        self.__files[j] = self.pageFiles( config.VISUAL_TESTS_BASEPATH + j, graph )
+
+        # the baselines belong to a visual test as well
+        baselines = os.path.join( config.VISUAL_BASELINES_PATH, os.path.splitext( j )[0] + '_' )
+        self.__files[j].update( [os.path.join( config.VISUAL_BASELINES_PATH, b ) for b in os.listdir( config.VISUAL_BASELINES_PATH ) if os.path.join( config.VISUAL_BASELINES_PATH, b ).startswith( baselines )] )
+
+    changes = self.changes()
+
+    if changes is None:
+      print Colors.YELLOW + 'Could not determine the changes, running all tests.' + Colors._CLEAR
+      return list( jobs )
+
+    # changes to the testing infrastructure affect everything
+    filefinder = JSFileFinder()
+    everything = filefinder.compile( config.TEST_SELECTION_ALL )
+
+    for c in changes:
+      if filefinder.matches( c, everything ):
+        print Colors.PURPLE + 'Running all tests because of ' + os.path.relpath( c, config.SOFTWARE_PATH ) + '.' + Colors._CLEAR
+        return list( jobs )
+
+    selected = [j for j in jobs if self.__files[j] & changes]
+
+    print Colors.PURPLE + 'Selected ' + str( len( selected ) ) + ' of ' + str( len( jobs ) ) + ' test jobs affected by ' + str( len( changes ) ) + ' changed files: ' + ( ', '.join( selected ) or 'none' ) + Colors._CLEAR
+
+    return selected
+
+
+  def pageFiles( self, page, graph ):
+    '''
+    Return all files a test page depends on.
+    '''
+    page = os.path.normpath( config.SOFTWARE_PATH + page )
+    directory = os.path.dirname( page )
+
+    with open( page, 'r' ) as f:
+      content = f.read()
+
+    includes = set( [os.path.normpath( os.path.join( directory, i.split( '?' )[0] ) ) for i in self.INCLUDE_REGEX.findall( content )] )
+    files = set( [page] ) | includes
+
+    # the data files loaded by the scripts of the page
+    data = set()
+    for i in includes:
+      if i.endswith( '.js' ) and os.path.isfile( i ):
+        with open( i, 'r' ) as f:
+          data.update( self.DATA_REGEX.findall( f.read() ) )
+
+    files.update( [os.path.normpath( os.path.join( directory, d ) ) for d in data] )
+
+    # the parsers for these files
+    extensions = ModuleSplitter().extensions()
+    parsers = set()
+    for d in data:
+
+      # the same as X.loader.checkFileFormat
+      extension = d.split( '.' )[-1].upper()
+      if extension == d.upper():
+        extension = ''
+
+      if extensions.has_key( extension ) and graph.provider( extensions[extension] ):
+        parsers.add( graph.provider( extensions[extension] ) )
+
+    # follow the goog.require graph, but only enter the parsers we need
+    cut = self.parsers( graph, extensions ) - parsers
+
+    known = set( graph.files() )
+    roots = [f for f in includes | parsers if f in known]
+    files.update( roots )
+    files.update( graph.dependencies( roots, cut ) )
+
+    return files
+
+
+  def parsers( self, graph, extensions ):
+    '''
+    Return the files of all parsers which are loaded by file extension.
+    '''
+    return set( [graph.provider( n ) for n in extensions.values() if graph.provider( n )] )
+
+
+  def changes( self ):
+    '''
+    Return the changed files, this uses git or the digests of the last run.
+    Returns None if the changes are unknown.
+    '''
+    changes = self.gitChanges()
+
+    if changes is None:
+      changes = self.digestChanges()
+
+    return changes
+
+
+  def git( self, arguments ):
+    '''
+    Run git in the project root and return the output lines or None if this
+    failed.
+    '''
+    try:
+      process = subprocess.Popen( ['git'] + arguments, cwd=config.SOFTWARE_PATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+      output = process.communicate()[0]
+    except OSError:
+      # no git
+      return None
+
+    if process.returncode != 0:
+      return None
+
+    return [l for l in output.splitlines() if l]
+
+
+  def gitChanges( self ):
+    '''
+    Return the files which changed since the merge base with
+    config.TEST_SELECTION_BASE, including uncommitted and untracked files.
+    '''
+    base = self.git( ['merge-base', 'HEAD', config.TEST_SELECTION_BASE] )
+    if not base:
+      return None
+
+    changed = self.git( ['diff', '--name-only', '--relative', base[0]] )
+    untracked = self.git( ['ls-files', '--others', '--exclude-standard'] )
+
+    if changed is None or untracked is None:
+      return None
+
+    return set( [os.path.normpath( os.path.join( config.SOFTWARE_PATH, c ) ) for c in changed + untracked] )
+
+
+  def digest( self, filename ):
+    '''
+    Return the digest of a file or None if it does not exist.
+    '''
+    if not os.path.isfile( filename ):
+      return None
+
+    with open( filename, 'rb' ) as f:
+      return hashlib.sha1( f.read() ).hexdigest()
+
+
+  def digestChanges( self ):
+    '''
+    Return the files which changed since the last successful run.
+    '''
+    if not os.path.isfile( config.TEST_SELECTION_DIGESTS_PATH ):
+      return None
+
+    try:
+      with open( config.TEST_SELECTION_DIGESTS_PATH, 'r' ) as f:
+        digests = json.load( f )
+    except ValueError:
+      # a broken snapshot is no snapshot
+      return None
+
+    if digests.get( 'root' ) != config.SOFTWARE_PATH:
+      return None
+
+    files = set()
+    for j in self.__files:
+      files.update( self.__files[j] )
+
+    return set( [f for f in files if digests['files'].get( f ) != self.digest( f )] )
+
+
+  def remember( self ):
+    '''
+    Remember the digests of all files of the jobs, this should be
+    called after a successful run.
+    '''
+    digests = {}
+
+    if os.path.isfile( config.TEST_SELECTION_DIGESTS_PATH ):
+      try:
+        with open( config.TEST_SELECTION_DIGESTS_PATH, 'r' ) as f:
+          previous = json.load( f )
+        if previous.get( 'root' ) == config.SOFTWARE_PATH:
+          digests = previous['files']
+      except ValueError:
+        pass
+
+    for j in self.__files:
+      for f in self.__files[j]:
+        digests[f] = self.digest( f )
+
+    tmpfile = config.TEST_SELECTION_DIGESTS_PATH + '.tmp'
+
+    with open( tmpfile, 'w' ) as f:
+      json.dump( {'root':config.SOFTWARE_PATH, 'files':digests}, f )
+
+    os.rename( tmpfile, config.TEST_SELECTION_DIGESTS_PATH )
@@ -4,9 +4,13 @@
 # (c) 2012 The XTK Developers <dev@goXTK.com>
 #
 
+import httplib
 import os
-import sys
-import subprocess
+import shutil
+import socket
+import threading
+import time
+import Queue
 
 import config
 from _cdash import CDash
@@ -17,11 +21,25 @@ from _colors import Colors
 #
 class Uploader( object ):
   '''
+  Uploads the submission files to CDash.
+
+  The files are sent concurrently, each worker keeps its connection alive for
+  the next file. Failed submissions are retried with an increasing delay and
+  if they still fail, they are moved to the spool and sent again with the
+  next upload.
   '''
 
+  # the submission files in the order of the dashboard
+  REPORTS = [( 'Build Report', '_Build.xml' ),
+             ( 'Testing Report', '_Test.xml' ),
+             ( 'Coverage Summary', '_Coverage.xml' ),
+             ( 'Coverage Log', '_CoverageLog.xml' )]
+
   def run( self, options=None ):
     '''
     Performs the action.
+
+    Returns True if everything was uploaded.
     '''
 
     print 'Uploading results for ' + config.SOFTWARE_SHORT + '...'
@@ -33,100 +51,150 @@ class Uploader( object ):
     elif options.nightly:
       submissiontype = 'Nightly'
 
+    # the submissions which failed last time go first
+    # [name, filename, type, spooled]
+    jobs = self.spooled()
 
-    # now we create a dashboard submission file
-    cdasher = CDash()
+    if jobs:
+      print Colors.ORANGE + 'Found ' + str( len( jobs ) ) + ' spooled submissions!' + Colors._CLEAR
+
+    for name, suffix in self.REPORTS:
+
+      print Colors.CYAN + 'Loading ' + name + '..' + Colors._CLEAR
+      report = os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + suffix )
+
+      if os.path.isfile( report ):
+        # found a report
+        print Colors.ORANGE + 'Found ' + name + '!' + Colors._CLEAR
+        jobs.append( [name, report, submissiontype, False] )
+      else:
+        # not found
+        print Colors.ORANGE + 'Not Found!' + Colors._CLEAR
+
+    if not jobs:
+      return True
+
+    results = self.upload( jobs, options.gzip )
+
+    success = True
+
+    for j, error in zip( jobs, results ):
+
+      name, filename, type, spooled = j
+
+      if not error:
+        print Colors.ORANGE + '..Successfully uploaded ' + name + ' as ' + Colors.CYAN + type + Colors.ORANGE + '.' + Colors._CLEAR
+
+        # delete the old report
+        os.unlink( filename )
+        continue
+
+      success = False
+
+      print Colors.RED + 'Error: Could not upload ' + name + ' to CDash: ' + error + Colors._CLEAR
 
-    #
-    # build
-    #
-    print Colors.CYAN + 'Loading Build Report..' + Colors._CLEAR
-    buildReport = os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Build.xml' )
+      if not spooled:
+        self.spool( filename, type )
+        print Colors.YELLOW + '..Spooled, it will be uploaded again next time.' + Colors._CLEAR
 
-    if os.path.isfile( buildReport ):
-      # found a build report
-      print Colors.ORANGE + 'Found Build Report!' + Colors._CLEAR
+    return success
 
-      with open( buildReport, 'r' ) as f:
-        cdasher.submit( f.read(), submissiontype )
 
-      print Colors.ORANGE + '..Successfully uploaded as ' + Colors.CYAN + submissiontype + Colors.ORANGE + '.' + Colors._CLEAR
+  def upload( self, jobs, compress=False ):
+    '''
+    Upload the jobs concurrently.
+
+    Returns an error message for each job or None if it was uploaded.
+    '''
+    queue = Queue.Queue()
+    for i, j in enumerate( jobs ):
+      queue.put( ( i, j ) )
+
+    results = [None] * len( jobs )
+
+    workers = max( 1, min( config.UPLOAD_CONNECTIONS, len( jobs ) ) )
+    threads = [threading.Thread( target=self.work, args=( queue, results, compress ) ) for i in range( workers )]
+
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    return results
+
 
-    else:
-      # not found
-      print Colors.ORANGE + 'Not Found!' + Colors._CLEAR
-      buildReport = None
+  def work( self, queue, results, compress ):
+    '''
+    Upload jobs from the queue until it is empty. This runs in a thread with
+    its own connection.
+    '''
+    cdasher = CDash()
+    connection = None
+
+    while True:
 
-    #
-    # test
-    #
-    print Colors.CYAN + 'Loading Testing Report..' + Colors._CLEAR
-    testReport = os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Test.xml' )
+      try:
+        i, j = queue.get_nowait()
+      except Queue.Empty:
+        break
 
-    if os.path.isfile( testReport ):
-      # found a build report
-      print Colors.ORANGE + 'Found Testing Report!' + Colors._CLEAR
+      filename = j[1]
+      type = j[2]
 
-      with open( testReport, 'r' ) as f:
-        cdasher.submit( f.read(), submissiontype )
+      for attempt in range( config.UPLOAD_RETRIES + 1 ):
 
-      print Colors.ORANGE + '..Successfully uploaded as ' + Colors.CYAN + submissiontype + Colors.ORANGE + '.' + Colors._CLEAR
+        if attempt:
+          # back off before trying again
+          time.sleep( config.UPLOAD_BACKOFF * 2 ** ( attempt - 1 ) )
 
-    else:
-      # not found
-      print Colors.ORANGE + 'Not Found!' + Colors._CLEAR
-      testReport = None
+        try:
 
-    #
-    # coverage summary
-    # 
-    print Colors.CYAN + 'Loading Coverage Summary..' + Colors._CLEAR
-    coverageReport = os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_Coverage.xml' )
+          if not connection:
+            connection = cdasher.connection()
 
-    if os.path.isfile( coverageReport ):
-      # found a build report
-      print Colors.ORANGE + 'Found Coverage Summary!' + Colors._CLEAR
+          if cdasher.submit( filename, type, connection, compress ):
+            results[i] = None
+            break
 
-      with open( coverageReport, 'r' ) as f:
-        cdasher.submit( f.read(), submissiontype )
+          results[i] = 'the submission was rejected'
 
-      print Colors.ORANGE + '..Successfully uploaded as ' + Colors.CYAN + submissiontype + Colors.ORANGE + '.' + Colors._CLEAR
+        except ( socket.error, httplib.HTTPException ) as e:
+          # start over with a new connection
+          if connection:
+            connection.close()
+          connection = None
 
-    else:
-      # not found
-      print Colors.ORANGE + 'Not Found!' + Colors._CLEAR
-      coverageReport = None
+          results[i] = str( e ) or e.__class__.__name__
 
-    #
-    # coverage log
-    # 
-    print Colors.CYAN + 'Loading Coverage Log..' + Colors._CLEAR
-    coverageLog = os.path.join( config.TEMP_PATH, config.SOFTWARE_SHORT + '_CoverageLog.xml' )
+    if connection:
+      connection.close()
 
-    if os.path.isfile( coverageLog ):
-      # found a build report
-      print Colors.ORANGE + 'Found Coverage Log!' + Colors._CLEAR
 
-      with open( coverageLog, 'r' ) as f:
-        cdasher.submit( f.read(), submissiontype )
+  def spooled( self ):
+    '''
+    Return the jobs for the submissions in the spool.
+    '''
+    if not os.path.isdir( config.UPLOAD_SPOOL_PATH ):
+      return []
 
-      print Colors.ORANGE + '..Successfully uploaded as ' + Colors.CYAN + submissiontype + Colors.ORANGE + '.' + Colors._CLEAR
+    jobs = []
 
-    else:
-      # not found
-      print Colors.ORANGE + 'Not Found!' + Colors._CLEAR
-      coverageLog = None
+    for f in sorted( os.listdir( config.UPLOAD_SPOOL_PATH ) ):
+      # <time>_<type>_<report>
+      type = f.split( '_' )[1]
+      jobs.append( ['Spooled ' + f.split( '_', 2 )[2], os.path.join( config.UPLOAD_SPOOL_PATH, f ), type, True] )
 
+    return jobs
 
-    # delete old reports
-    if buildReport:
-      os.unlink( buildReport )
 
-    if testReport:
-      os.unlink( testReport )
+  def spool( self, filename, type ):
+    '''
+    Move a submission to the spool, the name keeps the submission type and the
+    order.
+    '''
+    if not os.path.isdir( config.UPLOAD_SPOOL_PATH ):
+      os.makedirs( config.UPLOAD_SPOOL_PATH )
 
-    if coverageReport:
-      os.unlink( coverageReport )
+    name = '%.6f' % time.time() + '_' + type + '_' + os.path.basename( filename )
 
-    if coverageLog:
-      os.unlink( coverageLog )
+    shutil.move( filename, os.path.join( config.UPLOAD_SPOOL_PATH, name ) )
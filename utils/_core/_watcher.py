@@ -0,0 +1,265 @@
+#
+# The XBUILD file watcher.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+import config
+from _colors import Colors
+from _jsfilefinder import JSFileFinder
+
+#
+#
+#
+class Watcher( object ):
+  '''
+  Watches the .js files of the project and reports changes.
+
+  On Linux, inotify is used to wait for changes. Everywhere else, the stat
+  data of the files is polled. Bursts of changes, f.e. when switching
+  branches, are reported at once.
+  '''
+
+  # the inotify events we are interested in
+  IN_MODIFY = 0x00000002
+  IN_ATTRIB = 0x00000004
+  IN_CLOSE_WRITE = 0x00000008
+  IN_MOVED_FROM = 0x00000040
+  IN_MOVED_TO = 0x00000080
+  IN_CREATE = 0x00000100
+  IN_DELETE = 0x00000200
+  IN_DELETE_SELF = 0x00000400
+  IN_EVENTS = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+  def __init__( self ):
+    '''
+    '''
+    self.__libc = None
+    self.__inotify = None
+    self.__watches = {}
+
+    self.__snapshot = {}
+
+
+  def run( self, options=None ):
+    '''
+    Performs the action.
+
+    options
+      [callback] which gets the list of changed, added and removed files
+
+    Runs until interrupted.
+    '''
+    callback = options[0]
+
+    self.startInotify()
+
+    files = self.files()
+    self.__snapshot = self.snapshot( files )
+    self.watch( files )
+
+    mode = 'polling'
+    if self.__inotify is not None:
+      mode = 'inotify'
+
+    print Colors.ORANGE + 'Watching ' + str( len( files ) ) + ' files for changes (' + mode + '), press Ctrl+C to stop.' + Colors._CLEAR
+
+    try:
+
+      while True:
+
+        self.wait()
+
+        # compare with the last snapshot, this also catches new and removed files
+        files = self.files()
+        snapshot = self.snapshot( files )
+
+        changed = [f for f in set( snapshot.keys() + self.__snapshot.keys() ) if snapshot.get( f ) != self.__snapshot.get( f )]
+
+        self.__snapshot = snapshot
+        self.watch( files )
+
+        if not changed:
+          continue
+
+        print
+        print Colors.PURPLE + 'Changed: ' + ', '.join( sorted( [os.path.relpath( f, config.SOFTWARE_PATH ) for f in changed] ) ) + Colors._CLEAR
+
+        callback( sorted( changed ) )
+
+    except KeyboardInterrupt:
+      print
+
+    finally:
+      self.stopInotify()
+
+    print Colors.ORANGE + 'Stopped watching.' + Colors._CLEAR
+
+
+  def files( self ):
+    '''
+    Return all files to watch.
+    '''
+    filefinder = JSFileFinder()
+
+    # the tree might have changed
+    filefinder.invalidate()
+
+    return filefinder.run( ['USE_INCLUDES'] )
+
+
+  def snapshot( self, files ):
+    '''
+    Return the stat data of the given files.
+    '''
+    snapshot = {}
+
+    for f in files:
+
+      try:
+        st = os.stat( f )
+      except OSError:
+        # removed in the meantime
+        continue
+
+      snapshot[f] = ( st.st_mtime, st.st_size )
+
+    return snapshot
+
+
+  def directories( self, files ):
+    '''
+    Return all directories which can contain files to watch. These are all
+    directories which are not excluded plus all directories of files which
+    are explicitly included.
+    '''
+    directories = set( [config.SOFTWARE_PATH] )
+
+    for f in files:
+
+      d = os.path.dirname( f )
+
+      while d not in directories and d.startswith( config.SOFTWARE_PATH ):
+        directories.add( d )
+        d = os.path.dirname( d )
+
+    filefinder = JSFileFinder()
+    excludes = filefinder.compile( config.EXCLUDES_PATH )
+
+    for dirpath, dirnames, filenames in os.walk( config.SOFTWARE_PATH ):
+
+      dirnames[:] = [d for d in dirnames if not d.startswith( '.' ) and ( os.path.join( dirpath, d ) in directories or not filefinder.matches( os.path.join( dirpath, d ), excludes ) )]
+
+      directories.add( dirpath )
+
+    return directories
+
+
+  def startInotify( self ):
+    '''
+    Setup inotify, if available.
+    '''
+    library = ctypes.util.find_library( 'c' )
+    if not library:
+      return
+
+    try:
+      libc = ctypes.CDLL( library, use_errno=True )
+    except OSError:
+      return
+
+    if not hasattr( libc, 'inotify_init' ):
+      # not on Linux
+      return
+
+    fd = libc.inotify_init()
+    if fd < 0:
+      return
+
+    self.__libc = libc
+    self.__inotify = fd
+
+
+  def stopInotify( self ):
+    '''
+    Shutdown inotify.
+    '''
+    if self.__inotify is None:
+      return
+
+    os.close( self.__inotify )
+    self.__inotify = None
+    self.__watches = {}
+
+
+  def watch( self, files ):
+    '''
+    Make sure all directories which can contain the files are watched.
+    '''
+    if self.__inotify is None:
+      return
+
+    for d in self.directories( files ):
+
+      if self.__watches.has_key( d ):
+        continue
+
+      wd = self.__libc.inotify_add_watch( self.__inotify, d, self.IN_EVENTS )
+
+      if wd < 0:
+        # f.e. too many watches, we can still poll
+        print Colors.YELLOW + 'Could not watch ' + d + ', falling back to polling.' + Colors._CLEAR
+        self.stopInotify()
+        return
+
+      self.__watches[d] = wd
+
+
+  def events( self, timeout ):
+    '''
+    Wait for inotify events and consume them. Returns False if nothing
+    happened within the timeout.
+    '''
+    ready = select.select( [self.__inotify], [], [], timeout )[0]
+    if not ready:
+      return False
+
+    # the details do not matter since we compare snapshots anyways
+    os.read( self.__inotify, 65536 )
+
+    return True
+
+
+  def wait( self ):
+    '''
+    Block until something changed and it calmed down again.
+    '''
+    if self.__inotify is not None:
+
+      self.events( None )
+
+      # debounce
+      while self.events( config.WATCH_DEBOUNCE ):
+        pass
+
+      return
+
+    # poll
+    current = self.__snapshot
+    while current == self.__snapshot:
+      time.sleep( config.WATCH_POLL_INTERVAL )
+      current = self.snapshot( self.files() )
+
+    # debounce
+    while True:
+      time.sleep( config.WATCH_DEBOUNCE )
+      latest = self.snapshot( self.files() )
+      if latest == current:
+        break
+      current = latest
@@ -0,0 +1,129 @@
+#
+# The XBUILD streaming XML writer.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import base64
+
+#
+#
+#
+class XMLWriter( object ):
+  '''
+  Writes XML to a file-like object while it is generated, so documents of
+  any size need constant memory.
+
+  The output is the same as minidom's toxml(): attributes are sorted by name,
+  text and attributes are escaped the same way and empty elements are
+  closed right away.
+  '''
+
+  # the base64 encoded files are read in chunks of this size, a multiple of 3
+  # so that the encoded chunks can be concatenated
+  BASE64_CHUNK = 3 * 64 * 1024
+
+  def __init__( self, f ):
+    '''
+    '''
+    self.__file = f
+    self.__stack = []
+
+    # True if the start tag of the current element is not closed yet
+    self.__pending = False
+
+
+  def escape( self, value ):
+    '''
+    Escape a value for text and attributes.
+    '''
+    if isinstance( value, unicode ):
+      value = value.encode( 'utf-8' )
+    else:
+      value = str( value )
+
+    return value.replace( '&', '&amp;' ).replace( '<', '&lt;' ).replace( '"', '&quot;' ).replace( '>', '&gt;' )
+
+
+  def declaration( self ):
+    '''
+    Write the XML declaration.
+    '''
+    self.__file.write( '<?xml version="1.0" ?>' )
+
+
+  def content( self ):
+    '''
+    Close the start tag of the current element since it has content.
+    '''
+    if self.__pending:
+      self.__file.write( '>' )
+      self.__pending = False
+
+
+  def attributes( self, attributes ):
+    '''
+    Return the attributes of a start tag.
+    '''
+    if not attributes:
+      return ''
+
+    return ''.join( [' ' + a + '="' + self.escape( attributes[a] ) + '"' for a in sorted( attributes )] )
+
+
+  def start( self, name, attributes=None ):
+    '''
+    Start an element.
+    '''
+    self.content()
+
+    self.__file.write( '<' + name + self.attributes( attributes ) )
+
+    self.__stack.append( name )
+    self.__pending = True
+
+
+  def end( self ):
+    '''
+    End the current element.
+    '''
+    name = self.__stack.pop()
+
+    if self.__pending:
+      self.__file.write( '/>' )
+      self.__pending = False
+    else:
+      self.__file.write( '</' + name + '>' )
+
+
+  def text( self, value ):
+    '''
+    Write text to the current element.
+    '''
+    self.content()
+    self.__file.write( self.escape( value ) )
+
+
+  def element( self, name, value, attributes=None ):
+    '''
+    Write an element containing only text.
+    '''
+    self.content()
+
+    # in one go, this is called a lot
+    self.__file.write( '<' + name + self.attributes( attributes ) + '>' + self.escape( value ) + '</' + name + '>' )
+
+
+  def base64( self, filename ):
+    '''
+    Write the content of a file base64 encoded to the current element.
+    '''
+    self.content()
+
+    with open( filename, 'rb' ) as f:
+
+      while True:
+        chunk = f.read( self.BASE64_CHUNK )
+        if not chunk:
+          break
+        self.__file.write( base64.b64encode( chunk ) )
@@ -4,6 +4,7 @@
 # (c) 2012 The XTK Developers <dev@goXTK.com>
 #
 
+import multiprocessing
 import os
 import sys
 import tempfile
@@ -57,12 +58,20 @@ LICENSE_HEADER = '''/*
 
 
 # PATHS
-EXCLUDES_PATH = ['lib', 'testing', 'deps', 'utils']
+EXCLUDES_PATH = ['lib', 'testing', '*-deps.js', 'utils'] # shell-style patterns, matched against each path component
 INCLUDES_PATH = ['csg', 'zlib.js']  # force inclusion of sub folders in an excluded directory for dependency generation
 
 REPOSITORY_URL = 'https://github.com/xtk/X/blob/master/'
 
+COMPILER_SERVER_ADDRESS = ( 'localhost', 8642 )
+NAILGUN_ADDRESS = ( 'localhost', 2113 )
+
 CDASH_SUBMIT_URL = 'http://x.babymri.org/cdash/submit.php?project=' + SOFTWARE_SHORT
+UPLOAD_CONNECTIONS = 4 # number of submissions sent concurrently, each through its own kept-alive connection
+UPLOAD_RETRIES = 3 # number of retries of a failed submission
+UPLOAD_BACKOFF = 2 # seconds before the first retry, doubled for each further one
+UPLOAD_TIMEOUT = 60 # seconds to wait for the server before a submission fails
+UPLOAD_SPOOL_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_spool/' ) ) # failed submissions wait here for the next upload
 
 XBUILD_PATH = os.path.abspath( os.path.dirname( sys.argv[0] ) )
 SOFTWARE_PATH = os.path.normpath( XBUILD_PATH + os.sep + '..' + os.sep )
@@ -74,6 +83,7 @@ CLOSUREBUILDER_PATH = os.path.normpath( os.path.join( CLOSURELIBRARY_PYTHON_PATH
 CLOSUREDEPSWRITER_PATH = os.path.normpath( os.path.join( CLOSURELIBRARY_PYTHON_PATH, 'depswriter.py' ) )
 CLOSURECOMPILER_PATH = os.path.normpath( os.path.join( SOFTWARE_PATH, 'lib/google-closure-compiler/compiler.jar' ) )
 CLOSUREGOOGBASE_PATH = os.path.normpath( os.path.join( CLOSURELIBRARY_PATH, 'goog/base.js' ) )
+NAILGUN_PATH = os.path.normpath( os.path.join( SOFTWARE_PATH, 'lib/nailgun/nailgun.jar' ) ) # optional, keeps the compiler JVM warm
 
 DOC_TEMPLATES_PATH = os.path.normpath( os.path.join( XBUILD_PATH, '_core', 'templates/' ) )
 
@@ -81,12 +91,56 @@ BUILD_OUTPUT_PATH = os.path.normpath( os.path.join( XBUILD_PATH , SOFTWARE_SHORT
 DEPS_OUTPUT_PATH = os.path.normpath( os.path.join( SOFTWARE_PATH , SOFTWARE_SHORT.lower() + '-deps.js' ) )
 DOC_OUTPUT_PATH = os.path.normpath( os.path.join( SOFTWARE_PATH , 'doc/' ) )
 
+# the variants of the build matrix (./build.py -m), the first one is reported to the dashboard
+#  name | output file | additional compiler flags | additional defines | entry point namespaces (all files if empty)
+BUILD_VARIANTS = [
+  {'name':'release', 'output':BUILD_OUTPUT_PATH, 'flags':[], 'defines':[], 'namespaces':[]},
+  {'name':'debug', 'output':os.path.normpath( os.path.join( XBUILD_PATH , SOFTWARE_SHORT.lower() + '-debug.js' ) ), 'flags':['--debug', '--formatting=PRETTY_PRINT'], 'defines':[], 'namespaces':[]}
+  ]
+
+# namespaces which are split into lazily loadable modules (./build.py -s), every namespace with one of these prefixes gets its own module
+BUILD_MODULES_SPLIT = ['X.parser']
+BUILD_MODULES_OUTPUT_PATH = os.path.normpath( os.path.join( XBUILD_PATH , SOFTWARE_SHORT.lower() + '-modules/' ) )
+
+JSFILES_INDEX_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_files.json' ) )
+DEPS_CACHE_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_deps.json' ) )
+DOC_CACHE_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_doc.json' ) )
+
+BUILD_CACHE_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_cache/' ) )
+BUILD_CACHE_SIZE = 10 # number of compiled files to keep in the build cache
+
+WATCH_DEBOUNCE = 0.3 # seconds without changes before a burst of changes is processed (-w)
+WATCH_POLL_INTERVAL = 0.5 # seconds between checks if inotify is not available
+
 UNIT_TESTS = os.path.normpath( os.sep + 'testing' + os.sep + SOFTWARE_SHORT.lower() + '_tests.html' )
 UNIT_TESTS_BUILD = os.path.normpath( os.sep + 'testing' + os.sep + SOFTWARE_SHORT.lower() + '_tests_build.html' )
 VISUAL_TESTS_BASEPATH = os.sep + 'testing' + os.sep + 'visualization' + os.sep
 VISUAL_TESTS = ['test_image.html', 'test_binstl.html', 'test_mgh.html', 'test_nii.html', 'test_fsm_crv.html', 'test_fsm_label.html', 'test_dcm.html', 'test_shapes.html', 'test_trk.html', 'test_vtk.html', 'test_labelmap.html', 'test_mgz.html', 'test_nrrd.html', 'test_stl.html', 'test_vr.html', 'test_obj.html']
 
 VISUAL_BASELINES_PATH = os.path.normpath( os.path.join( SOFTWARE_PATH, 'testing/visualization/baselines/' ) )
+BASELINE_CACHE_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_baselines/' ) )
+BASELINE_CACHE_SIZE = 1000 # number of decoded baselines to keep
+PERF_HISTORY_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_perf.sqlite' ) )
+PERF_HISTORY_WINDOW = 20 # number of previous runs forming the baseline of a test
+PERF_HISTORY_MINIMUM = 5 # number of previous runs before regressions are detected
+PERF_REGRESSION_THRESHOLD = 3.0 # robust standard deviations a value has to be worse than the baseline
+PERF_REGRESSION_MINIMUM = 0.1 # relative change a value has to be worse than the baseline
+TEST_SELECTION_BASE = 'master' # the changes relative to this branch select the tests (./test.py -ch)
+TEST_SELECTION_ALL = ['utils', 'jscoverage', 'selenium', 'pypng-*'] # changes below these paths select all tests
+TEST_SELECTION_DIGESTS_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_test_digests.json' ) )
+BENCHMARK_RUNS = 10 # number of measured runs of each visual test (./test.py -bm)
+BENCHMARK_WARMUP = 2 # number of runs before, which are not measured
+BENCHMARK_REPORT_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), SOFTWARE_SHORT + '_Benchmark.json' ) )
+IMAGE_PIXEL_TOLERANCE = 16 # maximum difference of a color channel before a pixel counts as different
+IMAGE_TILE_SIZE = 32 # the images are compared in tiles of this size
+IMAGE_TILE_THRESHOLD = 0.02 # maximum fraction of different pixels in a tile
+IMAGE_SSIM_THRESHOLD = 0.9 # minimum structural similarity of a tile
+TEST_DURATIONS_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_test_durations.json' ) )
+TEST_SESSIONS = 1 # number of browser sessions running tests concurrently, more would measure the startup time and FPS under contention
+TEST_PARALLEL_SESSIONS = multiprocessing.cpu_count() # number of browser sessions with ./test.py -p
+TEST_TIMEOUT = 30 # seconds to wait for a test page to be ready
+TEST_HOVER_TIMEOUT = 1 # seconds to wait for a caption, the interactor fires the hover after 300 ms
+TEST_POLL_INTERVAL = ( 0.01, 0.25 ) # first and maximum interval in seconds if a test page can not signal readiness
 JSCOVERAGE_PATH = os.path.normpath( os.path.join( SOFTWARE_PATH, 'lib/jscoverage/' ) )
 JSCOVERAGE_OUTPUT_PATH = os.path.normpath( os.path.join( tempfile.gettempdir(), 'xbuild_coverage/' ) )
 JSCOVERAGE_ARGUMENTS = " --report-dir=" + JSCOVERAGE_OUTPUT_PATH + " --document-root=" + SOFTWARE_PATH + " --no-instrument=/lib/ --no-instrument=/testing/ --no-instrument=/utils/ --no-instrument=/core/testing/ --no-instrument=/math/testing/ --no-instrument=xtk-deps.js &"
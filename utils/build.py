@@ -19,6 +19,18 @@ if __name__ == "__main__":
   # add debug flag
   entrypoint.add( 'd', 'debug', 'enable debug mode during compilation' )
 
+  # add matrix flag
+  entrypoint.add( 'm', 'matrix', 'build all variants of the build matrix concurrently' )
+
+  # add split flag
+  entrypoint.add( 's', 'split', 'build a core and lazily loadable modules for the parsers' )
+
+  # add cache flag
+  entrypoint.add( 'nc', 'nocache', 'ignore the build cache and always compile' )
+
+  # add watch flag
+  entrypoint.add( 'w', 'watch', 'watch for changes and rebuild incrementally' )
+
   options = entrypoint.parse( sys.argv )
 
   builder = Builder()
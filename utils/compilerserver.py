@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+#
+# The XBUILD compiler server.
+#
+# (c) 2012 The XTK Developers <dev@goXTK.com>
+#
+
+import sys
+from _core import *
+
+
+#
+# entry point
+#
+if __name__ == "__main__":
+  entrypoint = Entrypoint( description='Run a persistent compiler server for builds of ' + SOFTWARE_SHORT + '.' )
+
+  # add stop flag
+  entrypoint.add( 's', 'stop', 'stop a running compiler server' )
+
+  options = entrypoint.parse( sys.argv )
+
+  compilerserver = CompilerServer()
+  compilerserver.run( options )
+
@@ -15,6 +15,10 @@ from _core import *
 #
 if __name__ == "__main__":
   entrypoint = Entrypoint( description='Generate dependencies of ' + SOFTWARE_SHORT + '.' )
+
+  # add watch flag
+  entrypoint.add( 'w', 'watch', 'watch for changes and regenerate the dependencies if needed' )
+
   options = entrypoint.parse( sys.argv )
 
   depsgenerator = DepsGenerator()
@@ -19,6 +19,9 @@ if __name__ == "__main__":
   # add debug flag
   entrypoint.add( 'r', 'remove', 'remove any existing documentation' )
 
+  # add watch flag
+  entrypoint.add( 'w', 'watch', 'watch for changes and re-document incrementally' )
+
   options = entrypoint.parse( sys.argv )
 
   documenter = Documenter()
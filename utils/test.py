@@ -21,6 +21,9 @@ if __name__ == "__main__":
   entrypoint.add( 'f', 'firefox', 'test using the Firefox browser', False )
   entrypoint.add( 'b', 'build', 'test against the built', False )
   entrypoint.add( 'nv', 'novisual', 'skip visual testing', False )
+  entrypoint.add( 'ch', 'changed', 'only run the tests affected by the changes since ' + TEST_SELECTION_BASE, False )
+  entrypoint.add( 'p', 'parallel', 'run the tests in ' + str( TEST_PARALLEL_SESSIONS ) + ' concurrent browser sessions, faster but the startup times and FPS are measured under contention', False )
+  entrypoint.add( 'bm', 'benchmark', 'measure the performance of the visual tests in repeated runs', False )
 
   options = entrypoint.parse( sys.argv )
 
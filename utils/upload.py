@@ -21,8 +21,13 @@ if __name__ == "__main__":
   entrypoint.add( 'c', 'continuous', 'continuous submission', False )
   entrypoint.add( 'n', 'nightly', 'nightly submission', False )
 
+  # add compression flag
+  entrypoint.add( 'z', 'gzip', 'compress the submissions, the server has to accept gzip encoded requests', False )
+
   options = entrypoint.parse( sys.argv )
 
   uploader = Uploader()
-  uploader.run( options )
+  if not uploader.run( options ):
+    # the failed submissions are spooled, but the run failed
+    sys.exit( 2 )
 